@@ -15,6 +15,18 @@ import chainlit as cl
 
 from utilities.tools import generate_image, review_image, research, write_content
 from utilities.chainlit_helpers import ChainlitAssistantAgent, ChainlitUserProxyAgent
+from utilities.agents import AgentTemplate, instantiate
+from utilities.warmup import WARM_START, prewarm
+from utilities.speaker_selection import SelectiveGroupChat, get_speaker_selector
+from utilities.workflow import WORKFLOW_MODE, Stage, Workflow, classify_task
+from utilities.dispatch import PARALLEL_TOOLS, ParallelDispatcher
+from utilities.knowledge import retrieve_content
+from utilities.artifacts import get_artifact_store
+from utilities.context import context_report
+from utilities.completion_cache import LLM_CACHE, install_completion_cache, get_completion_cache
+from utilities.tracing import TracePanel, trace, install_llm_tracing
+from utilities.conversation_log import install_conversation_log
+from utilities.ui_stream import start_ui_stream, post, drain
 
 # Load environment variables
 load_dotenv()
@@ -59,6 +71,17 @@ gpt4_config = {
     "request_timeout": GLOBAL_TIMEOUT,
 }
 
+# Heavy dependencies are imported on first use, WARM_START=1 imports them in the background right away
+if WARM_START:
+    prewarm()
+
+# Identical model calls are answered from disk, LLM_CACHE=replay runs a recorded session offline
+install_completion_cache()
+# Model call spans see the cache hits, so tracing wraps the cache
+install_llm_tracing()
+# Every model call is appended to a per-session JSONL log in the background, records are tagged with the traced agent
+install_conversation_log()
+
 # openai_ef = embedding_functions.OpenAIEmbeddingFunction(
 #                 api_key=os.getenv("OPENAI_API_KEY"),
 #                 model_name="text-embedding-ada-002"
@@ -66,6 +89,354 @@ gpt4_config = {
 
 # chroma_client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_HTTP_PORT)
 
+# Agent templates are built once per process, sessions only get cheap instances holding their conversation
+RESEARCH_FUNCTION = {
+    "name": "research",
+    "description": "Research about a given topic, return the research material including reference links. Long reports come back as an artifact:// handle with a preview",
+    "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "The topic to be researched about",
+                }
+            },
+        "required": ["query"],
+    },
+}
+
+KNOWLEDGE_FUNCTION = {
+    "name": "retrieve_content",
+    "description": "Retrieve mental health content for question answering",
+    "parameters": {
+            "type": "object",
+            "properties": {
+                "message": {
+                    "type": "string",
+                    "description": "Refined message which keeps the original meaning and can be used to retrieve content for question answering.",
+                },
+                "n_results": {
+                    "type": "integer",
+                    "description": "Number of passages to retrieve, 3 by default",
+                }
+            },
+        "required": ["message"],
+    },
+}
+
+WRITE_FUNCTION = {
+    "name": "write_content",
+    "description": "Write content based on the given research material & topic",
+    "parameters": {
+            "type": "object",
+            "properties": {
+                "research_material": {
+                    "type": "string",
+                    "description": "Research material of a given topic, including reference links when available. Pass the artifact:// handle returned by research as it is",
+                },
+                "topic": {
+                    "type": "string",
+                    "description": "The topic of the content",
+                }
+            },
+        "required": ["research_material", "topic"],
+    },
+}
+
+LLM_CONFIG_ASSISTANTS = {
+    "functions": [
+        {
+            "name": "generate_image",
+            "description": "Utilize the most recent AI model to create an image using a given prompt and provide the file path to the generated image.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "A detailed textual prompt that provides a description of the image to be generated.",
+                    }
+                },
+                "required": ["prompt"],
+            },
+        },
+        {
+            "name": "image_review",
+            "description": "Examine and assess the image created by AI according to the initial prompt, offering feedback and recommendations for enhancement.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "The original input text that served as the prompt for generating the image.",
+                    },
+                    "image_path": {
+                        "type": "string",
+                        "description": "The complete file path for the image, including both the directory path and the file extension.",
+                    }
+                },
+                "required": ["prompt", "image_path"],
+            },
+        },
+    ],
+    "config_list": config_list,
+    "request_timeout": GLOBAL_TIMEOUT
+}
+
+# Retrieval runs locally against the chroma/ knowledge base, see utilities/knowledge.py
+DOMAIN_EXPERT_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Domain_Expert",
+    system_message=f'''You are the domain knowledge expert of Calm Collective. 
+    You are able to retrieve deep knowledge aboout mental health and the community with the retrieve_content function.
+    You assist by providing more information for the user task when it comes to mental health in Asia.
+    Only answer from the retrieved content and name the sources you used.
+    ''',
+    llm_config = {
+        "functions": [KNOWLEDGE_FUNCTION],
+        "config_list": config_list,
+        "temperature": 0,
+        "retry_wait_time": 30,
+        "request_timeout": GLOBAL_TIMEOUT,
+    },
+    max_consecutive_auto_reply=3,
+    function_map={
+        "retrieve_content": retrieve_content,
+    }
+)
+
+PROJECT_MANAGER_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Project_Manager",
+    system_message=f'''
+    You are the Project Manager. 
+    Be concise and avoid pleasantries. Your primary responsibility is to oversee the entire project lifecycle, ensuring that all agents are effectively fulfilling their objectives and tasks on time.
+    Based on the directives from the user task, coordinate with all involved agents, set clear milestones, and monitor progress. 
+    Ensure that user feedback is promptly incorporated, and any adjustments are made in real-time to align with the project's goals.
+    Act as the central point of communication, facilitating collaboration between teams and ensuring that all deliverables are of the highest quality. 
+    Your expertise is crucial in ensuring that the project stays on track, meets deadlines, and achieves its objectives.
+    Regularly review the project's status, address any challenges, and ensure that all stakeholders are kept informed of the project's progress.
+    ''',
+    llm_config = llm_config,
+)
+
+# CREATIVE_DIRECTOR_TEMPLATE = AgentTemplate(
+#     ChainlitAssistantAgent,
+#     name="Creative_Director",
+#     system_message=f'''
+#     You are the Creative Director. Be concise and avoid pleasantries. Your primary role is to guide the creative vision of the project, ensuring that all ideas are not only unique and compelling but also meet the highest standards of excellence and desirability.
+#     Drawing from the insights of user task, oversee the creative process, inspire innovation, and set the bar for what's possible.
+#     Review all creative outputs, provide constructive feedback, and ensure that every piece aligns with the brand's identity and resonates with the target audience. 
+#     Collaborate closely with all teams, fostering a culture of excellence, and ensuring that our creative solutions are both groundbreaking and aligned with the project's objectives.
+#     ''',
+#     llm_config = llm_config,
+# )
+
+# CONTENT_STRATEGIST_TEMPLATE = AgentTemplate(
+#     ChainlitAssistantAgent,
+#     name="Content_Strategist",
+#     llm_config=llm_config_content_assistant,
+#     system_message=f'''
+#     You are the Lead Strategist.
+#     Your primary responsibility is to draft content briefs that effectively position our client's brand in the market.
+#     Based on the information provided for the user task, your task is to craft a comprehensive content brief that outlines the content strategy of our client.
+#     The brief should delve deep into the brand's unique value proposition, target audience, and competitive landscape. 
+#     It should also provide clear directives on how the brand should be perceived and the emotions it should evoke.
+#     Once you've drafted the brief, it will be reviewed and iterated upon based on feedback from the client and our internal team. 
+#     Ensure that the brief is both insightful and actionable, setting a clear path for the brand's journey ahead.
+#     Collaborate with the Content Researcher to ensure that the content brief is grounded in solid research and insights.
+#     Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
+#     ''',
+#     function_map={
+#         "research": research
+#     }
+# )
+
+CONTENT_RESEARCHER_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Content_Researcher",
+    system_message=f'''
+    You are the Lead Researcher. 
+    You must use the research function to provide a topic for the Copywriter in order to get up to date information outside of your knowledge cutoff.
+    Your primary responsibility is to delve deep into understanding the challenges around mental health.
+    Using the information from the user task, conduct thorough research to uncover insights related to the task.
+    Share your research findings with the Project Manager to provide insight into the task.
+    Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
+    ''',
+    llm_config = {
+        "functions": [RESEARCH_FUNCTION],
+        "config_list": config_list,
+        "temperature": 0,
+        "retry_wait_time": 30,
+        "request_timeout": GLOBAL_TIMEOUT,
+    },
+    function_map={
+        "research": research,
+    }
+)
+
+# CONTENT_WRITER_TEMPLATE = AgentTemplate(
+#     ChainlitAssistantAgent,
+#     name="Content_Copywriter",
+#     system_message=f'''
+#     You are the Lead Copywriter.
+#     Your primary role is to craft compelling narratives and messages that align with the organisation's vision to break the stigma of mental health in Asia, so that people can get the help they need.
+#     Based on the research gathered from the Content Researcher, create engaging content, from catchy headlines to in-depth articles.
+#     Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
+#     ''',
+#     llm_config = {
+#         "functions": [WRITE_FUNCTION],
+#         "config_list": config_list,
+#         "temperature": 0,
+#         "retry_wait_time": 30,
+#         "request_timeout": GLOBAL_TIMEOUT,
+#     },
+#     function_map={
+#         "write_content": write_content
+#     }
+# )
+
+COPYWRITER_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Copywriter",
+    system_message=f'''You are a Copywriter, you can use research function to collect latest information about a given topic, 
+    and then use write_content function to write a very well written content;
+    Reply TERMINATE when your task is done
+    Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
+    ''',
+    llm_config = {
+        "functions": [RESEARCH_FUNCTION, WRITE_FUNCTION],
+        "config_list": config_list,
+        "temperature": 0,
+        "retry_wait_time": 30,
+        "request_timeout": GLOBAL_TIMEOUT,
+    },
+    function_map={
+        "research": research,
+        "write_content": write_content
+    }
+)
+
+GRAPHIC_DESIGNER_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Graphic_Designer",
+    system_message=f'''As an expert in text-to-image AI models, you will utilize the 'generate_image' function to create an image based on the given prompt and iterate on the prompt. 
+    Incorporating feedback from the Art Director until it achieves a perfect rating of 10/10.''',
+    llm_config=LLM_CONFIG_ASSISTANTS,
+    function_map={
+        "image_review": review_image,
+        "generate_image": generate_image
+    }
+)
+
+ART_DIRECTOR_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Art_Director",
+    system_message=f'''You are the Art Director. 
+    As an AI image critic, your task is to employ the 'image_review' function to evaluate the image generated by the Graphic Designer using the original prompt. 
+    You will then offer feedback on how to enhance the prompt for better image generation.''',
+    llm_config=LLM_CONFIG_ASSISTANTS,
+    function_map={
+        "image_review": review_image,
+        "generate_image": generate_image
+    }
+)
+
+USER_PROXY_TEMPLATE = AgentTemplate(
+    ChainlitUserProxyAgent,
+    name="User_Proxy",
+    human_input_mode="TERMINATE",
+    function_map={
+        "research": research,
+        "retrieve_content": retrieve_content,
+        "write_content": write_content,
+        "image_review": review_image,
+        "generate_image": generate_image
+    }
+)
+
+AGENT_TEMPLATES = {
+    USER_PROXY_NAME: USER_PROXY_TEMPLATE,
+    PROJECT_MANAGER: PROJECT_MANAGER_TEMPLATE,
+    DOMAIN_EXPERT: DOMAIN_EXPERT_TEMPLATE,
+    # CREATIVE_DIRECTOR: CREATIVE_DIRECTOR_TEMPLATE,
+    CONTENT_RESEARCHER: CONTENT_RESEARCHER_TEMPLATE,
+    COPYWRITER: COPYWRITER_TEMPLATE,
+    GRAPHIC_DESIGNER: GRAPHIC_DESIGNER_TEMPLATE,
+    ART_DIRECTOR: ART_DIRECTOR_TEMPLATE,
+}
+
+IMAGE_BRIEF_CHARS = 2000
+
+# Workflow stages work on fresh agent instances, so independent stages can run side by side
+def design_image(topic, research_material=""):
+    user_proxy = USER_PROXY_TEMPLATE.instance()
+    designers = SelectiveGroupChat(
+        agents=[user_proxy, GRAPHIC_DESIGNER_TEMPLATE.instance(), ART_DIRECTOR_TEMPLATE.instance()],
+        messages=[],
+        max_round=12,
+        speaker_selector=get_speaker_selector(),
+    )
+    manager = autogen.GroupChatManager(groupchat=designers, llm_config=gpt4_config)
+    brief = f"Create an image for: {topic}"
+    research_material = get_artifact_store().resolve(research_material)
+    if research_material:
+        brief += f"\n\nKey points from the research:\n{research_material[:IMAGE_BRIEF_CHARS]}"
+    user_proxy.initiate_chat(manager, message=brief)
+
+    images = [message["content"] for message in designers.messages if message.get("role") == "function" and message.get("name") == "generate_image"]
+    feedback = [message["content"] for message in designers.messages if message.get("name") == "Art_Director" and message.get("content")]
+    if not images:
+        return "No image was generated."
+    return images[-1] + (f"\n\nArt Director: {feedback[-1]}" if feedback else "")
+
+def review_deliverables(task, blog="", image=""):
+    project_manager = PROJECT_MANAGER_TEMPLATE.instance()
+    # The review is a single reply to the admin, reply functions that look at the sender see who asked
+    user_proxy = USER_PROXY_TEMPLATE.instance()
+    deliverables = "\n\n".join(part for part in (f"Blog:\n{blog}" if blog else "", f"Image:\n{image}" if image else "") if part)
+    reply = project_manager.generate_reply(messages=[{
+        "role": "user",
+        "name": user_proxy.name,
+        "content": f"Review the deliverables for the task: {task}\n\n{deliverables}\n\nSay what is done and what needs another pass.",
+    }], sender=user_proxy)
+    return reply if isinstance(reply, str) else (reply or {}).get("content", "")
+
+def research_topic(topic):
+    return research(topic)
+
+# Task type -> stages, see utilities/workflow.py. Unknown task types fall back to the group chat.
+WORKFLOWS = {
+    "content_with_image": Workflow("content_with_image", [
+        Stage("research_material", research_topic, inputs=["topic"]),
+        Stage("blog", write_content, inputs=["research_material", "topic"]),
+        Stage("image", design_image, inputs=["topic", "research_material"]),
+        Stage("review", review_deliverables, inputs=["task", "blog", "image"]),
+    ]),
+    "content": Workflow("content", [
+        Stage("research_material", research_topic, inputs=["topic"]),
+        Stage("blog", write_content, inputs=["research_material", "topic"]),
+        Stage("review", review_deliverables, inputs=["task", "blog"]),
+    ]),
+    "image": Workflow("image", [
+        Stage("image", design_image, inputs=["topic"]),
+        Stage("review", review_deliverables, inputs=["task", "image"]),
+    ]),
+}
+
+def show_background_result(name, content):
+    post(f'** Response from calling function "{name}" in the background ** \n\n{content}', "User_Proxy")
+
+async def run_workflow(workflow, task):
+    await cl.Message(content=f"Running the {workflow.name} workflow on task: {task}...").send()
+
+    def progress(text):
+        post(f"*{text}*", "Workflow")
+
+    results, timings = await cl.make_async(workflow.run)({"task": task, "topic": task}, progress=progress)
+    print("Workflow stages: ", ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+    await drain()
+    await cl.Message(content=results["review"], author="Project_Manager").send()
+
 @cl.oauth_callback
 def oauth_callback(
   provider_id: str,
@@ -78,273 +449,9 @@ def oauth_callback(
 @cl.on_chat_start
 async def on_chat_start():
     try:
-        research_function = {
-            "name": "research",
-            "description": "Research about a given topic, return the research material including reference links",
-            "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "The topic to be researched about",
-                        }
-                    },
-                "required": ["query"],
-            },
-        }
-
-        # knowledge_function = {
-        #     "name": "retrieve_content",
-        #     "description": "Retrieve mental health content for question answering",
-        #     "parameters": {
-        #             "type": "object",
-        #             "properties": {
-        #                 "message": {
-        #                     "type": "string",
-        #                     "description": "Refined message which keeps the original meaning and can be used to retrieve content for question answering.",
-        #                 }
-        #             },
-        #         "required": ["message"],
-        #     },
-        # }
-
-        write_function = {
-            "name": "write_content",
-            "description": "Write content based on the given research material & topic",
-            "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "research_material": {
-                            "type": "string",
-                            "description": "Research material of a given topic, including reference links when available",
-                        },
-                        "topic": {
-                            "type": "string",
-                            "description": "The topic of the content",
-                        }
-                    },
-                "required": ["research_material", "topic"],
-            },
-        }
-
-        llm_config_assistants = {
-            "functions": [
-                {
-                    "name": "generate_image",
-                    "description": "Utilize the most recent AI model to create an image using a given prompt and provide the file path to the generated image.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "A detailed textual prompt that provides a description of the image to be generated.",
-                            }
-                        },
-                        "required": ["prompt"],
-                    },
-                },
-                {
-                    "name": "image_review",
-                    "description": "Examine and assess the image created by AI according to the initial prompt, offering feedback and recommendations for enhancement.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "The original input text that served as the prompt for generating the image.",
-                            },
-                            "image_path": {
-                                "type": "string",
-                                "description": "The complete file path for the image, including both the directory path and the file extension.",
-                            }
-                        },
-                        "required": ["prompt", "image_path"],
-                    },
-                },
-            ],
-            "config_list": config_list,
-            "request_timeout": GLOBAL_TIMEOUT
-        }
-
-        # domain_expert = RetrieveUserProxyAgent(
-        #     name="Domain_Expert",
-        #     human_input_mode="NEVER",
-        #     system_message=f'''You are the domain knowledge expert of Calm Collective. 
-        #     You are able to retrieve deep knowledge aboout mental health and the community.
-        #     You assist by providing more information for the user task when it comes to mental health in Asia.
-        #     ''',
-        #     max_consecutive_auto_reply=3,
-        #     retrieve_config={
-        #         "task": "qa",
-        #         "chunk_token_size": 1000,
-        #         "model": config_list[0]["model"],
-        #         "client": chromadb.PersistentClient(path="./chroma"),
-        #         "collection_name": "langchain",
-        #         "get_or_create": True,
-        #         "embedding_function": openai_ef,
-        #     },
-        #     code_execution_config=False,
-        # )
-
-        # def retrieve_content(message, n_results=3):
-        #     domain_expert.n_results = n_results  # Set the number of results to be retrieved.
-        #     # Check if we need to update the context.
-        #     update_context_case1, update_context_case2 = domain_expert._check_update_context(message)
-        #     if (update_context_case1 or update_context_case2) and domain_expert.update_context:
-        #         domain_expert.problem = message if not hasattr(domain_expert, "problem") else domain_expert.problem
-        #         _, ret_msg = domain_expert._generate_retrieve_user_reply(message)
-        #     else:
-        #         ret_msg = domain_expert.generate_init_message(message, n_results=n_results)
-        #     return ret_msg if ret_msg else message
-
-        project_manager = ChainlitAssistantAgent(
-            name="Project_Manager",
-            system_message=f'''
-            You are the Project Manager. 
-            Be concise and avoid pleasantries. Your primary responsibility is to oversee the entire project lifecycle, ensuring that all agents are effectively fulfilling their objectives and tasks on time.
-            Based on the directives from the user task, coordinate with all involved agents, set clear milestones, and monitor progress. 
-            Ensure that user feedback is promptly incorporated, and any adjustments are made in real-time to align with the project's goals.
-            Act as the central point of communication, facilitating collaboration between teams and ensuring that all deliverables are of the highest quality. 
-            Your expertise is crucial in ensuring that the project stays on track, meets deadlines, and achieves its objectives.
-            Regularly review the project's status, address any challenges, and ensure that all stakeholders are kept informed of the project's progress.
-            ''',
-            llm_config = llm_config,
-        )
-
-        # creative_director = ChainlitAssistantAgent(
-        #     name="Creative_Director",
-        #     system_message=f'''
-        #     You are the Creative Director. Be concise and avoid pleasantries. Your primary role is to guide the creative vision of the project, ensuring that all ideas are not only unique and compelling but also meet the highest standards of excellence and desirability.
-        #     Drawing from the insights of user task, oversee the creative process, inspire innovation, and set the bar for what's possible.
-        #     Review all creative outputs, provide constructive feedback, and ensure that every piece aligns with the brand's identity and resonates with the target audience. 
-        #     Collaborate closely with all teams, fostering a culture of excellence, and ensuring that our creative solutions are both groundbreaking and aligned with the project's objectives.
-        #     ''',
-        #     llm_config = llm_config,
-        # )
-
-        # content_strategist = ChainlitAssistantAgent(
-        #     name="Content_Strategist",
-        #     llm_config=llm_config_content_assistant,
-        #     system_message=f'''
-        #     You are the Lead Strategist.
-        #     Your primary responsibility is to draft content briefs that effectively position our client's brand in the market.
-        #     Based on the information provided for the user task, your task is to craft a comprehensive content brief that outlines the content strategy of our client.
-        #     The brief should delve deep into the brand's unique value proposition, target audience, and competitive landscape. 
-        #     It should also provide clear directives on how the brand should be perceived and the emotions it should evoke.
-        #     Once you've drafted the brief, it will be reviewed and iterated upon based on feedback from the client and our internal team. 
-        #     Ensure that the brief is both insightful and actionable, setting a clear path for the brand's journey ahead.
-        #     Collaborate with the Content Researcher to ensure that the content brief is grounded in solid research and insights.
-        #     Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
-        #     ''',
-        #     function_map={
-        #         "research": research
-        #     }
-        # )
-
-        content_researcher = ChainlitAssistantAgent(
-            name="Content_Researcher",
-            system_message=f'''
-            You are the Lead Researcher. 
-            You must use the research function to provide a topic for the Copywriter in order to get up to date information outside of your knowledge cutoff.
-            Your primary responsibility is to delve deep into understanding the challenges around mental health.
-            Using the information from the user task, conduct thorough research to uncover insights related to the task.
-            Share your research findings with the Project Manager to provide insight into the task.
-            Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
-            ''',
-            llm_config = {
-                "functions": [research_function],
-                "config_list": config_list,
-                "temperature": 0,
-                "retry_wait_time": 30,
-                "request_timeout": GLOBAL_TIMEOUT,
-            },
-            function_map={
-                "research": research,
-            }
-        )
-
-        # content_writer = ChainlitAssistantAgent(
-        #     name="Content_Copywriter",
-        #     system_message=f'''
-        #     You are the Lead Copywriter.
-        #     Your primary role is to craft compelling narratives and messages that align with the organisation's vision to break the stigma of mental health in Asia, so that people can get the help they need.
-        #     Based on the research gathered from the Content Researcher, create engaging content, from catchy headlines to in-depth articles.
-        #     Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
-        #     ''',
-        #     llm_config = {
-        #         "functions": [write_function],
-        #         "config_list": config_list,
-        #         "temperature": 0,
-        #         "retry_wait_time": 30,
-        #         "request_timeout": GLOBAL_TIMEOUT,
-        #     },
-        #     function_map={
-        #         "write_content": write_content
-        #     }
-        # )
-
-        copywriter = ChainlitAssistantAgent(
-            name="Copywriter",
-            system_message=f'''You are a Copywriter, you can use research function to collect latest information about a given topic, 
-            and then use write_content function to write a very well written content;
-            Reply TERMINATE when your task is done
-            Be concise and not verbose. Refrain from any conversations that don't serve the goal of the user.
-            ''',
-            llm_config = {
-                "functions": [research_function, write_function],
-                "config_list": config_list,
-                "temperature": 0,
-                "retry_wait_time": 30,
-                "request_timeout": GLOBAL_TIMEOUT,
-            },
-            function_map={
-                "research": research,
-                "write_content": write_content
-            }
-        )
-
-        graphic_designer = ChainlitAssistantAgent(
-            name="Graphic_Designer",
-            system_message=f'''As an expert in text-to-image AI models, you will utilize the 'generate_image' function to create an image based on the given prompt and iterate on the prompt. 
-            Incorporating feedback from the Art Director until it achieves a perfect rating of 10/10.''',
-            llm_config=llm_config_assistants,
-            function_map={
-                "image_review": review_image,
-                "generate_image": generate_image
-            }
-        )
-
-        art_director = ChainlitAssistantAgent(
-            name="Art_Director",
-            system_message=f'''You are the Art Director. 
-            As an AI image critic, your task is to employ the 'image_review' function to evaluate the image generated by the Graphic Designer using the original prompt. 
-            You will then offer feedback on how to enhance the prompt for better image generation.''',
-            llm_config=llm_config_assistants,
-            function_map={
-                "image_review": review_image,
-                "generate_image": generate_image
-            }
-        )
-
-        user_proxy = ChainlitUserProxyAgent(
-            name="User_Proxy",
-            human_input_mode="TERMINATE",
-            function_map={
-                "research": research,
-                "write_content": write_content,
-                "image_review": review_image,
-                "generate_image": generate_image
-            }
-        )
-
-        cl.user_session.set(USER_PROXY_NAME, user_proxy)
-        cl.user_session.set(PROJECT_MANAGER, project_manager)
-        # cl.user_session.set(CREATIVE_DIRECTOR, creative_director)
-        cl.user_session.set(CONTENT_RESEARCHER, content_researcher)
-        cl.user_session.set(COPYWRITER, copywriter)
-        cl.user_session.set(GRAPHIC_DESIGNER, graphic_designer)
-        cl.user_session.set(ART_DIRECTOR, art_director)
-        
+        for key, agent in instantiate(AGENT_TEMPLATES).items():
+            cl.user_session.set(key, agent)
+
         await cl.Message(content=WELCOME_MESSAGE, author="Chat").send()
         
     except Exception as e:
@@ -352,52 +459,76 @@ async def on_chat_start():
         pass
 
 
-@cl.on_message
-async def run_conversation(message: cl.Message):
+async def run_group_chat(TASK):
+    user_proxy = cl.user_session.get(USER_PROXY_NAME)
+    project_manager = cl.user_session.get(PROJECT_MANAGER)
+    domain_expert = cl.user_session.get(DOMAIN_EXPERT)
+    # creative_director = cl.user_session.get(CREATIVE_DIRECTOR)
+    content_researcher = cl.user_session.get(CONTENT_RESEARCHER)
+    copywriter = cl.user_session.get(COPYWRITER)
+    graphic_designer = cl.user_session.get(GRAPHIC_DESIGNER)
+    art_director = cl.user_session.get(ART_DIRECTOR)
+    
+    # write_content runs in the background while the image loop goes on, results join before the review
+    dispatcher = ParallelDispatcher(notify=show_background_result) if PARALLEL_TOOLS else None
+
+    # Speakers are picked by rules and memoized decisions first, see utilities/speaker_selection.py
+    groupchat = SelectiveGroupChat(
+        agents=[user_proxy, project_manager, domain_expert, content_researcher, copywriter, graphic_designer, art_director],
+        messages=[],
+        max_round=30,
+        speaker_selector=get_speaker_selector(),
+        dispatcher=dispatcher,
+    )
+    manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=gpt4_config)
+    
+    print("Group chat messages: ", len(groupchat.messages))
+    
+    if dispatcher:
+        dispatcher.install(groupchat.agents)
     try:
-        print("Start logging...")
-        autogen.ChatCompletion.start_logging()
-        
-        TASK = message.content
-        print("Task: ", TASK)
-
-        user_proxy = cl.user_session.get(USER_PROXY_NAME)
-        project_manager = cl.user_session.get(PROJECT_MANAGER)
-        # creative_director = cl.user_session.get(CREATIVE_DIRECTOR)
-        content_researcher = cl.user_session.get(CONTENT_RESEARCHER)
-        copywriter = cl.user_session.get(COPYWRITER)
-        graphic_designer = cl.user_session.get(GRAPHIC_DESIGNER)
-        art_director = cl.user_session.get(ART_DIRECTOR)
-        
-        groupchat = autogen.GroupChat(agents=[user_proxy, project_manager, content_researcher, copywriter, graphic_designer, art_director], messages=[], max_round=30)
-        manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=gpt4_config)
-        
-        print("Group chat messages: ", len(groupchat.messages))
-        
         if len(groupchat.messages) == 0:
             await cl.Message(content=f"""Starting agents on task: {TASK}...""").send()
             await cl.make_async(user_proxy.initiate_chat)( manager, message=TASK, )
         else:
             await cl.make_async(user_proxy.send)( manager, message=TASK, )
+    finally:
+        if dispatcher:
+            # Results of calls still running when the chat ended without a review
+            await cl.make_async(dispatcher.join)()
+            dispatcher.shutdown()
+
+    print("Speaker selection: ", groupchat.selection_stats.summary())
+    print("Context: ", context_report(groupchat.agents, manager))
 
-        # Display cost logs
-        # logs = autogen.ChatCompletion.logged_history
-        # print(logs)
-        # conversation = next(iter(logs.values()))
-        # cost = sum(conversation["cost"])
-
-        # TOTAL_COST = float(cl.user_session.get("total_cost", 0))
-        # cost += TOTAL_COST
-        # cl.user_session.set("total_cost", cost)
-
-        # cost_counter = cl.TaskList(name="Cost Counter", status="running")
-        # await cost_counter.send()
-        # cost_task = cl.Task(title=f"Total Cost in USD for this conversation: ${float(cl.user_session.get('total_cost', 0)):.2f}", status=cl.TaskStatus.DONE)
-        # await cost_counter.add_task(cost_task)
-        # await cost_counter.send()
+@cl.on_message
+async def run_conversation(message: cl.Message):
+    try:
+        TASK = message.content
+        print("Task: ", TASK)
+        # Agent messages are queued and shown by a task on the event loop, agents don't wait for the UI
+        ui_stream = start_ui_stream()
+
+        # Rounds, model and tool calls of the task are traced, the panel shows where the time and money go
+        panel = TracePanel(session_cost=float(cl.user_session.get("total_cost", 0)))
+        with trace("task", on_update=panel.update, **{"task.text": TASK, "session.id": cl.user_session.get("id")}) as task_trace:
+            # Known task types follow a fixed workflow, anything else is a free-form group chat
+            workflow = WORKFLOWS.get(classify_task(TASK)) if WORKFLOW_MODE else None
+            if workflow is not None:
+                await run_workflow(workflow, TASK)
+            else:
+                await run_group_chat(TASK)
+            await drain()
+
+        if LLM_CACHE != "off":
+            print("LLM cache: ", get_completion_cache().summary())
+        if task_trace is not None:
+            print("Trace: ", task_trace.summary())
+            cl.user_session.set("total_cost", panel.session_cost + task_trace.totals()["cost"])
+            await panel.show(task_trace, done=True)
+        if ui_stream is not None:
+            print("UI stream: ", ui_stream.summary())
         
     except Exception as e:
         print("Error: ", e)
         pass
-
-
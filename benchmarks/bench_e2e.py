@@ -0,0 +1,138 @@
+# End-to-end latency, rounds, tokens, tool calls and peak memory per task, replayed offline from recorded sessions.
+# Record once against the live services (needs the usual API keys and OAI_CONFIG_LIST):
+#   python benchmarks/bench_e2e.py record --fixtures fixtures/e2e "Write a blog post about burnout" "Create an image of a calm office"
+# Then replay as often as needed, fully offline:
+#   python benchmarks/bench_e2e.py replay --fixtures fixtures/e2e --llm-latency 1.0 --http-latency 0.3 --image-latency 5
+#   python benchmarks/bench_e2e.py replay --fixtures fixtures/e2e --save baseline.json
+#   python benchmarks/bench_e2e.py replay --fixtures fixtures/e2e --baseline baseline.json --tolerance 0.2
+# Every task runs in a fresh process, so peak memory and caches only cover that task. See harness.py for the fixture format.
+import os
+import sys
+import json
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+
+RESULT = "E2E_RESULT "
+# Metrics compared against a baseline, higher is worse
+COMPARED = ["seconds", "rounds", "llm_calls", "tokens", "tool_calls", "peak_rss_mb"]
+
+def run_child(args):
+    fixture = harness.Fixture(args.fixtures)
+    stats = harness.RunStats()
+    replay = args.mode == "replay"
+    server = None
+    if replay:
+        host_latency = {host: args.image_latency for host in ("replicate.delivery", "pbxt.replicate.delivery")}
+        server = harness.StandInServer(fixture, args.http_latency, host_latency, stats).start()
+    harness.prepare_environment(fixture, replay, server)
+    if not replay:
+        harness.record_models(fixture)
+    latency = {"llm": args.llm_latency, "token": args.token_latency, "image": args.image_latency, "ui": args.ui_latency}
+    harness.install(fixture, stats, replay, latency)
+
+    task = fixture.config["tasks"][args.index]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = harness.run_task(task)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {"task": task, "seconds": round(seconds, 3), "peak_rss_mb": round(peak / 1024, 1),
+              "rounds_per_second": round(stats.summary()["rounds"] / seconds, 2),
+              "task_rss_mb": round((peak - baseline) / 1024, 1), **stats.summary()}
+    print(RESULT + json.dumps(result), flush=True)
+
+def spawn(args, mode, index, env=None):
+    command = [
+        sys.executable, os.path.abspath(__file__), "child", "--mode", mode, "--fixtures", args.fixtures, "--index", str(index),
+        "--llm-latency", str(args.llm_latency), "--token-latency", str(args.token_latency),
+        "--http-latency", str(args.http_latency), "--image-latency", str(args.image_latency), "--ui-latency", str(args.ui_latency),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, env={**os.environ, **(env or {})})
+    output = completed.stdout
+    if args.verbose:
+        print(output, completed.stderr)
+    for line in output.splitlines():
+        if line.startswith(RESULT):
+            return json.loads(line[len(RESULT):])
+    print(output[-2000:], completed.stderr[-2000:] if completed.stderr else "")
+    raise SystemExit(f"Task {index} failed in the {mode} run")
+
+def print_results(results):
+    print(f"{'task':<40} {'time':>8} {'rounds':>7} {'rounds/s':>8} {'llm':>5} {'tokens':>8} {'tools':>6} {'http':>5} {'peak rss':>9} {'errors':>6}")
+    for result in results:
+        print(f"{result['task'][:40]:<40} {result['seconds']:>7.2f}s {result['rounds']:>7} {result['rounds_per_second']:>8.2f} {result['llm_calls']:>5} "
+              f"{result['tokens']:>8} {result['tool_calls']:>6} {sum(result['http'].values()):>5} "
+              f"{result['peak_rss_mb']:>7.1f}MB {sum(result['errors'].values()):>6}")
+        if result["errors"]:
+            print(f"{'':<40} errors: {result['errors']}")
+
+# Metrics that grew by more than the tolerance against the saved baseline
+def regressions(results, baseline, tolerance):
+    previous = {result["task"]: result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get(result["task"])
+        if before is None:
+            continue
+        for metric in COMPARED:
+            if result[metric] > before[metric] * (1 + tolerance) and result[metric] - before[metric] > 0.01:
+                found.append(f"{result['task'][:40]}: {metric} {before[metric]} -> {result[metric]}")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["record", "replay", "child"])
+    parser.add_argument("tasks", nargs="*", help="tasks to record, replay runs every recorded task")
+    parser.add_argument("--fixtures", default="fixtures/e2e")
+    parser.add_argument("--runs", type=int, default=1, help="replays per task, the fastest one is reported")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per replayed model call")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="extra seconds per completion token")
+    parser.add_argument("--http-latency", type=float, default=0.3, help="seconds per stand-in HTTP request")
+    parser.add_argument("--image-latency", type=float, default=5.0, help="seconds per replicate call and image download")
+    parser.add_argument("--ui-latency", type=float, default=0.0, help="seconds per message shown in the UI")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="show the app output of every run")
+    parser.add_argument("--mode", choices=["record", "replay"], help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_intermixed_args()
+
+    if args.command == "child":
+        run_child(args)
+        return
+
+    fixture = harness.Fixture(args.fixtures)
+    if args.command == "record":
+        if not args.tasks:
+            raise SystemExit("Give the tasks to record")
+        fixture.config["tasks"] = fixture.config.get("tasks", []) + [task for task in args.tasks if task not in fixture.config.get("tasks", [])]
+        fixture.save_config()
+        indexes = [fixture.config["tasks"].index(task) for task in args.tasks]
+        results = [spawn(args, "record", index) for index in indexes]
+        print(f"Recorded {len(results)} tasks into {args.fixtures}\n")
+    else:
+        tasks = args.tasks or fixture.config.get("tasks", [])
+        indexes = [fixture.config["tasks"].index(task) for task in tasks]
+        print(f"Replaying {len(indexes)} tasks, model {args.llm_latency}s + {args.token_latency}s/token, "
+              f"http {args.http_latency}s, images {args.image_latency}s, ui {args.ui_latency}s\n")
+        results = [min((spawn(args, "replay", index) for _ in range(args.runs)), key=lambda result: result["seconds"]) for index in indexes]
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        print("\nRegressions:" if found else "\nNo regressions against the baseline")
+        for line in found:
+            print("  " + line)
+        if found:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Time and peak RSS of the scrape() text extractors on saved HTML pages.
+# Usage: python benchmarks/bench_extract.py [page.html ...]
+# Without arguments it uses generated pages. Each page is read from disk in SCRAPE_READ_CHUNK pieces, like a streamed response.
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utilities.extract import EXTRACTORS, SCRAPE_MAX_CHARS, SCRAPE_READ_CHUNK, extract
+
+WORDS = "mental health mindfulness community stigma support therapy research asia wellbeing".split()
+
+def generate_page(paragraphs):
+    body = []
+    for index in range(paragraphs):
+        text = " ".join(random.choice(WORDS) for _ in range(80))
+        body.append(f"<div class='c{index}'><p>{text}</p><script>track({index});</script></div>")
+    nav = "".join(f"<li><a href='/p{i}'>Link {i}</a></li>" for i in range(200))
+    return f"<html><head><style>p{{color:red}}</style></head><body><nav><ul>{nav}</ul></nav>{''.join(body)}<footer>footer</footer></body></html>"
+
+def fixture_pages():
+    pages = [generate_page(count) for count in (100, 1000, 5000)]
+
+    directory = tempfile.mkdtemp(prefix="bench_extract_")
+    paths = []
+    for index, page in enumerate(pages):
+        path = os.path.join(directory, f"page-{index}.html")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(page)
+        paths.append(path)
+    return paths
+
+# Runs in a fresh process so ru_maxrss only covers one extractor
+def worker(name, path, max_chars):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(path, "rb") as file:
+        text = extract(EXTRACTORS[name](max_chars), iter(lambda: file.read(SCRAPE_READ_CHUNK), b""))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "rss_kb": peak, "rss_delta_kb": peak - baseline, "chars": len(text)}))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--max-chars", type=int, default=SCRAPE_MAX_CHARS)
+    parser.add_argument("--worker", nargs=2, metavar=("EXTRACTOR", "PAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], args.max_chars)
+        return
+
+    paths = args.pages or fixture_pages()
+    print(f"{'page':<14} {'size':>9} {'extractor':>9} {'time':>9} {'peak rss':>10} {'rss delta':>10} {'chars':>8}")
+    for path in paths:
+        size = os.path.getsize(path)
+        for name in EXTRACTORS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", name, path, "--max-chars", str(args.max_chars)],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                print(f"{os.path.basename(path):<14} {size:>9} {name:>9} failed: {output.stderr.strip().splitlines()[-1]}")
+                continue
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{os.path.basename(path):<14} {size:>9} {name:>9} {result['seconds'] * 1000:>7.1f}ms "
+                  f"{result['rss_kb'] / 1024:>8.1f}MB {result['rss_delta_kb'] / 1024:>8.1f}MB {result['chars']:>8}")
+
+if __name__ == "__main__":
+    main()
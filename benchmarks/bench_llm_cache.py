@@ -0,0 +1,83 @@
+# Completion cache: a task run cold, retried with the cache warm, then recorded and replayed offline.
+# Usage: python benchmarks/bench_llm_cache.py --turns 10 --latency 0.5
+# The model is a fake that sleeps like an API call, replay runs with it switched off to prove nothing reaches it.
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autogen import oai, ConversableAgent
+
+from utilities.cache import DiskCache
+from utilities.completion_cache import CompletionCache
+
+# Stand-in for the OpenAI API, the answer depends on the conversation so far and, when sampled, on a counter
+class FakeModel:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.online = True
+
+    def create(self, context=None, messages=None, **config):
+        if not self.online:
+            raise RuntimeError("the model was called during replay")
+        self.calls += 1
+        time.sleep(self.latency)
+        tokens = len(json.dumps(messages)) // 4 + 3
+        sample = f" (sample {self.calls})" if config.get("temperature", 1) > 0 else ""
+        return {
+            "model": "fake",
+            "choices": [{"message": {"role": "assistant", "content": f"Draft {len(messages)}{sample}"}}],
+            "usage": {"total_tokens": tokens},
+            "cost": tokens * 0.03 / 1000,
+        }
+
+def run_task(turns, temperature):
+    llm_config = {"config_list": [{"model": "fake", "api_key": "sk-bench"}], "temperature": temperature}
+    writer = ConversableAgent("Writer", system_message="You write blog posts.", llm_config=llm_config,
+                              human_input_mode="NEVER")
+    editor = ConversableAgent("Editor", llm_config=False, human_input_mode="NEVER",
+                              max_consecutive_auto_reply=turns - 1, default_auto_reply="Tighten it up.")
+    start = time.perf_counter()
+    editor.initiate_chat(writer, message="Write a post about burnout in Singapore", silent=True)
+    return time.perf_counter() - start, [message["content"] for message in editor.chat_messages[writer]]
+
+def measure(label, model, completions, turns, temperature):
+    calls = model.calls
+    seconds, transcript = run_task(turns, temperature)
+    print(f"{label:<28} {seconds:7.2f}s {model.calls - calls:6d} model calls   {completions.summary()}")
+    return transcript
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    model = FakeModel(args.latency)
+    oai.ChatCompletion.create = staticmethod(model.create)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "llm.sqlite")
+
+        completions = CompletionCache(mode="cache", cache=DiskCache("completions", path=path)).install()
+        print(f"{args.turns} turns, {args.latency}s per model call\n")
+        measure("temperature 0, cold", model, completions, args.turns, 0)
+        measure("temperature 0, retry", model, completions, args.turns, 0)
+        completions.uninstall()
+
+        completions = CompletionCache(mode="record", cache=DiskCache("recording", path=path)).install()
+        recorded = measure("temperature 0.7, record", model, completions, args.turns, 0.7)
+        completions.uninstall()
+
+        model.online = False
+        completions = CompletionCache(mode="replay", cache=DiskCache("recording", path=path)).install()
+        replayed = measure("temperature 0.7, replay", model, completions, args.turns, 0.7)
+        completions.uninstall()
+        print("\nReplay matches the recording: ", replayed == recorded)
+
+if __name__ == "__main__":
+    main()
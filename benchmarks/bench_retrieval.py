@@ -0,0 +1,86 @@
+# Ingestion throughput and query latency of the Domain_Expert knowledge base.
+# Usage: python benchmarks/bench_retrieval.py --documents 200 --queries 500
+# Runs on a generated corpus in a temporary chroma store with the offline hashing embedder,
+# pass --corpus to use real files and --embeddings openai to include the embedding API.
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.knowledge import KnowledgeBase, find_documents
+from utilities.semantic_index import get_chroma_client, get_embedding_function
+
+WORDS = ("mental health mindfulness community stigma support therapy anxiety depression burnout "
+         "meditation resilience workplace youth family counselling asia singapore talk speaker").split()
+
+def generate_corpus(directory, documents, paragraphs=12):
+    for index in range(documents):
+        with open(os.path.join(directory, f"talk-{index}.md"), "w") as file:
+            file.write(f"# Talk {index} by Speaker {index % 37}\n\n")
+            for _ in range(paragraphs):
+                file.write(" ".join(random.choice(WORDS) for _ in range(90)) + "\n\n")
+
+def percentile(samples, share):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * share))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--corpus", help="directory of real documents instead of a generated corpus")
+    parser.add_argument("--embeddings", default="hashing", choices=["hashing", "openai"])
+    parser.add_argument("--retrieval", default="hybrid", choices=["hybrid", "vector"])
+    parser.add_argument("--rerank", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    corpus = args.corpus
+    if corpus is None:
+        corpus = os.path.join(workdir, "corpus")
+        os.makedirs(corpus)
+        generate_corpus(corpus, args.documents)
+
+    knowledge = KnowledgeBase(
+        collection_name="bench_knowledge",
+        embedding_function=get_embedding_function(args.embeddings),
+        client=get_chroma_client(os.path.join(workdir, "chroma")),
+        manifest_path=os.path.join(workdir, "manifest.json"),
+        retrieval=args.retrieval,
+        rerank=args.rerank,
+    )
+
+    start = time.perf_counter()
+    stats = knowledge.ingest([corpus], progress=None)
+    elapsed = time.perf_counter() - start
+    documents = len(find_documents([corpus]))
+    print(f"ingest: {documents} documents, {stats['chunks']} chunks in {elapsed:.2f}s "
+          f"({documents / elapsed:.1f} docs/s, {stats['chunks'] / elapsed:.1f} chunks/s)")
+
+    start = time.perf_counter()
+    stats = knowledge.ingest([corpus], progress=None)
+    print(f"re-ingest unchanged: {stats['unchanged']} skipped in {time.perf_counter() - start:.2f}s")
+
+    latencies = []
+    for _ in range(args.queries):
+        question = " ".join(random.choice(WORDS) for _ in range(6))
+        start = time.perf_counter()
+        knowledge.query(question, n_results=3)
+        latencies.append(time.perf_counter() - start)
+    print(f"query: {args.queries} queries, p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms")
+
+    # Exact-name lookups, the talk asked for by title should be in the top 3
+    if args.corpus is None:
+        hits = 0
+        for index in range(args.documents):
+            sources = [os.path.basename(result["source"]) for result in knowledge.query(f"Talk {index}", n_results=3)]
+            hits += f"talk-{index}.md" in sources
+        print(f"exact names: {hits}/{args.documents} talks found in the top 3 ({args.retrieval})")
+
+if __name__ == "__main__":
+    main()
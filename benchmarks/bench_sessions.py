@@ -0,0 +1,47 @@
+# Session start latency and per-session memory of the agent team, rebuilt per session vs cloned from templates.
+# Usage: python benchmarks/bench_sessions.py --sessions 1 100 1000
+# Only agents are created, no LLM is called so no API key is needed.
+import os
+import sys
+import copy
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OAI_CONFIG_LIST", '[{"model": "gpt-3.5-turbo-16k", "api_key": "sk-bench"}]')
+os.environ.setdefault("GLOBAL_TIMEOUT", "120")
+
+from app import AGENT_TEMPLATES
+from utilities.agents import instantiate
+
+# What on_chat_start used to do: fresh schemas and configs, full agent construction
+def rebuild(templates):
+    return {key: template.agent_class(**copy.deepcopy(template.kwargs)) for key, template in templates.items()}
+
+def run(start_session, sessions):
+    tracemalloc.start()
+    alive = []
+    start = time.perf_counter()
+    for _ in range(sessions):
+        alive.append(start_session(AGENT_TEMPLATES))
+    elapsed = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / sessions, memory / sessions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 100, 1000])
+    args = parser.parse_args()
+
+    # Prototypes are built once per process, like on the first session of a worker
+    instantiate(AGENT_TEMPLATES)
+    print(f"{len(AGENT_TEMPLATES)} agents per session")
+    for sessions in args.sessions:
+        for label, start_session in (("rebuild", rebuild), ("template", instantiate)):
+            latency, memory = run(start_session, sessions)
+            print(f"{label:>8} x{sessions:<5} session start {latency * 1000:.3f}ms, {memory / 1024:.1f} KiB per session")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Speaker selection latency and token spend per task, autogen's LLM pick on every turn vs rules + memo + cheap model.
+# Usage: python benchmarks/bench_speaker.py --tasks 3 --latency 0.5
+# Replays a scripted research -> copy -> image review task against a fake model that knows the script,
+# so the numbers also show how often the rules and the memo agree with the intended speaker.
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autogen import oai, ConversableAgent, GroupChatManager
+
+from utilities.cache import DiskCache
+from utilities.speaker_selection import SelectiveGroupChat, SpeakerSelector
+
+FUNCTIONS = {
+    "User_Proxy": ["research", "retrieve_content", "write_content", "image_review", "generate_image"],
+    "Project_Manager": [],
+    "Domain_Expert": ["retrieve_content"],
+    "Content_Researcher": ["research"],
+    "Copywriter": ["research", "write_content"],
+    "Graphic_Designer": ["image_review", "generate_image"],
+    "Art_Director": ["image_review", "generate_image"],
+}
+
+# (speaker, message) of a typical task
+SCRIPT = [
+    ("User_Proxy", {"role": "user", "content": "Write a blog post with an image about burnout in Singapore"}),
+    ("Project_Manager", {"role": "user", "content": "Content_Researcher, please research burnout in Singapore."}),
+    ("Content_Researcher", {"role": "assistant", "content": None, "function_call": {"name": "research", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "research", "content": "research report " * 200}),
+    ("Content_Researcher", {"role": "user", "content": "Findings are in, Copywriter please write the post."}),
+    ("Copywriter", {"role": "assistant", "content": None, "function_call": {"name": "write_content", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "write_content", "content": "blog post " * 300}),
+    ("Copywriter", {"role": "user", "content": "Here is the post. Graphic_Designer, please create the header image."}),
+    ("Graphic_Designer", {"role": "assistant", "content": None, "function_call": {"name": "generate_image", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "generate_image", "content": "Image saved as 'burnout.png'"}),
+    ("Art_Director", {"role": "assistant", "content": None, "function_call": {"name": "image_review", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "image_review", "content": "A tired office worker, 7/10"}),
+    ("Art_Director", {"role": "user", "content": "7/10, Graphic_Designer make the lighting warmer."}),
+    ("Graphic_Designer", {"role": "assistant", "content": None, "function_call": {"name": "generate_image", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "generate_image", "content": "Image saved as 'burnout-2.png'"}),
+    ("Art_Director", {"role": "assistant", "content": None, "function_call": {"name": "image_review", "arguments": "{}"}}),
+    ("User_Proxy", {"role": "function", "name": "image_review", "content": "A calm office worker at sunset, 10/10"}),
+    ("Art_Director", {"role": "user", "content": "10/10, Project_Manager the image is approved."}),
+    ("Project_Manager", {"role": "user", "content": "All deliverables are done. TERMINATE"}),
+]
+
+# Stand-in for the OpenAI API: sleeps like a model call, answers the scripted speaker, bills ~4 chars per token
+class FakeModel:
+    def __init__(self, latency):
+        self.latency = latency
+        self.expected = None
+        self.calls = 0
+        self.tokens = 0
+
+    def create(self, context=None, messages=None, **config):
+        self.calls += 1
+        time.sleep(self.latency)
+        tokens = len(json.dumps(messages)) // 4 + 3
+        self.tokens += tokens
+        return {
+            "model": "fake",
+            "choices": [{"message": {"role": "assistant", "content": self.expected}}],
+            "usage": {"total_tokens": tokens},
+            "cost": tokens * 0.03 / 1000,
+        }
+
+def build_agents():
+    llm_config = {"config_list": [{"model": "fake", "api_key": "sk-bench"}]}
+    return [
+        ConversableAgent(
+            name=name,
+            system_message=f"You are the {name.replace('_', ' ')}.",
+            llm_config=False if name == "User_Proxy" else llm_config,
+            human_input_mode="NEVER",
+            function_map={function: (lambda **kwargs: "") for function in functions},
+        )
+        for name, functions in FUNCTIONS.items()
+    ]
+
+def run_task(model, speaker_selector):
+    agents = build_agents()
+    groupchat = SelectiveGroupChat(agents=agents, messages=[], max_round=30, speaker_selector=speaker_selector)
+    manager = GroupChatManager(groupchat=groupchat, llm_config={"config_list": [{"model": "fake", "api_key": "sk-bench"}]})
+    correct = 0
+    for index in range(1, len(SCRIPT)):
+        groupchat.messages = [dict(message, name=message.get("name", speaker)) for speaker, message in SCRIPT[:index]]
+        model.expected = SCRIPT[index][0]
+        speaker = groupchat.select_speaker(groupchat.agent_by_name(SCRIPT[index - 1][0]), manager)
+        correct += speaker.name == model.expected
+    return groupchat.selection_stats, correct
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake model call")
+    args = parser.parse_args()
+
+    model = FakeModel(args.latency)
+    oai.ChatCompletion.create = model.create
+    cache = DiskCache("speaker", path=os.path.join(tempfile.mkdtemp(prefix="bench_speaker_"), "speaker.sqlite"))
+    modes = [
+        ("autogen", lambda: None),
+        ("rules", lambda: SpeakerSelector(llm_config={"config_list": [{"model": "fake", "api_key": "sk-bench"}]}, cache=cache)),
+    ]
+    turns = len(SCRIPT) - 1
+    for label, make_selector in modes:
+        selector = make_selector()
+        for task in range(args.tasks):
+            calls, tokens = model.calls, model.tokens
+            with contextlib.redirect_stderr(io.StringIO()):
+                stats, correct = run_task(model, selector)
+            seconds = sum(stats.seconds.values())
+            print(f"{label:>8} task {task + 1}: {seconds:.2f}s selecting ({seconds / turns * 1000:.0f}ms/turn), "
+                  f"{model.calls - calls} model calls, {model.tokens - tokens} tokens, {correct}/{turns} as scripted")
+            print(f"{'':>8}   {stats.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Cold start of a Chainlit worker: wall time and per-module import time from python -X importtime.
+# Usage: python benchmarks/bench_startup.py --module app --top 25
+# Each run is a fresh interpreter, the report shows the slowest top-level packages and modules.
+import os
+import sys
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times(module, runs):
+    env = dict(os.environ)
+    env.setdefault("OAI_CONFIG_LIST", '[{"model": "gpt-3.5-turbo-16k", "api_key": "sk-bench"}]')
+    env.setdefault("GLOBAL_TIMEOUT", "120")
+    env["WARM_START"] = "0"
+    walls, samples = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+        walls.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+        samples.append(parse(result.stderr))
+    return walls, samples
+
+# Lines look like "import time:       642 |     173608 | httpx", self and cumulative in microseconds
+def parse(report):
+    modules = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        modules[name] = (int(self_us), int(cumulative_us))
+    return modules
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    walls, samples = import_times(args.module, args.runs)
+    # Best of the runs, the first one also pays for cold disk caches
+    best = min(range(len(walls)), key=lambda index: walls[index])
+    modules = samples[best]
+
+    packages = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        packages[name.split(".")[0]] += self_us
+    total = sum(packages.values())
+
+    print(f"import {args.module}: wall {walls[best] * 1000:.0f}ms (best of {args.runs}), "
+          f"imports {total / 1000:.0f}ms over {len(modules)} modules")
+    print(f"\nslowest packages (self time of all their modules):")
+    for name, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {self_us / total:5.1%}  {name}")
+    print(f"\nslowest modules (cumulative):")
+    for name, (_, cumulative_us) in sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+
+if __name__ == "__main__":
+    main()
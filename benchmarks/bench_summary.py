@@ -0,0 +1,55 @@
+# Wall-clock time of the summary() map phase, sequential vs parallel, against a local fake LLM.
+# Usage: python benchmarks/bench_summary.py --latency 0.5 --workers 4
+import os
+import io
+import sys
+import time
+import random
+import argparse
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.summarizer import map_reduce_summary
+
+# Stand-in for ChatOpenAI.predict, sleeps like a model call and fails now and then
+class FakeLLM:
+    def __init__(self, latency, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def predict(self, prompt):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise TimeoutError("fake LLM timeout")
+        return f"summary of {len(prompt)} chars"
+
+def run(chunk_count, workers, latency, failure_rate):
+    llm = FakeLLM(latency, failure_rate)
+    chunks = [f"chunk {index} " * 1000 for index in range(chunk_count)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        map_reduce_summary(chunks, complete=llm.predict, model="fake", workers=workers, retry_wait=0)
+    return time.perf_counter() - start, llm.calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1, 2, 4, 8, 11, 16])
+    args = parser.parse_args()
+
+    print(f"{'chunks':>6} {'sequential':>11} {'parallel':>9} {'speedup':>8} {'calls':>6}")
+    for chunk_count in args.chunks:
+        sequential, _ = run(chunk_count, 1, args.latency, args.failure_rate)
+        parallel, calls = run(chunk_count, args.workers, args.latency, args.failure_rate)
+        print(f"{chunk_count:>6} {sequential:>10.2f}s {parallel:>8.2f}s {sequential / parallel:>7.1f}x {calls:>6}")
+
+if __name__ == "__main__":
+    main()
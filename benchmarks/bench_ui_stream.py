@@ -0,0 +1,38 @@
+# Rounds per second of recorded tasks with every UI message sent in the agent's thread (UI_STREAM=0) vs queued and
+# delivered by the event loop (UI_STREAM=1), replayed offline with a simulated websocket round trip per message.
+# Usage (record the fixtures first, see bench_e2e.py):
+#   python benchmarks/bench_ui_stream.py --fixtures fixtures/e2e --ui-latency 0.2
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+from bench_e2e import spawn
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tasks", nargs="*", help="recorded tasks to replay, all by default")
+    parser.add_argument("--fixtures", default="fixtures/e2e")
+    parser.add_argument("--ui-latency", type=float, default=0.2, help="seconds per message shown in the UI")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--http-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=5.0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_intermixed_args()
+
+    fixture = harness.Fixture(args.fixtures)
+    tasks = args.tasks or fixture.config.get("tasks", [])
+    print(f"UI round trip {args.ui_latency}s per message, model {args.llm_latency}s + {args.token_latency}s/token\n")
+    print(f"{'task':<40} {'ui stream':>9} {'time':>8} {'rounds':>7} {'rounds/s':>8} {'ui msgs':>8}")
+    for task in tasks:
+        index = fixture.config["tasks"].index(task)
+        for stream in ("0", "1"):
+            result = spawn(args, "replay", index, env={"UI_STREAM": stream})
+            print(f"{task[:40]:<40} {'on' if stream == '1' else 'off':>9} {result['seconds']:>7.2f}s {result['rounds']:>7} "
+                  f"{result['rounds_per_second']:>8.2f} {result['ui_messages']:>8}")
+
+if __name__ == "__main__":
+    main()
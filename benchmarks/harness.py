@@ -0,0 +1,411 @@
+# Record/replay harness for end-to-end runs of the agent team, used by bench_e2e.py.
+# Recording runs a task against the live services and stores everything they answered in a fixture directory:
+#   llm.sqlite     model completions (utilities/completion_cache.py in record mode)
+#   http.jsonl     serper, browserless, origin and image download exchanges, bodies in bodies/
+#   calls.jsonl    in-process services: replicate models, the langchain summary model, embeddings
+#   config.json    models of OAI_CONFIG_LIST, without keys, and the recorded tasks
+# Replaying serves the same answers from a local stand-in server and a fake model at configurable latencies.
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+import functools
+from datetime import datetime
+from collections import Counter, defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Query parameters holding credentials, never written to a fixture
+SECRET_PARAMS = {"token", "key", "api_key", "apikey", "access_token"}
+# Response headers the tools read
+KEPT_HEADERS = {"content-type", "etag", "last-modified", "cache-control"}
+# Recorded sessions and their replays see the same clock, so file names and messages match
+FROZEN_TIME = datetime(2024, 1, 1, 9, 0, 0)
+
+class ReplayMiss(Exception):
+    pass
+
+def redact(url):
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key.lower() not in SECRET_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+def request_body(kwargs):
+    body = kwargs.get("data", kwargs.get("content"))
+    if body is None and kwargs.get("json") is not None:
+        body = json.dumps(kwargs["json"])
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return body or b""
+
+def exchange_key(method, url, body):
+    digest = hashlib.sha256(f"{method.upper()} {redact(url)}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+def call_key(args, kwargs):
+    return hashlib.sha256(json.dumps([args, kwargs], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+# Repeated identical requests may get different answers, the nth request gets the nth recorded answer
+class Occurrences:
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def next(self, key):
+        with self._lock:
+            occurrence = self.counts[key]
+            self.counts[key] += 1
+        return occurrence
+
+class Fixture:
+    def __init__(self, directory):
+        self.directory = directory
+        self.bodies = os.path.join(directory, "bodies")
+        self.llm_path = os.path.join(directory, "llm.sqlite")
+        self.exchanges = defaultdict(list)
+        self.calls = defaultdict(list)
+        self.config = {"models": [], "tasks": []}
+        self._lock = threading.Lock()
+        os.makedirs(self.bodies, exist_ok=True)
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        if os.path.exists(self.path("config.json")):
+            with open(self.path("config.json")) as file:
+                self.config = json.load(file)
+        for name, entries in (("http.jsonl", self.exchanges), ("calls.jsonl", self.calls)):
+            if os.path.exists(self.path(name)):
+                with open(self.path(name)) as file:
+                    for line in file:
+                        entry = json.loads(line)
+                        entries[(entry.get("tape"), entry["key"])].append(entry)
+
+    def save_config(self):
+        with open(self.path("config.json"), "w") as file:
+            json.dump(self.config, file, indent=2)
+
+    def append(self, name, entry):
+        with self._lock:
+            with open(self.path(name), "a") as file:
+                file.write(json.dumps(entry) + "\n")
+
+    def record_exchange(self, method, url, kwargs, response):
+        body = response.content or b""
+        digest = hashlib.sha256(body).hexdigest()
+        with open(os.path.join(self.bodies, digest), "wb") as file:
+            file.write(body)
+        entry = {
+            "key": exchange_key(method, url, request_body(kwargs)),
+            "method": method.upper(),
+            "url": redact(url),
+            "status": response.status_code,
+            "headers": {name: value for name, value in response.headers.items() if name.lower() in KEPT_HEADERS},
+            "body": digest,
+        }
+        self.exchanges[(None, entry["key"])].append(entry)
+        self.append("http.jsonl", entry)
+
+    def record_call(self, tape, key, result):
+        entry = {"tape": tape, "key": key, "result": result}
+        self.calls[(tape, key)].append(entry)
+        self.append("calls.jsonl", entry)
+
+    # Past the last recorded answer the last one is repeated
+    def exchange(self, key, occurrence):
+        entries = self.exchanges.get((None, key))
+        return entries[min(occurrence, len(entries) - 1)] if entries else None
+
+    def call(self, tape, key, occurrence):
+        entries = self.calls.get((tape, key))
+        return entries[min(occurrence, len(entries) - 1)] if entries else None
+
+    def body(self, digest):
+        with open(os.path.join(self.bodies, digest), "rb") as file:
+            return file.read()
+
+# Records the calls of an in-process service, or answers them from the fixture after a delay
+class Tape:
+    def __init__(self, fixture, name, function=None, replay=False, latency=0.0, stats=None):
+        self.fixture = fixture
+        self.name = name
+        self.function = function
+        self.replay = replay
+        self.latency = latency
+        self.stats = stats
+        self.occurrences = Occurrences()
+
+    def __call__(self, *args, **kwargs):
+        key = call_key(args, kwargs)
+        occurrence = self.occurrences.next(key)
+        if self.stats is not None:
+            self.stats.count("service", self.name)
+        if self.replay:
+            entry = self.fixture.call(self.name, key, occurrence)
+            if entry is None:
+                if self.stats is not None:
+                    self.stats.count("error", f"{self.name} not recorded")
+                raise ReplayMiss(f"No recorded {self.name} call for {json.dumps([args, kwargs], default=str)[:120]}")
+            time.sleep(self.latency)
+            return entry["result"]
+        result = self.function(*args, **kwargs)
+        # Streaming outputs such as llava tokens are consumed once here
+        if not isinstance(result, (str, int, float, bool, dict, list, type(None))):
+            result = list(result)
+        self.fixture.record_call(self.name, key, result)
+        return result
+
+# Chroma checks that embedding functions take a single `input` argument
+class EmbeddingTape(Tape):
+    def __call__(self, input):
+        return super().__call__(input)
+
+# Stand-in for the langchain summary model, tools only call predict
+class SummaryTape:
+    def __init__(self, tape):
+        self.predict = tape
+
+# Local stand-in for every HTTP service, requests arrive as /<quoted original url>, see utilities/http_client.route
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixture, latency=0.0, host_latency=None, stats=None):
+        self.fixture = fixture
+        self.latency = latency
+        self.host_latency = host_latency or {}
+        self.stats = stats
+        self.occurrences = Occurrences()
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stand-in", daemon=True).start()
+        return self
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def answer(self):
+        server = self.server
+        url = unquote(self.path.lstrip("/"))
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        key = exchange_key(self.command, url, body)
+        entry = server.fixture.exchange(key, server.occurrences.next(key))
+        host = urlsplit(url).netloc
+        if server.stats is not None:
+            server.stats.count("http", host if entry is not None else f"{host} (missing)")
+        time.sleep(server.host_latency.get(host, server.latency))
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content = server.fixture.body(entry["body"])
+        self.send_response(entry["status"])
+        for name, value in entry["headers"].items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_HEAD = answer
+
+    def log_message(self, format, *args):
+        pass
+
+# Counts of everything a task did, by kind and name
+class RunStats:
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+        self.llm_seconds = 0.0
+        self.tokens = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def count(self, kind, name):
+        with self._lock:
+            self.counts[kind][name] += 1
+
+    def record_completion(self, seconds, response):
+        usage = response.get("usage", {}) if isinstance(response, dict) else {}
+        with self._lock:
+            self.counts["llm"]["calls"] += 1
+            self.llm_seconds += seconds
+            self.tokens += usage.get("total_tokens", 0)
+            self.cost += response.get("cost", 0) if isinstance(response, dict) else 0
+
+    def summary(self):
+        with self._lock:
+            return {
+                "rounds": self.counts["round"]["messages"],
+                "llm_calls": self.counts["llm"]["calls"],
+                "llm_seconds": round(self.llm_seconds, 3),
+                "tokens": self.tokens,
+                "cost": round(self.cost, 4),
+                "tool_calls": sum(self.counts["tool"].values()),
+                "tools": dict(self.counts["tool"]),
+                "http": dict(self.counts["http"]),
+                "services": dict(self.counts["service"]),
+                "ui_messages": self.counts["ui"]["messages"],
+                "errors": dict(self.counts["error"]),
+            }
+
+# Measures every model call, during replay it also waits like the model would: a fixed delay plus one per completion token
+def meter_model(stats, latency=0.0, token_latency=0.0):
+    from utilities.completion_hooks import add_completion_hook
+
+    def metered(create, **params):
+        start = time.perf_counter()
+        try:
+            response = create(**params)
+        except Exception as e:
+            stats.count("error", type(e).__name__)
+            raise
+        if latency or token_latency:
+            tokens = response.get("usage", {}).get("completion_tokens", 0) if isinstance(response, dict) else 0
+            time.sleep(latency + token_latency * tokens)
+        stats.record_completion(time.perf_counter() - start, response)
+        return response
+
+    add_completion_hook(metered)
+
+# Every message sent between agents is a round, every function an agent executes is a tool call
+def count_rounds_and_tools(stats):
+    from autogen import ConversableAgent
+
+    send, execute_function = ConversableAgent.send, ConversableAgent.execute_function
+
+    def counted_send(self, message, recipient, request_reply=None, silent=False):
+        stats.count("round", "messages")
+        return send(self, message, recipient, request_reply=request_reply, silent=silent)
+
+    def counted_execute_function(self, func_call):
+        stats.count("tool", func_call.get("name", ""))
+        return execute_function(self, func_call)
+
+    ConversableAgent.send = counted_send
+    ConversableAgent.execute_function = counted_execute_function
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FROZEN_TIME.replace(tzinfo=tz) if tz else FROZEN_TIME
+
+# autogen keeps its own completion cache in .cache/<seed> under the working directory, whatever the seed
+def redirect_autogen_cache(directory):
+    from autogen import oai
+
+    set_cache = oai.Completion.set_cache.__func__
+    oai.Completion.set_cache = classmethod(lambda cls, seed=41, cache_path_root=None: set_cache(cls, seed, directory))
+    oai.Completion.set_cache()
+    oai.ChatCompletion.set_cache()
+
+# Environment of a run, set before the app is imported. Every run starts with empty tool caches,
+# so recordings and replays go through the same calls, and writes nothing to the working directory.
+# Like install() it changes the process for good, only call it in the per-task child process.
+def prepare_environment(fixture, replay, server=None):
+    workdir = tempfile.mkdtemp(prefix="e2e-run-")
+    os.environ["CACHE_DIR"] = os.path.join(workdir, "cache")
+    # The path of a saved image is part of the tool result the model sees, it has to be the same in every run
+    os.environ["IMAGE_DIR"] = os.path.join(tempfile.gettempdir(), "e2e-image")
+    os.environ["CONVERSATION_LOG_DIR"] = os.path.join(workdir, "logs")
+    os.environ["TRACE_PATH"] = os.path.join(workdir, "logs", "traces.jsonl")
+    redirect_autogen_cache(os.path.join(workdir, ".cache"))
+    os.environ["LLM_CACHE"] = "off"
+    os.environ["WARM_START"] = "0"
+    os.environ.setdefault("GLOBAL_TIMEOUT", "120")
+    if replay:
+        # Same models as the recording, so completions are keyed the same
+        os.environ["OAI_CONFIG_LIST"] = json.dumps([{"model": model, "api_key": "sk-replay"} for model in fixture.config["models"]])
+        os.environ["OPENAI_API_KEY"] = "sk-replay"
+        os.environ["HTTP_STANDIN_URL"] = server.url
+        os.environ.setdefault("REPLICATE_API_TOKEN", "r8-replay")
+
+def record_models(fixture):
+    from autogen import config_list_from_json
+
+    fixture.config["models"] = sorted({config["model"] for config in config_list_from_json("OAI_CONFIG_LIST") if config.get("model")})
+    fixture.save_config()
+
+# Every message shown in the UI costs a websocket round trip to the browser, replays add it here
+def simulate_ui(stats, latency=0.0):
+    import chainlit as cl
+
+    send = cl.Message.send
+
+    async def slow_send(self, *args, **kwargs):
+        stats.count("ui", "messages")
+        if latency:
+            await asyncio.sleep(latency)
+        return await send(self, *args, **kwargs)
+
+    cl.Message.send = slow_send
+
+# Wraps the model, HTTP clients and in-process services of the app for recording or replay.
+# Module globals and classes are patched with no way back, only ever call it in the per-task child process
+# (bench_e2e.py run_child), never in a process that goes on to do anything else.
+def install(fixture, stats, replay, latency=None):
+    latency = latency or {}
+    import replicate
+    from utilities import tools, knowledge, http_client
+    from utilities.cache import DiskCache
+    from utilities.completion_cache import CompletionCache
+
+    from utilities.chainlit_helpers import ChainlitUserProxyAgent
+
+    tools.datetime = FrozenDatetime
+
+    # Nobody is there to answer, every prompt for human input gets "Continue"
+    def continue_without_human(agent, prompt):
+        stats.count("human", "continue")
+        return ""
+
+    ChainlitUserProxyAgent.get_human_input = continue_without_human
+    mode = "replay" if replay else "record"
+    CompletionCache(mode=mode, cache=DiskCache("completions", path=fixture.llm_path)).install()
+    meter_model(stats, latency.get("llm", 0.0) if replay else 0.0, latency.get("token", 0.0) if replay else 0.0)
+    count_rounds_and_tools(stats)
+
+    if replay:
+        simulate_ui(stats, latency.get("ui", 0.0))
+
+    replicate.run = Tape(fixture, "replicate", replicate.run, replay, latency.get("image", 0.0), stats)
+    # The live services are only built once a recording needs them
+    live_summary = functools.lru_cache(maxsize=None)(tools.get_summary_llm)
+    summary_model = SummaryTape(Tape(fixture, "summary", lambda prompt: live_summary().predict(prompt), replay, latency.get("llm", 0.0), stats))
+    tools.get_summary_llm = lambda: summary_model
+    live_embeddings = functools.lru_cache(maxsize=None)(knowledge.get_embedding_function)
+    embeddings = EmbeddingTape(fixture, "embeddings", lambda input: live_embeddings()(input), replay, 0.0, stats)
+    knowledge.get_embedding_function = lambda: embeddings
+
+    if not replay:
+        def observe(method, url, kwargs, response):
+            stats.count("http", urlsplit(url).netloc)
+            fixture.record_exchange(method, url, kwargs, response)
+        http_client.observers.append(observe)
+
+# Runs one task the way Chainlit would: a new session, then the message
+def run_task(task):
+    import chainlit as cl
+    from chainlit.context import init_http_context
+    import app
+
+    async def session():
+        init_http_context()
+        await app.on_chat_start()
+        await app.run_conversation(cl.Message(content=task))
+
+    start = time.perf_counter()
+    asyncio.run(session())
+    return time.perf_counter() - start
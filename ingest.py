@@ -0,0 +1,53 @@
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+
+from utilities.knowledge import KnowledgeBase, KNOWLEDGE_DIR, KNOWLEDGE_COLLECTION, KNOWLEDGE_BATCH_SIZE, KNOWLEDGE_MANIFEST
+from utilities.semantic_index import CHROMA_PATH, HashingEmbeddingFunction, get_chroma_client
+
+# Load environment variables
+load_dotenv()
+
+# Incremental ingestion of the Domain_Expert knowledge base into chroma/.
+# Unchanged files are skipped and an interrupted run picks up where it stopped.
+#   python ingest.py                      index KNOWLEDGE_DIR
+#   python ingest.py talks/ articles/     index the given files or directories
+#   python ingest.py --stub-embeddings    run offline with the local hashing embedder
+def main():
+    parser = argparse.ArgumentParser(description="Index PDFs and articles for the Domain_Expert")
+    parser.add_argument("paths", nargs="*", default=[KNOWLEDGE_DIR])
+    parser.add_argument("--collection", default=KNOWLEDGE_COLLECTION)
+    parser.add_argument("--chroma-path", default=CHROMA_PATH)
+    parser.add_argument("--manifest", default=KNOWLEDGE_MANIFEST)
+    parser.add_argument("--batch-size", type=int, default=KNOWLEDGE_BATCH_SIZE)
+    parser.add_argument("--stub-embeddings", action="store_true", help="use the offline hashing embedder")
+    parser.add_argument("--reset", action="store_true", help="drop the collection and index everything again")
+    args = parser.parse_args()
+
+    client = get_chroma_client(args.chroma_path)
+    if args.reset:
+        try:
+            client.delete_collection(args.collection)
+        except Exception:
+            pass
+        if os.path.exists(args.manifest):
+            os.remove(args.manifest)
+
+    knowledge = KnowledgeBase(
+        collection_name=args.collection,
+        embedding_function=HashingEmbeddingFunction() if args.stub_embeddings else None,
+        client=client,
+        manifest_path=args.manifest,
+        batch_size=args.batch_size,
+    )
+
+    start = time.perf_counter()
+    stats = knowledge.ingest(args.paths)
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s: {stats['added']} added, {stats['updated']} updated, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed, "
+          f"{stats['chunks']} chunks embedded, {stats['resumed']} chunks resumed")
+
+if __name__ == "__main__":
+    main()
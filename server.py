@@ -12,6 +12,7 @@ from autogen import Agent, AssistantAgent, UserProxyAgent, config_list_from_json
 # from chromadb.config import Settings
 
 from utilities.toolsb import generate_image, review_image, search, scrape
+from utilities.completion_cache import install_completion_cache
 
 # Load environment variables
 load_dotenv()
@@ -58,6 +59,9 @@ gpt4_config = {
     "request_timeout": GLOBAL_TIMEOUT,
 }
 
+# Identical model calls are answered from disk, see utilities/completion_cache.py
+install_completion_cache()
+
 # openai_ef = embedding_functions.OpenAIEmbeddingFunction(
 #                 api_key=os.getenv("OPENAI_API_KEY"),
 #                 model_name="text-embedding-ada-002"
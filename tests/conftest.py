@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+# The tools read their config at import, point every cache at a scratch directory before anything is imported
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="cc-media-tests-"))
+os.environ.setdefault("GLOBAL_TIMEOUT", "30")
+os.environ.setdefault("OAI_CONFIG_LIST", '[{"model": "gpt-3.5-turbo-16k", "api_key": "sk-test"}]')
+os.environ.setdefault("SEMANTIC_CACHE", "0")
+os.environ.setdefault("TRACING", "0")
+os.environ.setdefault("CONVERSATION_LOG", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local HTTP server counting what it received. It answers with a canned JSON body, or with
+# respond(method, path, headers, body) -> (status, headers, body) for anything more specific.
+class StandIn:
+    def __init__(self, respond):
+        self.respond = respond if callable(respond) else self.json_body(respond)
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def answer(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                stand_in.requests.append((self.command, self.path, dict(self.headers), body))
+                status, headers, data = stand_in.respond(self.command, self.path, self.headers, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_HEAD = answer
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def json_body(body):
+        data = json.dumps(body).encode("utf-8")
+        return lambda method, path, headers, request: (200, {"Content-Type": "application/json"}, data)
+
+    def count(self, method):
+        return sum(1 for request in self.requests if request[0] == method)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(body):
+        server = StandIn(body)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
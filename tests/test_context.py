@@ -0,0 +1,25 @@
+from utilities.context import ContextManager
+from utilities.tokens import context_window, count_message_tokens
+
+MODEL = "gpt-3.5-turbo-16k"
+
+def conversation(turns):
+    messages = [{"role": "user", "name": "Admin", "content": "Write a blog about burnout in Asia."}]
+    for index in range(turns):
+        messages.append({"role": "assistant", "name": "Writer", "content": f"Draft {index}: " + "words " * 400})
+    return messages
+
+def test_trimming_keeps_the_task_message():
+    messages = conversation(12)
+    manager = ContextManager(recent=8, block=0, window_share=1500 / context_window(MODEL))
+    window, before, after = manager.compact(messages, model=MODEL)
+    assert window[0] is messages[0]
+    assert window[-1] is messages[-1]
+    assert after < before and count_message_tokens(window, MODEL) <= 1500
+
+def test_task_stays_verbatim_once_summarized():
+    messages = conversation(20)
+    manager = ContextManager(recent=4, block=4)
+    window, _, _ = manager.compact(messages, model=MODEL)
+    assert window[0] is messages[0]
+    assert window[1]["content"].startswith("Summary of messages 1-4")
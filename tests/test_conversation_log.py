@@ -0,0 +1,64 @@
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from autogen import oai
+
+from utilities import completion_hooks, conversation_log
+from utilities.conversation_log import LogWriter, session_filename
+
+@pytest.fixture
+def model(monkeypatch):
+    calls = []
+
+    def create(*args, **params):
+        calls.append(params)
+        return {"choices": [{"message": {"role": "assistant", "content": "ok"}}], "usage": {}}
+
+    monkeypatch.setattr(oai.ChatCompletion, "create", staticmethod(create))
+    monkeypatch.setattr(completion_hooks, "completion_hooks", [])
+    return calls
+
+def test_hooks_are_chained_once(model):
+    order = []
+
+    def outer(create, **params):
+        order.append("outer")
+        return create(**params)
+
+    def inner(create, **params):
+        order.append("inner")
+        return create(**params)
+
+    completion_hooks.add_completion_hook(inner)
+    completion_hooks.add_completion_hook(outer)
+    completion_hooks.add_completion_hook(inner)
+    oai.ChatCompletion.create(messages=[{"role": "user", "content": "hi"}])
+    assert order == ["outer", "inner"] and len(model) == 1
+
+def test_conversation_log_installs_once(model, tmp_path, monkeypatch):
+    writer = LogWriter(directory=str(tmp_path), flush_interval=0).start()
+    monkeypatch.setattr(conversation_log, "CONVERSATION_LOG", True)
+    monkeypatch.setattr(conversation_log, "log_writer", writer)
+    conversation_log.install_conversation_log()
+    conversation_log.install_conversation_log()
+    oai.ChatCompletion.create(messages=[{"role": "user", "content": "hi"}])
+    writer.flush()
+    assert writer.stats()["written"] == 1
+    writer.close()
+
+def test_file_reopened_after_a_restart_rotates_by_age(tmp_path):
+    path = tmp_path / session_filename("s1")
+    started = datetime.now() - timedelta(hours=2)
+    path.write_text(json.dumps({"time": started.isoformat(timespec="milliseconds")}) + "\n")
+    # The last write was just now, the file itself is two hours old
+    os.utime(path, (time.time(), time.time()))
+
+    writer = LogWriter(directory=str(tmp_path), max_age=60 * 60, flush_interval=0).start()
+    writer.write("s1", {"time": datetime.now().isoformat()})
+    writer.flush()
+    writer.close()
+    assert writer.rotations == 1
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,66 @@
+import asyncio
+
+from utilities import tools
+from utilities.cache import canonical_url
+from utilities.extract import extract, extract_text, charset, StreamExtractor
+
+def test_missing_head_end_tag_keeps_the_body():
+    html = "<html><head><title>Burnout</title><body><p>Main article text</p></body></html>"
+    assert extract_text(html) == "Main article text"
+
+def test_unclosed_boilerplate_is_closed_by_its_parent():
+    html = "<body><div><nav><a>Home</a><a>About</a></div><p>First paragraph</p><form><input></div><main><p>Second</p></main>"
+    text = extract_text(html)
+    assert "Home" not in text
+    assert "First paragraph" in text and "Second" in text
+
+def test_optional_end_tags():
+    html = "<ul><li>one<li>two<li>three</ul><p>after"
+    assert extract_text(html).splitlines() == ["one", "two", "three", "after"]
+
+def test_response_encoding_is_honoured():
+    html = "<p>Café société</p>".encode("latin-1")
+    assert charset("text/html; charset=ISO-8859-1") == "iso8859-1"
+    assert charset("text/html; charset=unknown") == "utf-8"
+    assert extract_text(html, encoding=charset("text/html; charset=ISO-8859-1")) == "Café société"
+
+def test_multibyte_characters_split_across_chunks():
+    html = "<p>naïve café</p>".encode("utf-8")
+    pieces = [html[i:i + 1] for i in range(len(html))]
+    assert extract(StreamExtractor(), pieces) == "naïve café"
+
+def test_reading_stops_once_the_text_is_full():
+    read = []
+    def pieces():
+        for index in range(1000):
+            read.append(index)
+            yield f"<p>paragraph {index} with some words</p>".encode()
+    text = extract(StreamExtractor(max_chars=200), pieces())
+    assert len(text) <= 200
+    assert len(read) < 20
+
+def test_scrape_streams_and_caches_text_only(stand_in, monkeypatch):
+    page = "<html><head><title>T</title><body><nav>Menu</nav><p>Ünïcode page</p>".encode("latin-1")
+    site = stand_in(lambda method, path, headers, body: (200, {"Content-Type": "text/html; charset=latin-1"}, page))
+    monkeypatch.setattr(tools, "BROWSERLESS_URL", f"{site.url}/content")
+    tools.scrape_cache.clear()
+    url = f"{site.url}/page"
+    assert tools.scrape(url, summarize=False) == "Ünïcode page"
+    record = tools.scrape_cache.lookup(canonical_url(url)).value
+    assert "html" not in record
+    tools.scrape_cache.clear()
+    assert asyncio.run(tools.ascrape(url, summarize=False)) == "Ünïcode page"
+
+def test_article_header_keeps_title_and_byline():
+    html = ("<body><header><a>Site logo</a></header><article><header><h1>Burnout in Asia</h1>"
+            "<p>By A. Writer</p></header><p>Article body</p><footer>Filed under health</footer></article>"
+            "<footer>Copyright</footer></body>")
+    text = extract_text(html)
+    assert text.splitlines()[:3] == ["Burnout in Asia", "By A. Writer", "Article body"]
+    assert "Filed under health" in text
+    assert "Site logo" not in text and "Copyright" not in text
+
+def test_page_wrapped_in_a_form_is_extracted():
+    html = ("<html><body><form method='post' action='./Default.aspx'><input type='hidden' name='__VIEWSTATE'>"
+            "<div><h1>Support groups</h1><p>Meetings every Tuesday.</p></div></form></body></html>")
+    assert extract_text(html).splitlines() == ["Support groups", "Meetings every Tuesday."]
@@ -0,0 +1,21 @@
+import asyncio
+
+import replicate
+
+from utilities import tools
+
+def test_review_closes_the_image_file(tmp_path, monkeypatch):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"png")
+    files = []
+
+    def run(model, input):
+        files.append(input["image"])
+        assert not input["image"].closed
+        return iter(["A calm ", "lake, 8/10"])
+
+    monkeypatch.setattr(replicate, "run", run)
+    monkeypatch.delattr(replicate, "async_run", raising=False)
+    assert tools.review_image(str(image), "a calm lake") == "A calm lake, 8/10"
+    assert asyncio.run(tools.areview_image(str(image), "a calm lake")) == "A calm lake, 8/10"
+    assert len(files) == 2 and all(file.closed for file in files)
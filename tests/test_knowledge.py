@@ -0,0 +1,78 @@
+import os
+import shutil
+
+import pytest
+
+from utilities.knowledge import KnowledgeBase
+from utilities.semantic_index import HashingEmbeddingFunction, get_chroma_client
+
+ARTICLE = "\n\n".join(f"Paragraph {index} about mindfulness, burnout and community support." for index in range(40))
+
+@pytest.fixture
+def knowledge(tmp_path):
+    client = get_chroma_client(str(tmp_path / "chroma"))
+    def open_base():
+        return KnowledgeBase(
+            collection_name="test", embedding_function=HashingEmbeddingFunction(), client=client,
+            manifest_path=str(tmp_path / "chroma" / "manifest.json"), batch_size=4, retrieval="hybrid",
+        )
+    return open_base
+
+def sources(base):
+    return sorted(metadata["source"] for metadata in base.collection.get(include=["metadatas"])["metadatas"])
+
+def test_identical_files_are_indexed_separately(tmp_path, knowledge):
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    first, second = folder / "a.txt", folder / "b.txt"
+    first.write_text(ARTICLE)
+    second.write_text(ARTICLE)
+
+    base = knowledge()
+    stats = base.ingest([str(folder)], progress=None)
+    assert stats["added"] == 2 and stats["resumed"] == 0
+    count = base.collection.count()
+    assert count % 2 == 0 and sources(base).count(str(first)) == count // 2
+    assert len(base.bm25) == count
+
+    # Removing one copy keeps the chunks of the other, in the collection and the keyword index
+    os.remove(first)
+    stats = base.ingest([str(folder)], progress=None)
+    assert stats["removed"] == 1 and stats["unchanged"] == 1
+    assert set(sources(base)) == {str(second)}
+    assert base.collection.count() == count // 2 and len(base.bm25) == count // 2
+
+    # A copy added later is indexed in full instead of being taken as already stored
+    shutil.copy(second, folder / "c.txt")
+    stats = base.ingest([str(folder)], progress=None)
+    assert stats["added"] == 1 and stats["resumed"] == 0
+    assert base.collection.count() == count
+    assert knowledge().bm25.search("burnout")
+
+# The keyword hit is an exact name the embeddings rank low, the semantic hit shares no word with the question
+FUSION_DOCUMENTS = {
+    "keyword.txt": "Attendance sheet and room bookings for the XJ9 cohort, with parking, catering and invoice details for the spring term.",
+    "semantic.txt": "Meditating daily lowers stressful feelings and anxiety.",
+    "yoga.txt": "Yoga reduces muscle tension after long working days.",
+    "breathing.txt": "Breathing exercises help when you feel stressed at work.",
+    "walking.txt": "Meditative walks outdoors calm a busy mind.",
+    "nutrition.txt": "Balanced nutrition with whole foods supports mental wellbeing.",
+}
+
+def test_hybrid_query_fuses_keyword_and_vector_hits(tmp_path, knowledge):
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    for name, text in FUSION_DOCUMENTS.items():
+        (folder / name).write_text(text)
+    base = knowledge()
+    base.ingest([str(folder)], progress=None)
+    question = "how does meditation reduce stress in XJ9"
+    names = lambda results: [os.path.basename(result["source"]) for result in results]
+
+    vector = names(base.vector_query(question, 3))
+    keyword = [chunk_id for chunk_id, _ in base.bm25.search(question, k=3)]
+    assert vector[0] == "semantic.txt" and "keyword.txt" not in vector
+    assert len(keyword) == 1 and keyword[0] in base.collection.get(where={"source": str(folder / "keyword.txt")})["ids"]
+
+    fused = names(base.query(question, n_results=3))
+    assert {"keyword.txt", "semantic.txt"} <= set(fused)
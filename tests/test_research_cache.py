@@ -0,0 +1,42 @@
+import pytest
+
+from utilities import tools
+from utilities.semantic_index import HashingEmbeddingFunction, SemanticIndex, get_chroma_client
+
+REPORT = ("Remote work and burnout. Studies of remote workers show burnout rises when work hours blur "
+          "into home life. Remote employees report longer hours and fewer breaks.")
+
+@pytest.fixture
+def semantic_research(tmp_path, monkeypatch):
+    client = get_chroma_client(str(tmp_path / "chroma"))
+    indexes = {}
+
+    def get_index(name, **options):
+        if name not in indexes:
+            indexes[name] = SemanticIndex(name, embedding_function=HashingEmbeddingFunction(), client=client, **options)
+        return indexes[name]
+
+    runs = []
+
+    def run_research(query):
+        runs.append(query)
+        return REPORT
+
+    monkeypatch.setattr(tools, "get_semantic_index", get_index)
+    monkeypatch.setattr(tools, "run_research", run_research)
+    monkeypatch.setattr(tools, "post", lambda *args, **kwargs: None)
+    # The hashing embedder scores a question against a report lower than a real embedding model
+    monkeypatch.setattr(tools, "RESEARCH_REPORT_THRESHOLD", 0.5)
+    tools.research_cache.clear()
+    return runs
+
+def test_question_close_to_a_stored_report_reuses_it(semantic_research):
+    tools.research("remote employees and long hours")
+    second = tools.research("does remote work cause burnout")
+    assert semantic_research == ["remote employees and long hours"]
+    assert "Remote work and burnout" in second
+
+def test_unrelated_question_runs_new_research(semantic_research):
+    tools.research("remote employees and long hours")
+    tools.research("history of the roman empire")
+    assert len(semantic_research) == 2
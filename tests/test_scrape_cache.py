@@ -0,0 +1,80 @@
+import time
+import asyncio
+
+import pytest
+
+from utilities import tools
+from utilities.cache import canonical_url
+
+PAGE = b"<html><body><article><p>Burnout is a state of chronic workplace stress.</p></article></body></html>"
+
+@pytest.fixture
+def sites(stand_in, monkeypatch):
+    # The origin serves the page with its own validators, browserless renders it with different ones
+    def origin(method, path, headers, body):
+        if headers.get("If-None-Match") == '"origin-v1"':
+            return 304, {"ETag": '"origin-v1"'}, b""
+        return 200, {"ETag": '"origin-v1"', "Content-Type": "text/html"}, PAGE
+
+    def browserless(method, path, headers, body):
+        return 200, {"ETag": '"browserless"', "Content-Type": "text/html"}, PAGE
+
+    servers = {"origin": stand_in(origin), "browserless": stand_in(browserless)}
+    monkeypatch.setattr(tools, "BROWSERLESS_URL", f"{servers['browserless'].url}/content")
+    tools.scrape_cache.clear()
+    return servers
+
+# The validators are filled in by a background HEAD request after the scrape returned
+def stored_record(url, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        record = tools.scrape_cache.lookup(canonical_url(url)).value
+        if record["etag"] or time.monotonic() > deadline:
+            return record
+        time.sleep(0.01)
+
+def expire(url):
+    key = canonical_url(url)
+    tools.scrape_cache.set(key, tools.scrape_cache.lookup(key).value, ttl=-1)
+
+def test_validators_come_from_the_origin(sites):
+    url = f"{sites['origin'].url}/burnout"
+    assert "chronic workplace stress" in tools.scrape(url)
+    assert stored_record(url)["etag"] == '"origin-v1"'
+
+def test_expired_page_is_revalidated_against_the_origin(sites):
+    url = f"{sites['origin'].url}/burnout"
+    tools.scrape(url)
+    stored_record(url)
+    expire(url)
+    assert "chronic workplace stress" in tools.scrape(url)
+    # One HEAD for the validators, one conditional HEAD answered with 304, and a single browserless fetch
+    assert sites["origin"].count("HEAD") == 2
+    assert sites["browserless"].count("POST") == 1
+
+def test_async_scrape_revalidates_too(sites):
+    url = f"{sites['origin'].url}/burnout"
+    asyncio.run(tools.ascrape(url))
+    stored_record(url)
+    expire(url)
+    asyncio.run(tools.ascrape(url))
+    assert stored_record(url)["etag"] == '"origin-v1"'
+    assert sites["browserless"].count("POST") == 1
+
+def test_failed_fetch_sends_no_head_request(stand_in, monkeypatch):
+    site = stand_in(lambda method, path, headers, body: (500, {}, b""))
+    monkeypatch.setattr(tools, "BROWSERLESS_URL", f"{site.url}/content")
+    tools.scrape_cache.clear()
+    assert tools.scrape(f"{site.url}/down") is None
+    assert site.count("HEAD") == 0
+
+def test_page_cached_without_summary_is_summarized_on_a_later_hit(sites, monkeypatch):
+    summaries = []
+    monkeypatch.setattr(tools, "needs_summary", lambda text, model: True)
+    monkeypatch.setattr(tools, "summary", lambda text: summaries.append(text) or "Short summary.")
+    url = f"{sites['origin'].url}/burnout"
+    assert "chronic workplace stress" in tools.scrape(url, summarize=False)
+    assert tools.scrape(url) == "Short summary."
+    assert tools.scrape(url) == "Short summary."
+    assert tools.scrape(url, summarize=False) != "Short summary."
+    assert len(summaries) == 1 and sites["browserless"].count("POST") == 1
@@ -0,0 +1,15 @@
+from utilities.tools import combine_pages, page_budgets
+
+def test_short_pages_leave_their_budget_to_long_ones():
+    assert page_budgets([100, 5000, 20000], 12000) == [100, 5000, 6900]
+    assert page_budgets([9000, 9000], 12000) == [6000, 6000]
+    assert sum(page_budgets([30000] * 8, 24000)) == 24000
+
+def test_combined_pages_stay_within_the_budget():
+    urls = ["https://a.example/1", "https://b.example/2", "https://c.example/3"]
+    pages = ["short page", "x" * 50000, ValueError("timeout")]
+    combined = combine_pages(urls, pages, 12000)
+    assert "short page" in combined
+    assert "Failed to scrape: timeout" in combined
+    assert combined.count("x") > 11000
+    assert len(combined) < 12200
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from utilities import tools
+from utilities.cache import normalize_query
+
+RESULTS = {"organic": [{"title": "Burnout", "link": "https://example.com/burnout"}]}
+
+@pytest.fixture
+def serper(stand_in, monkeypatch):
+    server = stand_in(RESULTS)
+    monkeypatch.setattr(tools, "SERPER_URL", f"{server.url}/search")
+    monkeypatch.setattr(tools, "serper_api_key", "test-key")
+    tools.search_cache.clear()
+    return server
+
+def test_second_search_is_a_cache_hit(serper):
+    first = tools.search("Burnout at work", num=5)
+    second = tools.search("burnout  at WORK!", num=5)
+    assert first == second
+    assert '"Burnout"' in first
+    assert len(serper.requests) == 1
+    assert tools.search_cache.stats()["hits"] == 1
+
+def test_result_count_is_part_of_the_key(serper):
+    tools.search("Burnout at work", num=5)
+    tools.search("Burnout at work", num=10)
+    assert len(serper.requests) == 2
+
+def test_async_search_shares_the_cache(serper):
+    first = asyncio.run(tools.asearch("Burnout at work", num=5))
+    second = tools.search("Burnout at work", num=5)
+    assert first == second
+    assert len(serper.requests) == 1
+
+def test_symbols_keep_languages_apart():
+    assert normalize_query("C++") != normalize_query("C#")
+    assert normalize_query("What is C++?") == normalize_query("what is c++")
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from autogen import ConversableAgent
+
+from utilities.cache import DiskCache
+from utilities.speaker_selection import SpeakerSelector, SelectiveGroupChat, message_intent
+
+AGENTS = [SimpleNamespace(name="Writer"), SimpleNamespace(name="Reviewer")]
+
+def chat(content):
+    messages = [
+        {"role": "user", "name": "Admin", "content": "Plan the campaign"},
+        {"role": "user", "name": "Writer", "content": content},
+    ]
+    return SimpleNamespace(messages=messages, agent_names=[agent.name for agent in AGENTS])
+
+def test_memo_key_follows_the_shape_not_the_wording():
+    selector = SpeakerSelector(memo_depth=3)
+    first = selector.signature(chat("Here is the draft about burnout, Reviewer please take a look"), AGENTS)
+    assert first == selector.signature(chat("Draft on stigma is done, Reviewer please check it"), AGENTS)
+    assert first != selector.signature(chat("Reviewer, does the intro work?"), AGENTS)
+    assert first != selector.signature(chat("Here is the draft about burnout, please take a look"), AGENTS)
+
+def test_message_intents():
+    assert message_intent("Looks good, ready to publish. TERMINATE") == "terminate"
+    assert message_intent("Looks good to me") == "approval"
+    assert message_intent("Please revise the second paragraph") == "revision"
+    assert message_intent("Which audience is this for?") == "question"
+    assert message_intent("Here are the research notes.") == "statement"
+
+def session(task, draft):
+    agents = [ConversableAgent(name, llm_config=False, human_input_mode="NEVER") for name in ("Admin", "Writer", "Reviewer")]
+    groupchat = SelectiveGroupChat(agents=agents, messages=[
+        {"role": "user", "name": "Admin", "content": task},
+        {"role": "user", "name": "Writer", "content": draft},
+    ])
+    return groupchat, agents[1]
+
+def test_decision_is_reused_across_sessions(tmp_path):
+    calls = []
+
+    def complete(messages, llm_config):
+        calls.append(messages)
+        return "Reviewer", 10, 0.001
+
+    selector = SpeakerSelector(llm_config={"model": "test"}, cache=DiskCache("speaker", path=str(tmp_path / "speaker.sqlite")),
+                               complete=complete)
+    first, writer = session("Write a blog post about burnout", "Here is the draft on burnout for the Reviewer.")
+    second, other_writer = session("Write an article about stigma", "Draft on stigma is ready for the Reviewer.")
+
+    assert selector.select(first, writer, selector=None).name == "Reviewer"
+    assert selector.select(second, other_writer, selector=None).name == "Reviewer"
+    assert len(calls) == 1
+    assert second.selection_stats.turns == {"memo": 1}
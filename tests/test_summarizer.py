@@ -0,0 +1,82 @@
+import random
+
+from utilities.cache import DiskCache
+from utilities.summarizer import MAP_PROMPT, content_defined_chunks, map_reduce_summary
+
+def article(paragraphs=300, seed=7):
+    words = random.Random(seed)
+    return "\n".join(
+        " ".join(words.choice(["burnout", "stress", "work", "team", "sleep", "rest", "focus"]) for _ in range(words.randint(20, 80)))
+        + f" (paragraph {index})."
+        for index in range(paragraphs)
+    )
+
+# A new paragraph near the top, long enough to shift every later boundary of a greedy splitter
+def edit(text):
+    return text.replace("(paragraph 2).", "(paragraph 2).\n" + "An editor added this paragraph. " * 45, 1)
+
+class RecordingModel:
+    def __init__(self, answer_chars=200):
+        self.prompts = []
+        self.answer_chars = answer_chars
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return "s" * self.answer_chars
+
+def test_chunks_keep_every_paragraph_within_the_size():
+    text = article()
+    chunks = content_defined_chunks(text, 4000, len)
+    assert max(len(chunk) for chunk in chunks) <= 4000
+    assert "\n".join(chunks) == text
+
+def test_edit_near_the_top_keeps_the_later_chunks():
+    text = article()
+    edited = edit(text)
+    before = content_defined_chunks(text, 4000, len)
+    after = content_defined_chunks(edited, 4000, len)
+    changed = set(after) - set(before)
+    assert len(before) > 20
+    assert 1 <= len(changed) <= 3
+
+def test_oversized_paragraph_is_split():
+    chunks = content_defined_chunks("Short intro.\n" + "A long sentence about rest. " * 400, 1000, len)
+    assert max(len(chunk) for chunk in chunks) <= 1000
+
+def test_only_changed_chunks_are_summarized_again(tmp_path):
+    cache = DiskCache("summary", path=str(tmp_path / "summary.sqlite"))
+    text = article()
+    edited = edit(text)
+    first = RecordingModel()
+    map_reduce_summary(content_defined_chunks(text, 4000, len), first, "test", cache=cache)
+    second = RecordingModel()
+    map_reduce_summary(content_defined_chunks(edited, 4000, len), second, "test", cache=cache)
+    # The chunks around the edit and the combine step
+    assert len(second.prompts) <= 4 < len(first.prompts)
+
+def test_combine_step_fits_the_budget():
+    model = RecordingModel(answer_chars=900)
+    chunks = [f"chunk {index}" for index in range(40)]
+    map_reduce_summary(chunks, model, "test", max_combine_tokens=4000, length=len)
+    overhead = len(MAP_PROMPT.format(text=""))
+    assert all(len(prompt) - overhead <= 4000 for prompt in model.prompts)
+    assert len(model.prompts) > len(chunks) + 1
+
+def test_single_chunk_skips_the_combine_step():
+    model = RecordingModel()
+    assert map_reduce_summary(["only chunk"], model, "test", max_combine_tokens=4000, length=len) == "s" * 200
+    assert len(model.prompts) == 1
+
+def test_oversize_chunk_summary_is_condensed_not_cut():
+    # The first chunk's summary is twice the room it gets in the combine step, with a fact at its end
+    def model(prompt):
+        model.prompts.append(prompt)
+        if "first chunk" in prompt:
+            return "x " * 1900 + "FACT"
+        if "FACT" in prompt:
+            return "condensed FACT"
+        return "short"
+    model.prompts = []
+    map_reduce_summary(["first chunk", "second chunk"], model, "test", max_combine_tokens=4000, length=len)
+    combined = model.prompts[-1]
+    assert "condensed FACT" in combined and "x x" not in combined
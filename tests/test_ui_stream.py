@@ -0,0 +1,42 @@
+import asyncio
+
+import chainlit as cl
+
+from utilities import ui_stream
+from utilities.ui_stream import UIStream
+
+class Sent:
+    def __init__(self, content, author=None, log=None):
+        self.content, self.author, self.log = content, author, log
+
+    async def send(self):
+        self.log.append((self.author, self.content))
+
+def test_post_from_the_event_loop_without_a_stream(monkeypatch):
+    log = []
+
+    def run_sync(coroutine):
+        coroutine.close()
+        raise AssertionError("run_sync would block the event loop")
+
+    monkeypatch.setattr(cl, "run_sync", run_sync)
+    monkeypatch.setattr(ui_stream, "current_stream", lambda: None)
+
+    async def handler():
+        ui_stream.post_message(Sent("image", "Graphic_Designer", log))
+        await asyncio.sleep(0)
+
+    asyncio.run(handler())
+    assert log == [("Graphic_Designer", "image")]
+
+def test_merging_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(cl, "Message", lambda content, author: (author, content))
+
+    async def batches():
+        loop = asyncio.get_running_loop()
+        batch = [("Writer", "one"), ("Writer", "two")]
+        return UIStream(loop).coalesced(batch), UIStream(loop, merge=False).coalesced(batch)
+
+    merged, separate = asyncio.run(batches())
+    assert merged == [("Writer", "one\n\ntwo")]
+    assert separate == [("Writer", "one"), ("Writer", "two")]
@@ -0,0 +1,47 @@
+import copy
+import threading
+from collections import defaultdict
+
+# Immutable description of an agent: class, system message, function schemas and llm config.
+# Templates are built once per process, every session gets an instance cloned from a shared
+# prototype. The clone shares the configuration and only owns the conversation state.
+class AgentTemplate:
+    def __init__(self, agent_class, **kwargs):
+        self.agent_class = agent_class
+        self.kwargs = kwargs
+        self._prototype = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.kwargs["name"]
+
+    # Full construction, only runs once per template
+    def build(self):
+        return self.agent_class(**self.kwargs)
+
+    def prototype(self):
+        if self._prototype is None:
+            with self._lock:
+                if self._prototype is None:
+                    self._prototype = self.build()
+        return self._prototype
+
+    def instance(self):
+        prototype = self.prototype()
+        agent = copy.copy(prototype)
+        # Conversation state (messages, auto reply counters, stop flags) lives in defaultdicts keyed by peer
+        for attribute, value in vars(prototype).items():
+            if isinstance(value, defaultdict):
+                factory = value.default_factory
+                if getattr(factory, "__self__", None) is prototype:
+                    factory = getattr(agent, factory.__name__)
+                setattr(agent, attribute, defaultdict(factory))
+        # update_system_message edits the message in place, registered replies can differ per session
+        agent._oai_system_message = [dict(message) for message in prototype._oai_system_message]
+        agent._reply_func_list = list(prototype._reply_func_list)
+        return agent
+
+# One instance of every template, keyed like the templates
+def instantiate(templates):
+    return {key: template.instance() for key, template in templates.items()}
@@ -0,0 +1,64 @@
+import os
+import re
+import hashlib
+import threading
+
+# Tool outputs longer than this are stored and passed around as a handle plus a preview
+ARTIFACT_MIN_CHARS = int(os.getenv("ARTIFACT_MIN_CHARS", 2000))
+ARTIFACT_PREVIEW_CHARS = int(os.getenv("ARTIFACT_PREVIEW_CHARS", 500))
+
+ARTIFACT_STORE = "Artifact Store"
+HANDLE = re.compile(r"artifact://[a-z_]+/[0-9a-f]{12}")
+
+# Large tool outputs of one session. Agents see a handle and a preview in the chat,
+# the tools that consume the output dereference the handle to get the full text.
+class ArtifactStore:
+    def __init__(self):
+        self.artifacts = {}
+        self._lock = threading.Lock()
+
+    def put(self, kind, content):
+        handle = f"artifact://{kind}/{hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]}"
+        with self._lock:
+            self.artifacts[handle] = content
+        return handle
+
+    def get(self, handle):
+        with self._lock:
+            return self.artifacts.get(handle)
+
+    # Handle and preview in place of the full text, short outputs are returned as they are
+    def reference(self, kind, content, min_chars=ARTIFACT_MIN_CHARS, preview_chars=ARTIFACT_PREVIEW_CHARS):
+        if not isinstance(content, str) or len(content) < min_chars:
+            return content
+        handle = self.put(kind, content)
+        preview = content[:preview_chars].rstrip()
+        return (f"[{handle}, {len(content):,} chars]\n{preview}...\n"
+                f"(Preview only. Pass {handle} to a tool that needs the full text.)")
+
+    # Replace the handles in a tool argument with the stored text, unknown handles are left as they are
+    def resolve(self, text):
+        if not isinstance(text, str):
+            return text
+        handles = HANDLE.findall(text)
+        if not handles:
+            return text
+        # An argument that is just a reference, preview included, becomes the full text
+        if len(set(handles)) == 1 and self.get(handles[0]) is not None and text.lstrip().startswith(f"[{handles[0]}"):
+            return self.get(handles[0])
+        return HANDLE.sub(lambda match: self.get(match.group(0)) or match.group(0), text)
+
+default_store = ArtifactStore()
+
+# One store per Chainlit session, outside of a session (scripts, benchmarks) a process-wide one
+def get_artifact_store():
+    try:
+        import chainlit as cl
+
+        store = cl.user_session.get(ARTIFACT_STORE)
+        if store is None:
+            store = ArtifactStore()
+            cl.user_session.set(ARTIFACT_STORE, store)
+        return store
+    except Exception:
+        return default_store
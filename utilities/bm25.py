@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, defaultdict
+
+CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+# Words, plus character bigrams for CJK runs which have no spaces between words
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r"\w+", text.casefold()):
+        if CJK.search(word) and len(word) > 1:
+            tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+        else:
+            tokens.append(word)
+    return tokens
+
+# In-process BM25 inverted index, catches exact names of talks and speakers that embeddings miss
+class BM25Index:
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.terms = {}
+        self.lengths = {}
+        self.sources = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, doc_id, text, source=None):
+        with self._lock:
+            self._remove(doc_id)
+            counts = Counter(tokenize(text))
+            for term, count in counts.items():
+                self.postings[term][doc_id] = count
+            self.terms[doc_id] = list(counts)
+            length = sum(counts.values())
+            self.lengths[doc_id] = length
+            self.sources[doc_id] = source
+            self.total_length += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def remove_source(self, source, keep=None):
+        with self._lock:
+            for doc_id in [doc_id for doc_id, value in self.sources.items() if value == source]:
+                if keep is None or not keep(doc_id):
+                    self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        if doc_id not in self.lengths:
+            return
+        for term in self.terms.pop(doc_id, []):
+            postings = self.postings.get(term, {})
+            postings.pop(doc_id, None)
+            if not postings:
+                self.postings.pop(term, None)
+        self.total_length -= self.lengths.pop(doc_id)
+        self.sources.pop(doc_id, None)
+
+    def search(self, query, k=10):
+        with self._lock:
+            if not self.lengths:
+                return []
+            count = len(self.lengths)
+            average = self.total_length / count
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = frequency + self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"postings": self.postings, "lengths": self.lengths, "sources": self.sources}
+            with open(self.path + ".tmp", "w") as file:
+                json.dump(data, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def load(self):
+        with open(self.path) as file:
+            data = json.load(file)
+        self.postings = defaultdict(dict, data["postings"])
+        self.terms = defaultdict(list)
+        for term, postings in self.postings.items():
+            for doc_id in postings:
+                self.terms[doc_id].append(term)
+        self.terms = dict(self.terms)
+        self.lengths = data["lengths"]
+        self.sources = data["sources"]
+        self.total_length = sum(self.lengths.values())
+
+    def clear(self):
+        with self._lock:
+            self.postings = defaultdict(dict)
+            self.terms = {}
+            self.lengths = {}
+            self.sources = {}
+            self.total_length = 0
+
+# Reciprocal rank fusion of several rankings of ids
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+# Cheap local reranker: exact phrase matches first, then how many query terms a chunk covers
+def rerank(query, candidates):
+    terms = set(tokenize(query))
+    phrase = " ".join(tokenize(query))
+
+    def key(candidate):
+        tokens = tokenize(candidate["text"])
+        coverage = len(terms & set(tokens)) / max(len(terms), 1)
+        exact = 1 if phrase and phrase in " ".join(tokens) else 0
+        return (exact, coverage, candidate["score"])
+
+    return sorted(candidates, key=key, reverse=True)
@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_DIR = os.getenv("CACHE_DIR", "./cache")
+CACHE_DB = os.path.join(CACHE_DIR, "tools.sqlite")
+
+CacheEntry = namedtuple("CacheEntry", ["value", "created_at", "expires_at", "fresh"])
+
+# Fold case, punctuation and whitespace so near-identical queries share a key.
+# "+" and "#" right after a word are kept, "C++" and "C#" are different queries.
+def normalize_query(query):
+    query = str(query).casefold()
+    query = re.sub(r"[^\w\s+#]", " ", query)
+    query = re.sub(r"(?<![\w+#])[+#]+", " ", query)
+    return " ".join(query.split())
+
+# Query parameters that only track the visitor and never change the page content
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src"}
+
+# Drop fragments and tracking params, lowercase scheme/host and sort the query
+def canonical_url(url):
+    parts = urlsplit(str(url).strip())
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ]
+    netloc = parts.netloc.lower()
+    if parts.scheme == "http" and netloc.endswith(":80"):
+        netloc = netloc[:-3]
+    if parts.scheme == "https" and netloc.endswith(":443"):
+        netloc = netloc[:-4]
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or "/", urlencode(sorted(query)), ""))
+
+# SQLite backed key/value cache with per-entry TTL and LRU eviction.
+# One database file can hold several caches, each in its own namespace.
+# Expired entries are kept for `grace` seconds so callers can revalidate them.
+class DiskCache:
+    def __init__(self, namespace, path=CACHE_DB, ttl=None, max_entries=None, max_bytes=None, grace=0):
+        self.namespace = namespace
+        self.path = path
+        self.ttl = ttl
+        self.grace = grace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at)"
+        )
+
+    def lookup(self, key):
+        # Return the entry even when it has expired, callers decide whether to revalidate
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at, expires_at = row
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (time.time(), self.namespace, key),
+            )
+        fresh = expires_at is None or expires_at > time.time()
+        return CacheEntry(json.loads(value), created_at, expires_at, fresh)
+
+    def get(self, key, default=None):
+        entry = self.lookup(key)
+        if entry is None or not entry.fresh:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry.value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = json.dumps(value)
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO entries
+                (namespace, key, value, size, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (self.namespace, key, data, len(data), now, now, expires_at),
+            )
+            self._evict()
+
+    # Replace the value of an existing entry and keep its age, returns False when the entry is gone
+    def update(self, key, value):
+        data = json.dumps(value)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE entries SET value = ?, size = ? WHERE namespace = ? AND key = ?",
+                (data, len(data), self.namespace, key),
+            )
+            if cursor.rowcount:
+                self._evict()
+        return cursor.rowcount > 0
+
+    def touch(self, key, ttl=None):
+        # Mark an entry as fresh again, used after a successful revalidation
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET created_at = ?, accessed_at = ?, expires_at = ? WHERE namespace = ? AND key = ?",
+                (now, now, now + ttl if ttl else None, self.namespace, key),
+            )
+
+    def keys(self, limit=None):
+        # Fresh keys, most recently used first
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT key FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)
+                ORDER BY accessed_at DESC LIMIT ?""",
+                (self.namespace, time.time(), -1 if limit is None else limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self):
+        self._conn.execute(
+            "DELETE FROM entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, time.time() - self.grace),
+        )
+        if self.max_entries:
+            self._conn.execute(
+                """DELETE FROM entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM entries WHERE namespace = ?
+                    ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+        if self.max_bytes:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed_at ASC",
+                    (self.namespace,),
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+                    )
+                    total -= size
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?",
+                (self.namespace,),
+            ).fetchone()
+        return {
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
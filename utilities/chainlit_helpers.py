@@ -1,15 +1,17 @@
-import autogen
-from autogen import Agent, AssistantAgent, UserProxyAgent
+from autogen import Agent, AssistantAgent, UserProxyAgent, ConversableAgent
 
-import json
+import time
+import threading
+from collections import defaultdict
 
 from typing import Dict, Optional, Union
-from datetime import datetime
 
 import chainlit as cl
 
+from utilities.context import CONTEXT_COMPACTION, get_context_manager, model_of
+from utilities.tracing import span
+from utilities.ui_stream import post, drain_sync
 
-logs_filename = f"logs/conversations_{datetime.now().timestamp()}.json"
 
 async def ask_helper(func, **kwargs):
     res = await func(**kwargs).send()
@@ -17,13 +19,18 @@ async def ask_helper(func, **kwargs):
         res = await func(**kwargs).send()
     return res
 
-def save_logs(logs_filename=logs_filename):
-    logs = autogen.ChatCompletion.logged_history
-    json.dump(logs, open(logs_filename, "w"), 
-                indent=4)
-    return logs
+_human_input_locks = threading.Lock()
 
-async def message_helper(data):
+# One question to the user at a time per session, chats running side by side (workflow stages) take turns
+def human_input_lock():
+    with _human_input_locks:
+        lock = cl.user_session.get("human_input_lock")
+        if lock is None:
+            lock = threading.Lock()
+            cl.user_session.set("human_input_lock", lock)
+    return lock
+
+def message_content(data):
     content = ""
     if type(data["message"]) is str:
         message = data["message"]
@@ -33,13 +40,36 @@ async def message_helper(data):
             message = data["message"]["content"]
             content = f'*Sending message to "{data["recipient"]}":*\n\n ** Response from calling function "{data["message"]["name"]}" ** \n\n{message}'
         print('message: ', data["message"]["content"])
-    if content:
-        await cl.Message(
-            content=content,
-            author=data["author"],
-        ).send()
+    return content
+
+# Assistant that works on a compacted window of the history, without showing anything in the UI
+class CompactingAssistantAgent(AssistantAgent):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (time, prompt tokens before, after compaction) of every model call, per sender
+        self.context_rounds = defaultdict(list)
+        # Compact the history right before the model call, after function calls and termination are handled
+        position = next(
+            index for index, entry in enumerate(self._reply_func_list)
+            if entry["reply_func"] is ConversableAgent.generate_oai_reply
+        )
+        self.register_reply([Agent, None], CompactingAssistantAgent.generate_compact_reply, position=position)
+
+    def generate_compact_reply(self, messages=None, sender=None, config=None):
+        if not CONTEXT_COMPACTION or self.llm_config is False:
+            return False, None
+        if messages is None:
+            messages = self._oai_messages[sender]
+        window, before, after = get_context_manager().compact(messages, agent=self.name, model=model_of(self.llm_config))
+        self.context_rounds[sender].append((time.perf_counter(), before, after))
+        return self.generate_oai_reply(window, sender, config)
+
+    # Every turn of an agent is a round span, model and tool calls of the turn are nested in it
+    def generate_reply(self, messages=None, sender=None, exclude=None):
+        with span("round", **{"agent.name": self.name, "agent.sender": getattr(sender, "name", None)}):
+            return super().generate_reply(messages=messages, sender=sender, exclude=exclude)
 
-class ChainlitAssistantAgent(AssistantAgent):
+class ChainlitAssistantAgent(CompactingAssistantAgent):
     def send(
         self,
         message: Union[Dict, str],
@@ -47,10 +77,10 @@ class ChainlitAssistantAgent(AssistantAgent):
         request_reply: Optional[bool] = None,
         silent: Optional[bool] = False,
     ) -> bool:
-        message_content = {"author": self.name, "recipient": recipient.name, "message": message}
-        cl.run_sync(
-            message_helper(message_content)
-        )
+        # Queued for the UI, the conversation goes on while it is delivered
+        content = message_content({"author": self.name, "recipient": recipient.name, "message": message})
+        if content:
+            post(content, self.name)
         super(ChainlitAssistantAgent, self).send(
             message=message,
             recipient=recipient,
@@ -59,7 +89,17 @@ class ChainlitAssistantAgent(AssistantAgent):
         )
 
 class ChainlitUserProxyAgent(UserProxyAgent):
+    def generate_reply(self, messages=None, sender=None, exclude=None):
+        with span("round", **{"agent.name": self.name, "agent.sender": getattr(sender, "name", None)}):
+            return super().generate_reply(messages=messages, sender=sender, exclude=exclude)
+
     def get_human_input(self, prompt: str) -> str:
+        with human_input_lock():
+            return self.ask_human(prompt)
+
+    def ask_human(self, prompt):
+        # The conversation so far has to be on screen before the question
+        drain_sync()
         if prompt.startswith(
             "Please give feedback to"
         ):
@@ -100,12 +140,7 @@ class ChainlitUserProxyAgent(UserProxyAgent):
         request_reply: Optional[bool] = None,
         silent: Optional[bool] = False,
     ):
-        cl.run_sync(
-            cl.Message(
-                content=f'*Sending message to "{recipient.name}"*:\n\n{message}',
-                author=self.name,
-            ).send()
-        )
+        post(f'*Sending message to "{recipient.name}"*:\n\n{message}', self.name)
         super(ChainlitUserProxyAgent, self).send(
             message=message,
             recipient=recipient,
@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+import threading
+from collections import Counter
+
+from utilities.cache import CACHE_DIR, DiskCache
+from utilities.completion_hooks import add_completion_hook, remove_completion_hook
+
+# "cache" reuses answers of deterministic (temperature 0) calls, "record" calls the model and stores every answer,
+# "replay" answers every call from a recording and never reaches the model, "off" disables it
+LLM_CACHE = os.getenv("LLM_CACHE", "cache")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm.sqlite"))
+LLM_CACHE_NAMESPACE = os.getenv("LLM_CACHE_NAMESPACE", "completions")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 60 * 60))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# Calls sampled above this temperature are only cached when recording
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0))
+
+# Parameters that pick the endpoint or the retry policy, they never change the answer
+TRANSPORT_PARAMS = {
+    "config_list", "api_key", "api_base", "api_type", "api_version", "organization",
+    "request_timeout", "timeout", "retry_wait_time", "max_retry_period",
+    "use_cache", "seed", "raise_on_ratelimit_or_timeout",
+}
+
+class ReplayMiss(Exception):
+    pass
+
+def canonical_messages(messages):
+    return [{key: value for key, value in message.items() if value is not None} for message in messages or []]
+
+# Everything that decides the answer, serialized the same way whatever the dict order
+def canonical_request(params, context=None):
+    request = {key: value for key, value in params.items() if key not in TRANSPORT_PARAMS}
+    if params.get("config_list"):
+        request["model"] = [config.get("model") for config in params["config_list"]]
+    request["messages"] = canonical_messages(params.get("messages"))
+    if context:
+        request["context"] = context
+    return json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def request_key(params, context=None):
+    return hashlib.sha256(canonical_request(params, context).encode("utf-8")).hexdigest()
+
+# Completion cache in front of oai.ChatCompletion.create, shared by every agent, sub-chat and helper of the process
+class CompletionCache:
+    def __init__(self, mode=LLM_CACHE, cache=None, max_temperature=LLM_CACHE_MAX_TEMPERATURE):
+        self.mode = mode
+        self.cache = cache
+        self.max_temperature = max_temperature
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.saved_cost = 0.0
+        # Sampled calls repeat with different answers, recordings keep them apart by occurrence
+        self.occurrences = Counter()
+        self._lock = threading.Lock()
+
+    def deterministic(self, params):
+        return params.get("temperature", 1) <= self.max_temperature and params.get("n", 1) == 1
+
+    def key(self, params, context=None):
+        key = request_key(params, context)
+        if self.deterministic(params):
+            return key
+        with self._lock:
+            occurrence = self.occurrences[key]
+            self.occurrences[key] += 1
+        return f"{key}:{occurrence}"
+
+    def create(self, create, context=None, **params):
+        # Filters are arbitrary code, their calls can't be keyed
+        if self.mode == "off" or params.get("filter_func") is not None:
+            return create(context=context, **params)
+        if self.mode == "cache" and not self.deterministic(params):
+            return create(context=context, **params)
+
+        key = self.key(params, context)
+        if self.mode != "record":
+            response = self.cache.get(key)
+            if response is not None:
+                usage = response.get("usage", {})
+                with self._lock:
+                    self.hits += 1
+                    self.saved_tokens += usage.get("total_tokens", 0)
+                    self.saved_cost += response.get("cost", 0)
+                # Nothing was spent on a cached answer
+                return {**response, "cost": 0, "cached": True}
+            if self.mode == "replay":
+                last = (params.get("messages") or [{}])[-1]
+                raise ReplayMiss(f"No recorded completion for {key[:12]} (last message: {str(last.get('content'))[:80]!r})")
+
+        with self._lock:
+            self.misses += 1
+        response = create(context=context, **params)
+        # Failed calls return -1 or raise, only answers are stored
+        if isinstance(response, dict) and response.get("choices"):
+            self.cache.set(key, json.loads(json.dumps(response)), ttl=0 if self.mode == "record" else None)
+        return response
+
+    # Closest to the model of the completion hooks when installed first, tracing and logs see its hits
+    def install(self):
+        add_completion_hook(self.create)
+        return self
+
+    def uninstall(self):
+        remove_completion_hook(self.create)
+
+    def reset(self):
+        with self._lock:
+            self.occurrences.clear()
+
+    def summary(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return (f"{self.mode}: {self.hits}/{total} calls from cache, "
+                    f"{self.saved_tokens} tokens and ${self.saved_cost:.4f} saved")
+
+completion_cache = None
+_completion_lock = threading.Lock()
+
+def get_completion_cache():
+    global completion_cache
+    if completion_cache is None:
+        with _completion_lock:
+            if completion_cache is None:
+                cache = DiskCache(LLM_CACHE_NAMESPACE, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES)
+                completion_cache = CompletionCache(cache=cache)
+    return completion_cache
+
+# Wrap the model calls of the whole process, once
+def install_completion_cache():
+    if LLM_CACHE == "off":
+        return None
+    return get_completion_cache().install()
@@ -0,0 +1,38 @@
+import threading
+import functools
+
+from autogen import oai
+
+# Everything that wraps oai.ChatCompletion.create (completion cache, tracing, conversation log, benchmark meters)
+# goes through one patch. A hook is called as hook(create, **params) and returns the response, usually by calling
+# create(**params). Hooks run in the order they were added, the first one added is the closest to the model.
+completion_hooks = []
+_model_create = None
+_hooks_lock = threading.Lock()
+
+def chained_create(*args, **params):
+    # With a config list autogen calls create again for each config, positionally. Only the outer call is hooked.
+    if args:
+        return _model_create(*args, **params)
+    create = _model_create
+    for hook in list(completion_hooks):
+        create = functools.partial(hook, create)
+    return create(**params)
+
+_installed = staticmethod(chained_create)
+
+# Adding a hook twice is a no-op, so every install function can be called more than once
+def add_completion_hook(hook):
+    global _model_create
+    with _hooks_lock:
+        if oai.ChatCompletion.__dict__.get("create") is not _installed:
+            _model_create = oai.ChatCompletion.create
+            oai.ChatCompletion.create = _installed
+        if hook not in completion_hooks:
+            completion_hooks.append(hook)
+    return hook
+
+def remove_completion_hook(hook):
+    with _hooks_lock:
+        if hook in completion_hooks:
+            completion_hooks.remove(hook)
@@ -0,0 +1,152 @@
+import os
+import hashlib
+import threading
+
+from autogen import oai, config_list_from_json
+
+from utilities.cache import DiskCache
+from utilities.artifacts import get_artifact_store
+from utilities.tokens import context_window, count_message_tokens
+
+# Agents get a window of the group chat instead of the whole history: the last messages verbatim,
+# older ones as cached block summaries, large tool outputs of other agents as artifact handles
+CONTEXT_COMPACTION = os.getenv("CONTEXT_COMPACTION", "1") == "1"
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", 8))
+# Older messages are summarized in fixed blocks, so a block is summarized once however long the chat gets
+CONTEXT_BLOCK_MESSAGES = int(os.getenv("CONTEXT_BLOCK_MESSAGES", 6))
+# Share of the agent model's context the window may take, the rest is system message and answer
+CONTEXT_WINDOW_SHARE = float(os.getenv("CONTEXT_WINDOW_SHARE", 0.6))
+CONTEXT_TOOL_MAX_CHARS = int(os.getenv("CONTEXT_TOOL_MAX_CHARS", 2000))
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-3.5-turbo-16k")
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", 7 * 24 * 60 * 60))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", 20000))
+
+SUMMARY_PROMPT = """
+    Summarize this part of a team conversation for the agents who continue it.
+    Keep decisions, open tasks, names, links and artifact handles, drop pleasantries. Be brief.
+    "{conversation}"
+    SUMMARY:
+    """
+
+def render(messages):
+    lines = []
+    for message in messages:
+        if message.get("function_call"):
+            call = message["function_call"]
+            lines.append(f"{message.get('name', 'assistant')} called {call.get('name')}({call.get('arguments', '')})")
+        else:
+            lines.append(f"{message.get('name', message.get('role'))}: {message.get('content') or ''}")
+    return "\n\n".join(lines)
+
+def model_of(llm_config):
+    if llm_config and llm_config.get("model"):
+        return llm_config["model"]
+    if llm_config and llm_config.get("config_list"):
+        return llm_config["config_list"][0].get("model", CONTEXT_SUMMARY_MODEL)
+    return CONTEXT_SUMMARY_MODEL
+
+class ContextManager:
+    def __init__(self, recent=CONTEXT_RECENT_MESSAGES, block=CONTEXT_BLOCK_MESSAGES, window_share=CONTEXT_WINDOW_SHARE,
+                 tool_max_chars=CONTEXT_TOOL_MAX_CHARS, complete=None, cache=None):
+        self.recent = recent
+        self.block = block
+        self.window_share = window_share
+        self.tool_max_chars = tool_max_chars
+        self.complete = complete
+        self.cache = cache
+
+    # Without a model the block is cut down to the start of every message
+    def summarize_block(self, block):
+        conversation = render(block)
+        key = hashlib.sha256(conversation.encode("utf-8")).hexdigest()
+        if self.cache is not None:
+            summary = self.cache.get(key)
+            if summary is not None:
+                return summary
+        summary = None
+        if self.complete is not None:
+            try:
+                summary = self.complete(SUMMARY_PROMPT.format(conversation=conversation))
+            except Exception as e:
+                print("Context summary failed: ", e)
+        if not summary:
+            return "\n".join(line[:300] for line in conversation.split("\n\n"))
+        if self.cache is not None:
+            self.cache.set(key, summary)
+        return summary
+
+    # Only the agent that called a tool needs its full output, the others get a handle and a preview
+    def shrink_tool_outputs(self, messages, agent):
+        window = []
+        for index, message in enumerate(messages):
+            content = message.get("content")
+            if message.get("role") == "function" and isinstance(content, str) and len(content) > self.tool_max_chars:
+                caller = next((previous for previous in reversed(messages[:index]) if previous.get("function_call")), {})
+                if caller.get("role") != "assistant" and caller.get("name") != agent:
+                    message = {**message, "content": get_artifact_store().reference(message.get("name", "tool"), content, min_chars=self.tool_max_chars)}
+            window.append(message)
+        return window
+
+    # Returns the window and the prompt tokens of the history before and after.
+    # The first user message is the task, it stays verbatim in the window and is never trimmed.
+    def compact(self, messages, agent=None, model=CONTEXT_SUMMARY_MODEL):
+        cut = max(0, (len(messages) - self.recent) // self.block * self.block) if self.block else 0
+        window = [
+            {"role": "system", "content": f"Summary of messages {start + 1}-{start + self.block} of the conversation:\n"
+                                          f"{self.summarize_block(messages[start:start + self.block])}"}
+            for start in range(0, cut, self.block or 1)
+        ]
+        window += self.shrink_tool_outputs(messages[cut:], agent)
+        task = next((index for index, message in enumerate(messages) if message.get("role") == "user"), None)
+        pinned = messages[task] if task is not None else None
+        if task is not None and task < cut:
+            window.insert(0, pinned)
+
+        budget = int(context_window(model) * self.window_share)
+        while len(window) > 1 and count_message_tokens(window, model) > budget:
+            oldest = next((index for index, message in enumerate(window) if message is not pinned), None)
+            if oldest is None:
+                break
+            window.pop(oldest)
+        return window, count_message_tokens(messages, model), count_message_tokens(window, model)
+
+def summary_complete(prompt):
+    config_list = config_list_from_json("OAI_CONFIG_LIST", filter_dict={"model": [CONTEXT_SUMMARY_MODEL]})
+    if not config_list:
+        return None
+    response = oai.ChatCompletion.create(
+        messages=[{"role": "user", "content": prompt}],
+        config_list=config_list,
+        temperature=0,
+        request_timeout=int(os.getenv("GLOBAL_TIMEOUT", 120)),
+    )
+    return oai.ChatCompletion.extract_text_or_function_call(response)[0]
+
+context_manager = None
+_context_lock = threading.Lock()
+
+def get_context_manager():
+    global context_manager
+    if context_manager is None:
+        with _context_lock:
+            if context_manager is None:
+                cache = DiskCache("context", ttl=CONTEXT_CACHE_TTL, max_entries=CONTEXT_CACHE_MAX_ENTRIES)
+                context_manager = ContextManager(complete=summary_complete, cache=cache)
+    return context_manager
+
+# Prompt tokens of every model call in a chat, before and after compaction, in call order
+def context_rounds(agents, sender):
+    rounds = []
+    for agent in agents:
+        recorded = getattr(agent, "context_rounds", {})
+        rounds += [(at, agent.name, before, after) for at, before, after in recorded.get(sender, [])]
+    return [(name, before, after) for _, name, before, after in sorted(rounds)]
+
+def context_report(agents, sender):
+    rounds = context_rounds(agents, sender)
+    if not rounds:
+        return "no model calls"
+    before = sum(entry[1] for entry in rounds)
+    after = sum(entry[2] for entry in rounds)
+    per_round = ", ".join(f"{name} {before_tokens}->{after_tokens}" for name, before_tokens, after_tokens in rounds)
+    return f"{len(rounds)} calls, {before} -> {after} prompt tokens ({1 - after / max(before, 1):.0%} saved): {per_round}"
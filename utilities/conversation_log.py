@@ -0,0 +1,187 @@
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import threading
+from datetime import datetime
+
+from utilities.completion_hooks import add_completion_hook
+from utilities.tracing import current_span
+
+# Every model call is appended to a JSONL file per session by a background thread, nothing is kept in memory
+CONVERSATION_LOG = os.getenv("CONVERSATION_LOG", "1") == "1"
+CONVERSATION_LOG_DIR = os.getenv("CONVERSATION_LOG_DIR", "./logs")
+# A session file is rotated once it is this big or this old, 0 disables either limit
+CONVERSATION_LOG_MAX_BYTES = int(os.getenv("CONVERSATION_LOG_MAX_BYTES", 50 * 1024 * 1024))
+CONVERSATION_LOG_MAX_AGE = int(os.getenv("CONVERSATION_LOG_MAX_AGE", 24 * 60 * 60))
+CONVERSATION_LOG_COMPRESS = os.getenv("CONVERSATION_LOG_COMPRESS", "0") == "1"
+CONVERSATION_LOG_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_LOG_FLUSH_INTERVAL", 2))
+# Records waiting for the writer, once full new records are dropped and counted instead of blocking the agents
+CONVERSATION_LOG_QUEUE = int(os.getenv("CONVERSATION_LOG_QUEUE", 10000))
+# The whole prompt of every call repeats the history, by default only the newest message is logged
+CONVERSATION_LOG_FULL_PROMPTS = os.getenv("CONVERSATION_LOG_FULL_PROMPTS", "0") == "1"
+
+UNSAFE_CHARACTERS = re.compile(r"[^\w.-]")
+
+def session_filename(session):
+    return f"conversations_{UNSAFE_CHARACTERS.sub('_', str(session))}.jsonl"
+
+# When a file left by an earlier run was started, from its first record. Its mtime is the last write, not the start.
+def file_started(path):
+    try:
+        with open(path) as file:
+            return datetime.fromisoformat(json.loads(file.readline())["time"]).timestamp()
+    except (OSError, ValueError, KeyError, TypeError):
+        return os.path.getmtime(path)
+
+# Append-only JSONL writer with size and age based rotation, one file per session
+class LogWriter:
+    def __init__(self, directory=CONVERSATION_LOG_DIR, max_bytes=CONVERSATION_LOG_MAX_BYTES, max_age=CONVERSATION_LOG_MAX_AGE,
+                 compress=CONVERSATION_LOG_COMPRESS, flush_interval=CONVERSATION_LOG_FLUSH_INTERVAL, max_queue=CONVERSATION_LOG_QUEUE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        # When the current file of each session was started
+        self.started = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        return self
+
+    def write(self, session, record):
+        try:
+            self.queue.put_nowait((session, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Collect what else arrives within the flush interval, then write it in one go per file
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch([item for item in batch if item is not None])
+            except Exception as e:
+                print("Conversation log write failed: ", e)
+            for _ in batch:
+                self.queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write_batch(self, batch):
+        sessions = {}
+        for session, record in batch:
+            sessions.setdefault(session, []).append(json.dumps(record, default=str))
+        for session, lines in sessions.items():
+            path = os.path.join(self.directory, session_filename(session))
+            self._rotate_if_needed(path)
+            with open(path, "a") as file:
+                file.write("\n".join(lines) + "\n")
+            self.started.setdefault(path, time.time())
+            self.written += len(lines)
+
+    def _rotate_if_needed(self, path):
+        if not os.path.exists(path):
+            return
+        if path not in self.started:
+            self.started[path] = file_started(path)
+        started = self.started[path]
+        too_big = self.max_bytes and os.path.getsize(path) >= self.max_bytes
+        too_old = self.max_age and time.time() - started >= self.max_age
+        if not (too_big or too_old):
+            return
+        rotated = f"{path[:-len('.jsonl')]}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl"
+        os.replace(path, rotated)
+        del self.started[path]
+        self.rotations += 1
+        if self.compress:
+            with open(rotated, "rb") as source, gzip.open(f"{rotated}.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+
+    # Blocks until everything queued so far is on disk
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout=10)
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self.queue.qsize(), "rotations": self.rotations}
+
+def current_session():
+    try:
+        import chainlit as cl
+
+        return cl.user_session.get("id") or f"process-{os.getpid()}"
+    except Exception:
+        return f"process-{os.getpid()}"
+
+def call_record(params, response, seconds):
+    messages = params.get("messages") or []
+    span = current_span.get()
+    choices = response.get("choices", []) if isinstance(response, dict) else []
+    return {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "agent": span.owner() if span is not None else None,
+        "model": response.get("model") if isinstance(response, dict) else None,
+        "messages": messages if CONVERSATION_LOG_FULL_PROMPTS else messages[-1:],
+        "message_count": len(messages),
+        "functions": [function.get("name") for function in params.get("functions") or []],
+        "response": [choice.get("message", choice.get("text")) for choice in choices],
+        "usage": response.get("usage") if isinstance(response, dict) else None,
+        "cost": response.get("cost") if isinstance(response, dict) else None,
+        "cached": bool(response.get("cached")) if isinstance(response, dict) else False,
+        "seconds": round(seconds, 3),
+    }
+
+log_writer = None
+_log_lock = threading.Lock()
+
+def get_log_writer():
+    global log_writer
+    if log_writer is None:
+        with _log_lock:
+            if log_writer is None:
+                log_writer = LogWriter().start()
+    return log_writer
+
+def logged_create(create, **params):
+    start = time.perf_counter()
+    response = create(**params)
+    get_log_writer().write(current_session(), call_record(params, response, time.perf_counter() - start))
+    return response
+
+# Log every model call of the process, install after tracing so records name the agent of the call.
+# The hook is only added once however often this is called.
+def install_conversation_log():
+    if not CONVERSATION_LOG:
+        return None
+    add_completion_hook(logged_create)
+    return get_log_writer()
@@ -0,0 +1,74 @@
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Tools whose result nobody waits for right away, they run in the background while the chat goes on.
+# generate_image stays inline by default, the Art_Director reviews its result in the next turns.
+PARALLEL_TOOLS = [name.strip() for name in os.getenv("PARALLEL_TOOLS", "write_content").split(",") if name.strip()]
+# Background results are joined into the chat before these agents speak
+PARALLEL_JOIN_BEFORE = [name.strip() for name in os.getenv("PARALLEL_JOIN_BEFORE", "Project_Manager").split(",") if name.strip()]
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", 4))
+
+# True inside a background call, the main chat may be prompting the user meanwhile so the call must not
+in_background = contextvars.ContextVar("in_background", default=False)
+
+def run_in_background(function, **kwargs):
+    in_background.set(True)
+    return function(**kwargs)
+
+# Runs the calls of some tools in the background for one group chat and joins their results later
+class ParallelDispatcher:
+    def __init__(self, tools=PARALLEL_TOOLS, join_before=PARALLEL_JOIN_BEFORE, workers=PARALLEL_WORKERS, notify=None):
+        self.tools = tools
+        self.join_before = join_before
+        self.notify = notify
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = []
+        self._installed = []
+
+    def wrap(self, name, function):
+        def dispatch(**kwargs):
+            # Tools read the Chainlit session from context variables
+            context = contextvars.copy_context()
+            self.pending.append((name, self.pool.submit(context.run, run_in_background, function, **kwargs), time.perf_counter()))
+            print(f"Dispatched {name} in the background")
+            return (f"{name} is running in the background, its result will be shared before the review. "
+                    "Carry on with the other tasks meanwhile.")
+        return dispatch
+
+    # Swap the tools for background versions on these agents only, the shared templates are left alone
+    def install(self, agents):
+        for agent in agents:
+            names = [name for name in self.tools if name in agent.function_map]
+            if names:
+                self._installed.append((agent, agent._function_map))
+                agent._function_map = {**agent._function_map, **{name: self.wrap(name, agent.function_map[name]) for name in names}}
+
+    def restore(self):
+        for agent, function_map in self._installed:
+            agent._function_map = function_map
+        self._installed = []
+
+    def should_join(self, speaker):
+        return bool(self.pending) and speaker.name in self.join_before
+
+    # Wait for every background call, returns their results as function messages
+    def join(self):
+        pending, self.pending = self.pending, []
+        wait([future for _, future, _ in pending])
+        messages = []
+        for name, future, started in pending:
+            try:
+                content = str(future.result())
+            except Exception as e:
+                content = f"Error: {e}"
+            print(f"Joined {name} after {time.perf_counter() - started:.1f}s")
+            if self.notify:
+                self.notify(name, content)
+            messages.append({"role": "function", "name": name, "content": content})
+        return messages
+
+    def shutdown(self):
+        self.restore()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,165 @@
+import os
+import re
+import codecs
+from html.parser import HTMLParser
+
+SCRAPE_EXTRACTOR = os.getenv("SCRAPE_EXTRACTOR", "stream")
+SCRAPE_MAX_CHARS = int(os.getenv("SCRAPE_MAX_CHARS", 100000))
+# Bytes read from the response and fed to the parser at a time
+SCRAPE_READ_CHUNK = int(os.getenv("SCRAPE_READ_CHUNK", 64 * 1024))
+
+# Tags whose content is never part of the article text. Forms are kept, WebForms pages wrap the whole body in one.
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object",
+    "nav", "aside", "button", "select", "head",
+}
+# Page banners and footers are skipped, but inside an article they hold its title and byline
+PAGE_SKIP_TAGS = {"header", "footer"}
+CONTENT_TAGS = {"article", "main"}
+
+BLOCK_TAGS = {
+    "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article", "main",
+    "blockquote", "pre", "h1", "h2", "h3", "h4", "h5", "h6", "dd", "dt", "figcaption",
+}
+
+# Elements without content, they never get an end tag
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Elements whose end tag is optional, a new one closes the one left open
+OPTIONAL_END_TAGS = {"p", "li", "dt", "dd", "tr", "td", "th", "option"}
+# None of the skipped elements can hold these, whatever is still open when they start was left unclosed
+BODY_TAGS = {"body", "main"}
+
+# Incremental parser that keeps visible text only and stops once the budget is reached.
+# Open elements are kept on a stack, so an end tag also closes what the page left open inside it.
+class TextExtractor(HTMLParser):
+    def __init__(self, max_chars=SCRAPE_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.open_tags = []
+        self.skip_depth = 0
+        self.done = False
+
+    # Open elements are (tag, skipped) pairs
+    def close_from(self, index):
+        self.skip_depth -= sum(1 for _, skipped in self.open_tags[index:] if skipped)
+        del self.open_tags[index:]
+
+    def skips(self, tag):
+        if tag in PAGE_SKIP_TAGS:
+            return not any(open_tag in CONTENT_TAGS for open_tag, _ in self.open_tags)
+        return tag in SKIP_TAGS
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BODY_TAGS and self.skip_depth:
+            self.open_tags = [(open_tag, skipped) for open_tag, skipped in self.open_tags if not skipped]
+            self.skip_depth = 0
+        if tag in OPTIONAL_END_TAGS and self.open_tags and self.open_tags[-1][0] == tag:
+            self.close_from(len(self.open_tags) - 1)
+        if tag not in VOID_TAGS:
+            skipped = self.skips(tag)
+            self.open_tags.append((tag, skipped))
+            if skipped:
+                self.skip_depth += 1
+        if tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        # An end tag without a start tag is ignored
+        for index in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[index][0] == tag:
+                self.close_from(index)
+                break
+        if tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth or self.done:
+            return
+        # Text can arrive in several pieces, so whitespace is only collapsed here and trimmed in text()
+        text = re.sub(r"\s+", " ", data)
+        if not text.strip():
+            self.parts.append(" ")
+            return
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= self.max_chars:
+            self.done = True
+
+    def text(self):
+        text = "".join(self.parts)
+        text = re.sub(r" {2,}", " ", text)
+        text = re.sub(r" *\n[\s]*", "\n", text)
+        return text.strip()[:self.max_chars]
+
+# Charset of a Content-Type header, UTF-8 when it names none or one Python doesn't know
+def charset(content_type, default="utf-8"):
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.IGNORECASE)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return default
+
+# Takes the page piece by piece as it is read and stops once the budget is reached
+class StreamExtractor:
+    def __init__(self, max_chars=SCRAPE_MAX_CHARS, encoding="utf-8"):
+        self.parser = TextExtractor(max_chars)
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    # Returns True once no more input is needed
+    def feed(self, piece):
+        if isinstance(piece, bytes):
+            piece = self.decoder.decode(piece)
+        self.parser.feed(piece)
+        return self.parser.done
+
+    def text(self):
+        self.parser.feed(self.decoder.decode(b"", final=True))
+        self.parser.close()
+        return self.parser.text()
+
+# Original full document parse, kept for comparison. It needs the whole page before it can start.
+class Bs4Extractor:
+    def __init__(self, max_chars=None, encoding="utf-8"):
+        self.max_chars = max_chars
+        self.encoding = encoding
+        self.pieces = []
+
+    def feed(self, piece):
+        self.pieces.append(piece.encode(self.encoding, errors="replace") if isinstance(piece, str) else piece)
+        return False
+
+    def text(self):
+        from bs4 import BeautifulSoup
+
+        text = BeautifulSoup(b"".join(self.pieces), 'html.parser', from_encoding=self.encoding).get_text()
+        return text[:self.max_chars] if self.max_chars else text
+
+EXTRACTORS = {
+    "stream": StreamExtractor,
+    "bs4": Bs4Extractor,
+}
+
+def get_extractor(name=SCRAPE_EXTRACTOR, max_chars=SCRAPE_MAX_CHARS, encoding="utf-8"):
+    return EXTRACTORS[name](max_chars, encoding)
+
+# Feed an extractor from a str, bytes or an iterable of byte chunks (e.g. response.iter_content())
+def extract(extractor, content, chunk_size=SCRAPE_READ_CHUNK):
+    if isinstance(content, (str, bytes)):
+        pieces = (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+    else:
+        pieces = content
+    for piece in pieces:
+        if extractor.feed(piece):
+            break
+    return extractor.text()
+
+def extract_text(content, max_chars=SCRAPE_MAX_CHARS, encoding="utf-8"):
+    return extract(StreamExtractor(max_chars, encoding), content)
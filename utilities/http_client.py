@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import weakref
+import threading
+import contextlib
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Pool config, one keep-alive pool per host with up to HTTP_POOL_MAXSIZE connections
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 120))
+# Send every request of the shared clients to a local stand-in server instead, see benchmarks/harness.py
+HTTP_STANDIN_URL = os.getenv("HTTP_STANDIN_URL")
+
+# Called with (method, url, request kwargs, response) after every request, e.g. to record fixtures
+observers = []
+
+def route(url):
+    if HTTP_STANDIN_URL:
+        return f"{HTTP_STANDIN_URL.rstrip('/')}/{quote(url, safe='')}"
+    return url
+
+def notify(method, url, kwargs, response):
+    for observer in observers:
+        observer(method, url, kwargs, response)
+
+# Latency of every request per host, shared by the sync and async clients
+class LatencyStats:
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: deque(maxlen=window))
+        self._requests = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def record(self, host, elapsed, error=False):
+        with self._lock:
+            self._latency[host].append(elapsed)
+            self._requests[host] += 1
+            if error:
+                self._errors[host] += 1
+
+    # Latency per host in milliseconds, computed over the most recent requests
+    def summary(self):
+        with self._lock:
+            hosts = {host: sorted(samples) for host, samples in self._latency.items()}
+            requests_count = dict(self._requests)
+            errors = dict(self._errors)
+
+        stats = {}
+        for host, samples in hosts.items():
+            stats[host] = {
+                "requests": requests_count.get(host, 0),
+                "errors": errors.get(host, 0),
+                "avg_ms": round(1000 * sum(samples) / len(samples), 1),
+                "p95_ms": round(1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+                "max_ms": round(1000 * samples[-1], 1),
+            }
+        return stats
+
+latency_stats = LatencyStats()
+
+# Process-wide HTTP client shared by all the tools, keeps connections alive between calls
+# and records the latency of every request per host.
+class HttpClient:
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, route(url), **kwargs)
+        except requests.RequestException:
+            latency_stats.record(host, time.perf_counter() - start, error=True)
+            raise
+        latency_stats.record(host, time.perf_counter() - start, error=response.status_code >= 500)
+        notify(method, url, kwargs, response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stats(self):
+        return latency_stats.summary()
+
+# Async counterpart for code running on the Chainlit event loop.
+# httpx clients are bound to the loop that created them, so there is one per loop.
+class AsyncHttpClient:
+    def __init__(self, pool_maxsize=HTTP_POOL_MAXSIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        import httpx
+
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_maxsize * HTTP_POOL_CONNECTIONS, max_keepalive_connections=pool_maxsize),
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            follow_redirects=True,
+        )
+
+    async def request(self, method, url, **kwargs):
+        import httpx
+
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, route(url), **kwargs)
+        except httpx.HTTPError:
+            latency_stats.record(host, time.perf_counter() - start, error=True)
+            raise
+        latency_stats.record(host, time.perf_counter() - start, error=response.status_code >= 500)
+        notify(method, url, kwargs, response)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        return await self.request("HEAD", url, **kwargs)
+
+    # Response whose body is read as it arrives, with response.aiter_bytes()
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        import httpx
+
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        try:
+            request = self.client.build_request(method, route(url), **kwargs)
+            response = await self.client.send(request, stream=True)
+        except httpx.HTTPError:
+            latency_stats.record(host, time.perf_counter() - start, error=True)
+            raise
+        try:
+            latency_stats.record(host, time.perf_counter() - start, error=response.status_code >= 500)
+            # Observers see the whole body, e.g. to record it
+            if observers:
+                await response.aread()
+                notify(method, url, kwargs, response)
+            yield response
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        return latency_stats.summary()
+
+http_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    global http_client
+    if http_client is None:
+        with _client_lock:
+            if http_client is None:
+                http_client = HttpClient()
+    return http_client
+
+async_http_clients = weakref.WeakKeyDictionary()
+
+def get_async_http_client():
+    loop = asyncio.get_running_loop()
+    client = async_http_clients.get(loop)
+    if client is None:
+        client = AsyncHttpClient()
+        async_http_clients[loop] = client
+    return client
@@ -0,0 +1,306 @@
+import os
+import time
+import json
+import hashlib
+import threading
+from functools import lru_cache
+
+from utilities.bm25 import BM25Index, reciprocal_rank_fusion, rerank
+from utilities.extract import extract_text
+from utilities.semantic_index import CHROMA_PATH, get_chroma_client, get_embedding_function
+from utilities.tracing import traced_tool
+
+KNOWLEDGE_DIR = os.getenv("KNOWLEDGE_DIR", "./knowledge")
+KNOWLEDGE_COLLECTION = os.getenv("KNOWLEDGE_COLLECTION", "langchain")
+KNOWLEDGE_CHUNK_CHARS = int(os.getenv("KNOWLEDGE_CHUNK_CHARS", 4000))
+KNOWLEDGE_BATCH_SIZE = int(os.getenv("KNOWLEDGE_BATCH_SIZE", 64))
+KNOWLEDGE_EMBED_RETRIES = int(os.getenv("KNOWLEDGE_EMBED_RETRIES", 3))
+KNOWLEDGE_MANIFEST = os.path.join(CHROMA_PATH, "knowledge_manifest.json")
+# "hybrid" fuses vector and BM25 keyword rankings, "vector" is embeddings only
+KNOWLEDGE_RETRIEVAL = os.getenv("KNOWLEDGE_RETRIEVAL", "hybrid")
+KNOWLEDGE_CANDIDATES = int(os.getenv("KNOWLEDGE_CANDIDATES", 20))
+KNOWLEDGE_RERANK = os.getenv("KNOWLEDGE_RERANK", "0") == "1"
+KNOWLEDGE_KEYWORD_MIN_SHARE = float(os.getenv("KNOWLEDGE_KEYWORD_MIN_SHARE", 0.1))
+
+SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md", ".html", ".htm"}
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Returns a list of (page, text), pages are only meaningful for PDFs
+def load_document(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        return [(number + 1, page.extract_text() or "") for number, page in enumerate(reader.pages)]
+    with open(path, "rb") as file:
+        content = file.read()
+    if extension in (".html", ".htm"):
+        return [(1, extract_text(content, max_chars=10 ** 9))]
+    return [(1, content.decode("utf-8", errors="replace"))]
+
+# Split on paragraphs into chunks of about KNOWLEDGE_CHUNK_CHARS, the last paragraph overlaps the next chunk
+def chunk_text(text, max_chars=KNOWLEDGE_CHUNK_CHARS):
+    paragraphs = [paragraph.strip() for paragraph in text.split("\n\n") if paragraph.strip()]
+    chunks, current = [], []
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and sum(len(part) for part in current) + len(paragraph) > max_chars:
+            chunks.append("\n\n".join(current))
+            current = current[-1:] if len(current[-1]) < max_chars // 2 else []
+        current.append(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# Chunk ids name the file and its version, identical files in two places never share a chunk
+def chunk_prefix(path, digest):
+    return f"{hashlib.sha256(path.encode()).hexdigest()[:12]}-{digest[:16]}"
+
+def document_chunks(path, digest):
+    chunks = []
+    prefix = chunk_prefix(path, digest)
+    for page, text in load_document(path):
+        for index, chunk in enumerate(chunk_text(text)):
+            chunks.append({
+                "id": f"{prefix}-{page}-{index}",
+                "text": chunk,
+                "metadata": {"source": path, "page": page, "fingerprint": digest},
+            })
+    return chunks
+
+def find_documents(paths):
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                documents += [os.path.join(root, name) for name in sorted(files)]
+        else:
+            documents.append(path)
+    return [path for path in documents if os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS]
+
+# Domain knowledge of Calm Collective: past talks, articles and mental health resources.
+# Chunks are embedded once at ingestion, queries only embed the question and search the index.
+# The manifest maps every fully indexed file to its fingerprint and is saved after each batch,
+# so an interrupted ingestion resumes where it stopped.
+# A BM25 index next to the manifest mirrors the collection for keyword matches on names and titles.
+class KnowledgeBase:
+    def __init__(self, collection_name=KNOWLEDGE_COLLECTION, embedding_function=None, client=None,
+                 manifest_path=KNOWLEDGE_MANIFEST, batch_size=KNOWLEDGE_BATCH_SIZE, retrieval=KNOWLEDGE_RETRIEVAL,
+                 candidates=KNOWLEDGE_CANDIDATES, rerank=KNOWLEDGE_RERANK):
+        self.embedding_function = embedding_function or get_embedding_function()
+        self.client = client or get_chroma_client()
+        self.collection = self.client.get_or_create_collection(
+            collection_name,
+            embedding_function=self.embedding_function,
+            metadata={"hnsw:space": "cosine"},
+        )
+        self.manifest_path = manifest_path
+        self.batch_size = batch_size
+        self.manifest = self._load_manifest()
+        self.retrieval = retrieval
+        self.candidates = candidates
+        self.rerank = rerank
+        self.bm25 = BM25Index(os.path.splitext(manifest_path)[0] + "_bm25.json")
+        self._lock = threading.Lock()
+        self.embed_query = lru_cache(maxsize=1024)(self._embed_query)
+        if len(self.bm25) != self.collection.count():
+            self.rebuild_keyword_index()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        return {}
+
+    def _save_manifest(self):
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.manifest_path + ".tmp", "w") as file:
+            json.dump(self.manifest, file, indent=4)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    # The keyword index is saved at the end of an ingestion, after a crash it is rebuilt from the collection
+    def rebuild_keyword_index(self):
+        self.bm25.clear()
+        entries = self.collection.get(include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"]):
+            self.bm25.add(chunk_id, text, metadata["source"])
+        self.bm25.save()
+
+    def _embed_query(self, text):
+        return self.embedding_function([text])[0]
+
+    def embed(self, texts):
+        for attempt in range(KNOWLEDGE_EMBED_RETRIES + 1):
+            try:
+                return self.embedding_function(texts)
+            except Exception as e:
+                if attempt == KNOWLEDGE_EMBED_RETRIES:
+                    raise
+                print(f"Embedding failed ({e}), retrying in {2 ** attempt}s")
+                time.sleep(2 ** attempt)
+
+    # One embedding request and one bulk write per batch
+    def write_batch(self, batch):
+        texts = [chunk["text"] for chunk in batch]
+        self.collection.upsert(
+            ids=[chunk["id"] for chunk in batch],
+            embeddings=self.embed(texts),
+            documents=texts,
+            metadatas=[chunk["metadata"] for chunk in batch],
+        )
+        for chunk in batch:
+            self.bm25.add(chunk["id"], chunk["text"], chunk["metadata"]["source"])
+
+    def add_chunks(self, chunks):
+        for start in range(0, len(chunks), self.batch_size):
+            self.write_batch(chunks[start:start + self.batch_size])
+
+    def remove_source(self, path):
+        self.collection.delete(where={"source": path})
+        self.bm25.remove_source(path)
+
+    # Chunk ids are derived from the path and fingerprint of the file, ids already stored were written before an interruption
+    def stored_ids(self, chunks):
+        if not chunks:
+            return set()
+        return set(self.collection.get(ids=[chunk["id"] for chunk in chunks], include=[])["ids"])
+
+    # Index new and changed files, drop the chunks of files that changed or disappeared.
+    # Chunks of several files share embedding batches, a file is checkpointed once all its chunks are stored.
+    def ingest(self, paths, progress=print):
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "resumed": 0, "chunks": 0}
+        documents = find_documents(paths)
+        pending, remaining = [], {}
+
+        def finish(path):
+            digest, previous, _ = remaining.pop(path)
+            self.manifest[path] = digest
+            stats["updated" if previous else "added"] += 1
+
+        def flush(batch):
+            self.write_batch(batch)
+            stats["chunks"] += len(batch)
+            for chunk in batch:
+                remaining[chunk["metadata"]["source"]][2] -= 1
+            for path in [path for path, (_, _, left) in remaining.items() if left == 0]:
+                finish(path)
+            self._save_manifest()
+            if progress:
+                progress(f"Embedded {stats['chunks']} chunks, {stats['added'] + stats['updated']} files indexed")
+
+        with self._lock:
+            for path in documents:
+                digest = fingerprint(path)
+                previous = self.manifest.get(path)
+                if previous == digest:
+                    stats["unchanged"] += 1
+                    continue
+
+                # Chunks from an older version of the file
+                self.collection.delete(where={"$and": [{"source": path}, {"fingerprint": {"$ne": digest}}]})
+                prefix = chunk_prefix(path, digest) + "-"
+                self.bm25.remove_source(path, keep=lambda chunk_id: chunk_id.startswith(prefix))
+                chunks = document_chunks(path, digest)
+                stored = self.stored_ids(chunks)
+                stats["resumed"] += len(stored)
+                todo = [chunk for chunk in chunks if chunk["id"] not in stored]
+
+                remaining[path] = [digest, previous, len(todo)]
+                if not todo:
+                    finish(path)
+                pending += todo
+                while len(pending) >= self.batch_size:
+                    flush(pending[:self.batch_size])
+                    pending = pending[self.batch_size:]
+
+            if pending:
+                flush(pending)
+
+            roots = [os.path.abspath(path) for path in paths]
+            for path in list(self.manifest):
+                absolute = os.path.abspath(path)
+                inside = any(absolute == root or absolute.startswith(root + os.sep) for root in roots)
+                if inside and path not in documents:
+                    self.remove_source(path)
+                    del self.manifest[path]
+                    stats["removed"] += 1
+            self._save_manifest()
+            self.bm25.save()
+        return stats
+
+    def vector_query(self, message, n_results):
+        result = self.collection.query(
+            query_embeddings=[self.embed_query(message)],
+            n_results=min(n_results, self.collection.count()),
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            {"id": chunk_id, "text": text, "source": metadata["source"], "page": metadata["page"], "score": 1 - distance}
+            for chunk_id, text, metadata, distance in
+            zip(result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0])
+        ]
+
+    # Top candidates of both rankings fused with reciprocal rank fusion, keyword-only hits are fetched by id
+    def hybrid_query(self, message, n_results):
+        vector = self.vector_query(message, max(n_results, self.candidates))
+        keyword = self.bm25.search(message, k=max(n_results, self.candidates))
+        # Chunks that only share common words with the question would dilute the fusion
+        keyword = [chunk_id for chunk_id, score in keyword if score >= keyword[0][1] * KNOWLEDGE_KEYWORD_MIN_SHARE]
+        fused = reciprocal_rank_fusion([[result["id"] for result in vector], keyword])
+        results = {result["id"]: result for result in vector}
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in results]
+        if missing:
+            entries = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"]):
+                results[chunk_id] = {"id": chunk_id, "text": text, "source": metadata["source"], "page": metadata["page"]}
+        ranked = []
+        for chunk_id, score in fused:
+            if chunk_id in results:
+                ranked.append({**results[chunk_id], "score": score})
+        return ranked
+
+    def query(self, message, n_results=3):
+        if self.collection.count() == 0:
+            return []
+        if self.retrieval == "hybrid":
+            results = self.hybrid_query(message, n_results)
+        else:
+            results = self.vector_query(message, max(n_results, self.candidates) if self.rerank else n_results)
+        if self.rerank:
+            results = rerank(message, results)
+        return results[:n_results]
+
+knowledge_base = None
+_knowledge_lock = threading.Lock()
+
+def get_knowledge_base():
+    global knowledge_base
+    if knowledge_base is None:
+        with _knowledge_lock:
+            if knowledge_base is None:
+                knowledge_base = KnowledgeBase()
+    return knowledge_base
+
+# Retrieve domain content for question answering, straight from the index without an LLM call
+@traced_tool
+def retrieve_content(message, n_results=3):
+    results = get_knowledge_base().query(message, n_results=int(n_results))
+    if not results:
+        return "No domain knowledge found for this question."
+    sections = []
+    for result in results:
+        source = os.path.basename(result["source"])
+        page = f" p.{result['page']}" if result["source"].lower().endswith(".pdf") else ""
+        sections.append(f"[{source}{page}]\n{result['text']}")
+    return "\n\n".join(sections)
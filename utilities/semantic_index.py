@@ -0,0 +1,121 @@
+import os
+import re
+import math
+import time
+import hashlib
+import threading
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma")
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 5000))
+# "openai" or "hashing", the hashing embedder runs offline and is deterministic
+SEMANTIC_EMBEDDINGS = os.getenv("SEMANTIC_EMBEDDINGS", "openai" if os.getenv("OPENAI_API_KEY") else "hashing")
+
+# Deterministic local embedder: words and character trigrams hashed into a fixed size vector
+class HashingEmbeddingFunction:
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        words = re.findall(r"\w+", text.casefold())
+        features = words + [word[i:i + 3] for word in words for i in range(max(len(word) - 2, 1))]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def __call__(self, input):
+        return [self.embed(text) for text in input]
+
+    def embed_query(self, input):
+        return self(input)
+
+    # Newer chromadb versions persist the embedding function config with the collection
+    @staticmethod
+    def name():
+        return "hashing"
+
+    def get_config(self):
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashingEmbeddingFunction(config.get("dimensions", 512))
+
+def get_embedding_function(name=SEMANTIC_EMBEDDINGS):
+    if name == "hashing":
+        return HashingEmbeddingFunction()
+    from chromadb.utils import embedding_functions
+
+    return embedding_functions.OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model_name="text-embedding-ada-002",
+    )
+
+def get_chroma_client(path=CHROMA_PATH):
+    import chromadb
+
+    return chromadb.PersistentClient(path=path)
+
+# Vector index over past queries, a new query close enough to a stored one reuses its cache key.
+# The results themselves stay in the DiskCache, so their TTL still applies.
+class SemanticIndex:
+    def __init__(self, name, embedding_function=None, client=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.client = client or get_chroma_client()
+        self.collection = self.client.get_or_create_collection(
+            name,
+            embedding_function=embedding_function or get_embedding_function(),
+            metadata={"hnsw:space": "cosine"},
+        )
+        self._lock = threading.Lock()
+
+    def add(self, text, key):
+        with self._lock:
+            self.collection.upsert(
+                ids=[hashlib.sha256(key.encode("utf-8")).hexdigest()],
+                documents=[text],
+                metadatas=[{"key": key, "created_at": time.time()}],
+            )
+            self._evict()
+
+    # Returns (key, similarity) of the closest stored query above the threshold
+    def match(self, text):
+        if self.collection.count() == 0:
+            return None
+        result = self.collection.query(query_texts=[text], n_results=1, include=["metadatas", "distances"])
+        if not result["ids"] or not result["ids"][0]:
+            return None
+        similarity = 1 - result["distances"][0][0]
+        if similarity < self.threshold:
+            return None
+        return result["metadatas"][0][0]["key"], similarity
+
+    def _evict(self):
+        count = self.collection.count()
+        if count <= self.max_entries:
+            return
+        # Drop the oldest tenth in one go so we don't scan the collection on every add
+        entries = self.collection.get(include=["metadatas"])
+        ordered = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda entry: entry[1]["created_at"])
+        overflow = count - self.max_entries + self.max_entries // 10
+        self.collection.delete(ids=[entry_id for entry_id, _ in ordered[:overflow]])
+
+semantic_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Indexes are created on first use, chromadb is only imported when the semantic cache is on.
+# The options only apply when the index is created.
+def get_semantic_index(name, **options):
+    if not SEMANTIC_CACHE:
+        return None
+    with _indexes_lock:
+        if name not in semantic_indexes:
+            semantic_indexes[name] = SemanticIndex(name, **options)
+        return semantic_indexes[name]
@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from collections import defaultdict
+
+import autogen
+from autogen import oai, config_list_from_json
+
+from utilities.cache import DiskCache
+from utilities.tracing import span
+
+# "rules" tries transition rules, then memoized decisions, then a cheap model.
+# "llm" keeps autogen's default of asking the manager's model on every turn.
+SPEAKER_SELECTION = os.getenv("SPEAKER_SELECTION", "rules")
+SPEAKER_SELECTION_MODEL = os.getenv("SPEAKER_SELECTION_MODEL", "gpt-3.5-turbo-16k")
+# Messages of the conversation shown to the model, the participant roles are always included
+SPEAKER_SELECTION_HISTORY = int(os.getenv("SPEAKER_SELECTION_HISTORY", 8))
+# Decisions are memoized on the shape of the last messages, 0 disables it
+SPEAKER_MEMO_DEPTH = int(os.getenv("SPEAKER_MEMO_DEPTH", 3))
+SPEAKER_CACHE_TTL = int(os.getenv("SPEAKER_CACHE_TTL", 7 * 24 * 60 * 60))
+SPEAKER_CACHE_MAX_ENTRIES = int(os.getenv("SPEAKER_CACHE_MAX_ENTRIES", 20000))
+
+# What a message asks of the team, the first matching intent wins and anything else is a "statement".
+# The memo is keyed on these instead of the wording, so chats of different sessions share decisions.
+MESSAGE_INTENTS = [
+    ("terminate", r"TERMINATE\s*$"),
+    ("approval", r"\b(approved?|looks good|lgtm|well done|great job|ready to publish)\b"),
+    ("revision", r"\b(revis\w*|feedback|improve\w*|rewrite|change|fix|suggest\w*)\b"),
+    ("question", r"\?\s*$"),
+    ("request", r"\b(please|could you|can you|would you|kindly|let's)\b"),
+]
+
+def message_intent(content, intents=MESSAGE_INTENTS):
+    text = content.casefold()
+    for intent, pattern in intents:
+        if re.search(pattern, text, re.IGNORECASE):
+            return intent
+    return "statement"
+
+# (caller, function) -> next speaker once the function result is in, other results go back to the caller
+TRANSITIONS = {
+    ("Graphic_Designer", "generate_image"): "Art_Director",
+}
+
+# Turns, latency and model spend of speaker selection, per task
+class SelectionStats:
+    def __init__(self):
+        self.turns = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.tokens = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, source, seconds, tokens=0, cost=0.0):
+        with self._lock:
+            self.turns[source] += 1
+            self.seconds[source] += seconds
+            self.tokens += tokens
+            self.cost += cost
+
+    def summary(self):
+        with self._lock:
+            total = sum(self.turns.values())
+            sources = ", ".join(
+                f"{source} {count} ({self.seconds[source] / count * 1000:.1f}ms avg)"
+                for source, count in sorted(self.turns.items())
+            )
+            return (f"{total} turns: {sources or 'none'}, "
+                    f"{sum(self.seconds.values()):.2f}s selecting, {self.tokens} tokens, ${self.cost:.4f}")
+
+def chat_complete(messages, llm_config):
+    response = oai.ChatCompletion.create(messages=messages, **llm_config)
+    text = oai.ChatCompletion.extract_text_or_function_call(response)[0]
+    return text, response.get("usage", {}).get("total_tokens", 0), response.get("cost", 0)
+
+def function_call_name(message):
+    return (message.get("function_call") or {}).get("name")
+
+# Who asked for the function whose result is the last message
+def function_caller(messages):
+    for message in reversed(messages[:-1]):
+        if "function_call" in message:
+            return message.get("name")
+    return None
+
+# Pluggable engine for GroupChat.select_speaker: transition rules, memoized decisions, then a cheap model
+class SpeakerSelector:
+    def __init__(self, transitions=TRANSITIONS, llm_config=None, cache=None, history=SPEAKER_SELECTION_HISTORY,
+                 memo_depth=SPEAKER_MEMO_DEPTH, complete=chat_complete):
+        self.transitions = transitions
+        self.llm_config = llm_config
+        self.cache = cache
+        self.history = history
+        self.memo_depth = memo_depth
+        self.complete = complete
+
+    # Same candidates as autogen: the agents able to run a suggested function, otherwise everybody
+    def candidates(self, groupchat):
+        if groupchat.messages and "function_call" in groupchat.messages[-1]:
+            name = function_call_name(groupchat.messages[-1])
+            agents = [agent for agent in groupchat.agents if agent.can_execute_function(name)]
+            return agents or [agent for agent in groupchat.agents if agent.function_map] or groupchat.agents
+        return groupchat.agents
+
+    def rule(self, groupchat, last_speaker, agents):
+        if not groupchat.messages:
+            return None
+        message = groupchat.messages[-1]
+        if "function_call" in message:
+            if len(agents) == 1:
+                return agents[0]
+            # Prefer an agent that only executes, such as the user proxy, over one that would also reply
+            executors = [agent for agent in agents if not agent.llm_config]
+            executors = executors or [agent for agent in agents if agent is not last_speaker]
+            return executors[0] if executors else None
+        if message.get("role") == "function":
+            caller = function_caller(groupchat.messages)
+            target = self.transitions.get((caller, message.get("name")), caller)
+            if target in groupchat.agent_names:
+                return groupchat.agent_by_name(target)
+        return None
+
+    # Sender, role, function call, agents mentioned and intent of the last messages, not their wording
+    def signature(self, groupchat, agents):
+        if not self.memo_depth or not groupchat.messages:
+            return None
+        names = groupchat.agent_names
+        recent = []
+        for message in groupchat.messages[-self.memo_depth:]:
+            content = message.get("content") or ""
+            if not isinstance(content, str):
+                content = json.dumps(content)
+            mentioned = [name for name in names if name in content]
+            recent.append([message.get("name"), message.get("role"), function_call_name(message),
+                           mentioned, message_intent(content)])
+        key = json.dumps([[agent.name for agent in agents], recent])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def ask_model(self, groupchat, agents, llm_config):
+        names = [agent.name for agent in agents]
+        messages = [{"role": "system", "content": groupchat.select_speaker_msg(agents)}]
+        messages += groupchat.messages[-self.history:] if self.history else groupchat.messages
+        messages.append({
+            "role": "system",
+            "content": f"Read the above conversation. Then select the next role from {names} to play. Only return the role.",
+        })
+        text, tokens, cost = self.complete(messages, llm_config)
+        text = text if isinstance(text, str) else ""
+        if text.strip() in names:
+            return groupchat.agent_by_name(text.strip()), tokens, cost
+        # Models sometimes answer with a sentence, take the first role named in it
+        found = sorted((match.start(), name) for name in names for match in [re.search(re.escape(name), text)] if match)
+        if found:
+            return groupchat.agent_by_name(found[0][1]), tokens, cost
+        return None, tokens, cost
+
+    def select(self, groupchat, last_speaker, selector):
+        start = time.perf_counter()
+        agents = self.candidates(groupchat)
+        speaker = self.rule(groupchat, last_speaker, agents)
+        if speaker is not None:
+            groupchat.selection_stats.record("rule", time.perf_counter() - start)
+            return speaker
+
+        key = self.signature(groupchat, agents)
+        if self.cache is not None and key is not None:
+            name = self.cache.get(key)
+            if name in groupchat.agent_names:
+                groupchat.selection_stats.record("memo", time.perf_counter() - start)
+                return groupchat.agent_by_name(name)
+
+        llm_config = self.llm_config or selector.llm_config
+        try:
+            speaker, tokens, cost = self.ask_model(groupchat, agents, llm_config)
+        except Exception as e:
+            print("Speaker selection failed: ", e)
+            speaker, tokens, cost = None, 0, 0
+        if speaker is None:
+            groupchat.selection_stats.record("fallback", time.perf_counter() - start, tokens, cost)
+            return groupchat.next_agent(last_speaker, agents)
+        if self.cache is not None and key is not None:
+            self.cache.set(key, speaker.name)
+        groupchat.selection_stats.record("llm", time.perf_counter() - start, tokens, cost)
+        return speaker
+
+# GroupChat with a pluggable speaker selector, without one it behaves like autogen's and is only measured.
+# With a ParallelDispatcher, background tool results are joined into the chat before the reviewer speaks.
+@dataclass
+class SelectiveGroupChat(autogen.GroupChat):
+    speaker_selector: object = None
+    selection_stats: SelectionStats = field(default_factory=SelectionStats)
+    dispatcher: object = None
+
+    def select_speaker(self, last_speaker, selector):
+        with span("select_speaker", **{"agent.name": "speaker_selection"}) as selection_span:
+            if self.speaker_selector is not None:
+                speaker = self.speaker_selector.select(self, last_speaker, selector)
+            else:
+                start = time.perf_counter()
+                speaker = super().select_speaker(last_speaker, selector)
+                self.selection_stats.record("autogen", time.perf_counter() - start)
+            if selection_span is not None:
+                selection_span.set(**{"speaker.name": speaker.name})
+        if self.dispatcher is not None and self.dispatcher.should_join(speaker):
+            for message in self.dispatcher.join():
+                self.messages.append(message)
+                for agent in self.agents:
+                    selector.send(message, agent, request_reply=False, silent=True)
+        return speaker
+
+speaker_selector = None
+_selector_lock = threading.Lock()
+
+# One selector per process, its memo is shared by every session
+def get_speaker_selector():
+    global speaker_selector
+    if SPEAKER_SELECTION != "rules":
+        return None
+    if speaker_selector is None:
+        with _selector_lock:
+            if speaker_selector is None:
+                config_list = config_list_from_json("OAI_CONFIG_LIST", filter_dict={"model": [SPEAKER_SELECTION_MODEL]})
+                llm_config = None
+                if config_list:
+                    llm_config = {
+                        "config_list": config_list,
+                        "temperature": 0,
+                        "retry_wait_time": 30,
+                        "request_timeout": int(os.getenv("GLOBAL_TIMEOUT", 120)),
+                    }
+                cache = DiskCache("speaker", ttl=SPEAKER_CACHE_TTL, max_entries=SPEAKER_CACHE_MAX_ENTRIES)
+                speaker_selector = SpeakerSelector(llm_config=llm_config, cache=cache)
+    return speaker_selector
@@ -0,0 +1,170 @@
+import re
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Reusable prompt for each content on the split chain
+MAP_PROMPT = """
+    Summarize of the following text for research purpose:
+    "{text}"
+    SUMMARY:
+    """
+
+COMBINE_PROMPT = MAP_PROMPT
+# Times an oversize chunk summary is summarized again before it is cut
+CONDENSE_ROUNDS = 3
+
+SENTENCE_END = re.compile(r"(?<=[.!?。])\s+")
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+# A paragraph ends a chunk with a chance that grows with its size, decided by its own content:
+# boundaries land about every target_tokens, wherever the paragraph sits in the text
+def is_anchor(paragraph, tokens, target_tokens):
+    return int(content_hash(paragraph)[:8], 16) / 0xFFFFFFFF < tokens / target_tokens
+
+# Lines of the extracted text (one per block element), with the ones longer than max_tokens cut at sentences
+# and then at words
+def paragraphs(text, max_tokens, length):
+    for paragraph in text.splitlines():
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if length(paragraph) <= max_tokens:
+            yield paragraph
+            continue
+        for piece in pack(SENTENCE_END.split(paragraph) if SENTENCE_END.search(paragraph) else paragraph.split(), max_tokens, length, " "):
+            yield piece
+
+# Greedy packing of parts into pieces of at most max_tokens, a part too long on its own is cut by characters
+def pack(parts, max_tokens, length, separator):
+    pieces, current, size = [], [], 0
+    joint = length(separator) if separator else 0
+    for part in parts:
+        tokens = length(part)
+        if current and size + joint + tokens > max_tokens:
+            pieces.append(separator.join(current))
+            current, size = [], 0
+        while tokens > max_tokens:
+            cut = max(int(len(part) * max_tokens / tokens), 1)
+            while cut > 1 and length(part[:cut]) > max_tokens:
+                cut = int(cut * 0.9)
+            pieces.append(part[:cut])
+            part = part[cut:]
+            tokens = length(part)
+        size += tokens + (joint if current else 0)
+        current.append(part)
+    if current:
+        pieces.append(separator.join(current))
+    return pieces
+
+# Content-defined chunks: a chunk ends after an anchor paragraph once it holds min_tokens, or before it would
+# exceed max_tokens. Anchors depend only on the paragraph itself, so an edit moves the boundaries around it and
+# the chunks after it fall back onto the same anchors, unchanged regions keep their hashes.
+def content_defined_chunks(text, max_tokens, length, min_tokens=None, target_tokens=None):
+    min_tokens = max_tokens // 10 if min_tokens is None else min_tokens
+    target_tokens = target_tokens or max_tokens * 3 // 4
+    chunks, current, size = [], [], 0
+    joint = length("\n")
+    for paragraph in paragraphs(text, max_tokens, length):
+        tokens = length(paragraph)
+        if current and size + joint + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        size += tokens + (joint if current else 0)
+        current.append(paragraph)
+        if size >= min_tokens and is_anchor(paragraph, tokens, target_tokens):
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+# Run one prompt through the LLM, reusing the stored answer for the same model & prompt
+def cached_complete(prompt, complete, model, cache=None):
+    key = content_hash(model, prompt)
+    if cache is not None:
+        output = cache.get(key)
+        if output is not None:
+            return output, True
+
+    output = complete(prompt)
+    if cache is not None:
+        cache.set(key, output)
+    return output, False
+
+def complete_with_retries(prompt, complete, model, cache=None, retries=2, retry_wait=2):
+    # Each prompt retries on its own so one failed call doesn't restart the whole summary
+    for attempt in range(retries + 1):
+        try:
+            return cached_complete(prompt, complete, model, cache)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Summary call failed ({e}), retrying in {retry_wait * (attempt + 1)}s")
+            time.sleep(retry_wait * (attempt + 1))
+
+def summarize_chunk(chunk, complete, model, cache=None, map_prompt=MAP_PROMPT, retries=2, retry_wait=2):
+    return complete_with_retries(map_prompt.format(text=chunk), complete, model, cache, retries, retry_wait)
+
+def run_all(function, count, workers):
+    if workers > 1 and count > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, count)) as executor:
+            return list(executor.map(function, range(count)))
+    return [function(index) for index in range(count)]
+
+# Map reduce summary with memoization on every chunk.
+# With more than one worker the map step fans chunks out over a bounded thread pool,
+# results keep the chunk order for the combine step.
+# The combine prompt is keyed on the joined chunk summaries, so it only reruns when one of them changed.
+# With max_combine_tokens, summaries that don't fit one combine prompt are combined in groups first, level by level.
+def map_reduce_summary(chunks, complete, model, cache=None, map_prompt=MAP_PROMPT, combine_prompt=COMBINE_PROMPT,
+                       workers=1, retries=2, retry_wait=2, max_combine_tokens=None, length=len):
+    def map_chunk(index):
+        output, cached = summarize_chunk(chunks[index], complete, model, cache, map_prompt, retries, retry_wait)
+        print(f"Summarized chunk {index + 1}/{len(chunks)}{' (cached)' if cached else ''}")
+        return output
+
+    def condense(summary):
+        # Any two summaries fit one prompt, so every level of groups is at least halved.
+        # A longer summary is summarized again piece by piece, only cut if the model keeps it too long.
+        limit = max_combine_tokens // 2
+        for _ in range(CONDENSE_ROUNDS):
+            if not summary or length(summary) <= limit:
+                return summary
+            pieces = pack([summary], limit, length, "")
+            summary = "\n\n".join(
+                complete_with_retries(map_prompt.format(text=piece), complete, model, cache, retries, retry_wait)[0]
+                for piece in pieces
+            )
+        if summary and length(summary) > limit:
+            print("Chunk summary still too long after condensing, cutting it")
+            summary = pack([summary], limit, length, "")[0]
+        return summary
+
+    summaries = run_all(map_chunk, len(chunks), workers)
+    # A page of one chunk needs no combine step
+    if len(summaries) == 1:
+        return summaries[0]
+    if max_combine_tokens:
+        summaries = run_all(lambda index: condense(summaries[index]), len(summaries), workers)
+
+    while max_combine_tokens and len(summaries) > 1 and length("\n\n".join(summaries)) > max_combine_tokens:
+        groups = pack(summaries, max_combine_tokens, length, "\n\n")
+
+        def combine_group(index):
+            output, _ = complete_with_retries(combine_prompt.format(text=groups[index]), complete, model, cache, retries, retry_wait)
+            return output
+
+        summaries = run_all(combine_group, len(groups), workers)
+        print(f"Combined summaries into {len(summaries)} groups")
+
+    combined = combine_prompt.format(text="\n\n".join(summaries))
+    output, cached = complete_with_retries(combined, complete, model, cache, retries, retry_wait)
+    print(f"Combined {len(summaries)} chunk summaries{' (cached)' if cached else ''}")
+    return output
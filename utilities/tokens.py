@@ -0,0 +1,74 @@
+import os
+import json
+from functools import lru_cache
+
+# Context window of the models we use, matched on the longest prefix of the model name
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo": 4096,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Share of the reader's context a scraped page may take before it gets summarized
+SCRAPE_PASSTHROUGH_SHARE = float(os.getenv("SCRAPE_PASSTHROUGH_SHARE", 0.15))
+# Share of the summary model's context used by one chunk, the rest is prompt & answer
+SUMMARY_CHUNK_SHARE = float(os.getenv("SUMMARY_CHUNK_SHARE", 0.5))
+# Chunks end on content-defined paragraph anchors, never below this share of the chunk size
+SUMMARY_CHUNK_MIN = float(os.getenv("SUMMARY_CHUNK_MIN", 0.1))
+
+def context_window(model):
+    for name in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+# Stand-in when tiktoken can't load its encoding (it downloads it on first use): one token per 3 bytes,
+# more than the real count for English text, so budgets stay on the safe side
+class ByteEstimate:
+    def encode(self, text, disallowed_special=()):
+        return range(-(-len(text.encode("utf-8")) // 3))
+
+# Building an encoder is slow, keep one per model for the life of the process
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Token encoding for {model} unavailable ({type(e).__name__}), estimating tokens from bytes")
+        return ByteEstimate()
+
+def count_tokens(text, model):
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def needs_summary(text, model):
+    limit = int(context_window(model) * SCRAPE_PASSTHROUGH_SHARE)
+    # Every token covers at least one byte, skip the encoding for short texts
+    if len(text.encode("utf-8")) <= limit:
+        return False
+    return count_tokens(text, model) > limit
+
+# Largest and smallest chunk in tokens for the map step of summary()
+def chunk_sizes(model):
+    chunk_size = int(context_window(model) * SUMMARY_CHUNK_SHARE)
+    return chunk_size, int(chunk_size * SUMMARY_CHUNK_MIN)
+
+# Prompt tokens of a chat request, with the usual per-message overhead of the chat format
+def count_message_tokens(messages, model):
+    total = 3
+    for message in messages:
+        total += 4
+        for key in ("content", "name"):
+            if isinstance(message.get(key), str):
+                total += count_tokens(message[key], model)
+        if message.get("function_call"):
+            total += count_tokens(json.dumps(message["function_call"]), model)
+    return total
@@ -1,28 +1,36 @@
 import os
 from dotenv import load_dotenv
 
+import asyncio
 import requests
-from bs4 import BeautifulSoup
 
 import json
-import http.client
-import base64
+import threading
+import contextlib
+import contextvars
 from datetime import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 
 import autogen
 from autogen import Agent, AssistantAgent, UserProxyAgent, config_list_from_json
-from langchain.prompts import PromptTemplate
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain.chains import LLMMathChain
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chat_models import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import SystemMessage
-
-import replicate
+
 import chainlit as cl
 
-from utilities.chainlit_helpers import ChainlitAssistantAgent, ChainlitUserProxyAgent
+from utilities.chainlit_helpers import ChainlitAssistantAgent, ChainlitUserProxyAgent, CompactingAssistantAgent
+from utilities.agents import AgentTemplate
+from utilities.speaker_selection import SelectiveGroupChat, get_speaker_selector
+from utilities.dispatch import in_background
+from utilities.cache import DiskCache, normalize_query, canonical_url
+from utilities.http_client import get_http_client, get_async_http_client
+from utilities.summarizer import map_reduce_summary, content_defined_chunks
+from utilities.extract import get_extractor, extract, charset, SCRAPE_READ_CHUNK
+from utilities.tokens import count_tokens, needs_summary, chunk_sizes
+from utilities.semantic_index import get_semantic_index
+from utilities.artifacts import get_artifact_store
+from utilities.context import context_report
+from utilities.tracing import traced_tool
+from utilities.ui_stream import post, post_message
 
 load_dotenv()
 browserless_api_key = os.getenv("BROWSERLESS_API_KEY")
@@ -34,6 +42,44 @@ BASE_GPT_MODEL = "gpt-3.5-turbo-16k"
 SUB_GPT_MODEL = "gpt-3.5-turbo"
 GLOBAL_TIMEOUT = int(os.getenv("GLOBAL_TIMEOUT"))
 
+# Search config, point SERPER_URL at a local stand-in server to run offline
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 24 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000))
+
+# Scrape config, cached pages older than the max age are revalidated against the origin
+BROWSERLESS_URL = os.getenv("BROWSERLESS_URL", "https://chrome.browserless.io/content")
+SCRAPE_CACHE_MAX_AGE = int(os.getenv("SCRAPE_CACHE_MAX_AGE", 6 * 60 * 60))
+SCRAPE_CACHE_MAX_BYTES = int(os.getenv("SCRAPE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+SCRAPE_CACHE_REVALIDATE_WINDOW = int(os.getenv("SCRAPE_CACHE_REVALIDATE_WINDOW", 7 * 24 * 60 * 60))
+# Validators come from a HEAD request to the origin, sent alongside the browserless fetch. 0 lets pages simply expire.
+SCRAPE_CACHE_REVALIDATE = os.getenv("SCRAPE_CACHE_REVALIDATE", "1") == "1"
+
+# Summary config, chunk summaries are memoized on model + prompt + chunk text
+SUMMARY_MODEL = "gpt-3.5-turbo-16k-0613"
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", 30 * 24 * 60 * 60))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", 20000))
+SUMMARY_MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", 4))
+SUMMARY_MAP_RETRIES = int(os.getenv("SUMMARY_MAP_RETRIES", 2))
+# Summary calls in flight across the process, scrape_many summarizes several pages at once
+SUMMARY_MAX_CONCURRENT = int(os.getenv("SUMMARY_MAX_CONCURRENT", 4))
+
+# Batch scrape config, pages are fetched concurrently with a limit per host
+SCRAPE_MANY_WORKERS = int(os.getenv("SCRAPE_MANY_WORKERS", 6))
+SCRAPE_MANY_PER_HOST = int(os.getenv("SCRAPE_MANY_PER_HOST", 2))
+SCRAPE_MANY_MAX_URLS = int(os.getenv("SCRAPE_MANY_MAX_URLS", 8))
+SCRAPE_MANY_MAX_CHARS = int(os.getenv("SCRAPE_MANY_MAX_CHARS", 24000))
+
+# Research config, reports are reused across sessions and agents for the same topic
+RESEARCH_CACHE_TTL = int(os.getenv("RESEARCH_CACHE_TTL", 7 * 24 * 60 * 60))
+RESEARCH_CACHE_MAX_ENTRIES = int(os.getenv("RESEARCH_CACHE_MAX_ENTRIES", 1000))
+# Reuse a report whose query shares this share of words with the new one, 0 disables it
+RESEARCH_CACHE_NEAR_MATCH = float(os.getenv("RESEARCH_CACHE_NEAR_MATCH", 0))
+# With SEMANTIC_CACHE=1 the opening of each report is indexed too. A question is further from a report
+# than from another question, so reports get their own, lower threshold.
+RESEARCH_REPORT_INDEX_CHARS = int(os.getenv("RESEARCH_REPORT_INDEX_CHARS", 2000))
+RESEARCH_REPORT_THRESHOLD = float(os.getenv("RESEARCH_REPORT_THRESHOLD", 0.8))
+
 
 RESEARCH_ADMIN = "Research Admin"
 RESEARCH_ASSISTANT = "Research Assistant"
@@ -42,6 +88,20 @@ WRITER = "Writer"
 REVIEWER = "Reviewer"
 EDITORIAL_ADMIN = "Editorial Admin"
 
+search_cache = DiskCache("search", ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+scrape_cache = DiskCache(
+    "scrape",
+    ttl=SCRAPE_CACHE_MAX_AGE,
+    max_bytes=SCRAPE_CACHE_MAX_BYTES,
+    grace=SCRAPE_CACHE_REVALIDATE_WINDOW,
+)
+summary_cache = DiskCache("summary", ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES)
+summary_llm = None
+summary_slots = threading.BoundedSemaphore(SUMMARY_MAX_CONCURRENT)
+research_cache = DiskCache("research", ttl=RESEARCH_CACHE_TTL, max_entries=RESEARCH_CACHE_MAX_ENTRIES)
+# Origin HEAD requests for the validators of freshly scraped pages run here, nobody waits for them
+validator_pool = ThreadPoolExecutor(max_workers=SCRAPE_MANY_WORKERS, thread_name_prefix="validators")
+
 config_list = config_list_from_json("OAI_CONFIG_LIST", filter_dict={"model": ["gpt-3.5-turbo-16k"]})
 
 llm_config = {
@@ -51,31 +111,160 @@ llm_config = {
     "request_timeout": GLOBAL_TIMEOUT,
 }
 
-# Search Function
-def search(query):
-    url = "https://google.serper.dev/search"
+def is_terminate(message):
+    return message.get("content", "") and message.get("content", "").rstrip().endswith("TERMINATE")
+
+# The semantic index is optional, a failing embedding call should never break a tool
+def semantic_match(name, text, **options):
+    index = get_semantic_index(name, **options)
+    if index is None:
+        return None
+    try:
+        match = index.match(text)
+    except Exception as e:
+        print("Semantic index lookup failed: ", e)
+        return None
+    if match is None:
+        return None
+    key, similarity = match
+    print(f"Semantic match for '{text}': {key} ({similarity:.2f})")
+    return key
+
+def semantic_add(name, text, key, **options):
+    index = get_semantic_index(name, **options)
+    if index is None:
+        return
+    try:
+        index.add(text, key)
+    except Exception as e:
+        print("Semantic index update failed: ", e)
 
+# Search Function
+def search_request(query, num):
     payload = json.dumps({
         "q": query,
-        "num": 10
+        "num": num
     })
 
     headers = {
         'X-API-KEY': serper_api_key,
         'Content-Type': 'application/json'
     }
+    return payload, headers
+
+def cached_search(query, num):
+    cached = search_cache.get(f"{normalize_query(query)}|{num}")
+    if cached is None:
+        # A query that means the same as an earlier one reuses its results
+        match = semantic_match("search_queries", query)
+        if match is not None and match.endswith(f"|{num}"):
+            cached = search_cache.get(match)
+    if cached is not None:
+        print('Search cache hit... ', query)
+    return cached
+
+def store_search(query, num, status_code, text):
+    # Only keep successful responses, errors should be retried on the next call
+    if status_code == 200:
+        search_cache.set(f"{normalize_query(query)}|{num}", text)
+        semantic_add("search_queries", query, f"{normalize_query(query)}|{num}")
+    # print(text)
+    return text
+
+@traced_tool
+def search(query, num=10):
+    cached = cached_search(query, num)
+    if cached is not None:
+        return cached
 
     print('Searching for... ', query)
+    payload, headers = search_request(query, num)
+    response = get_http_client().post(SERPER_URL, headers=headers, data=payload)
+    return store_search(query, num, response.status_code, response.text)
 
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    # print(response.text)
-    return response.text
-
-# Website Scrape Function
-def scrape(url: str):
-    print('Scraping website... ', url)
+@traced_tool
+async def asearch(query, num=10):
+    cached = cached_search(query, num)
+    if cached is not None:
+        return cached
 
+    print('Searching for... ', query)
+    payload, headers = search_request(query, num)
+    response = await get_async_http_client().post(SERPER_URL, headers=headers, content=payload)
+    return store_search(query, num, response.status_code, response.text)
+
+# Cache validators the origin supplies for a page
+def read_validators(headers):
+    return headers.get("ETag"), headers.get("Last-Modified")
+
+def conditional_headers(record):
+    headers = {}
+    if record.get("etag"):
+        headers["If-None-Match"] = record["etag"]
+    if record.get("last_modified"):
+        headers["If-Modified-Since"] = record["last_modified"]
+    return headers
+
+def is_not_modified(record, status_code, headers):
+    if status_code == 304:
+        return True
+    # Some servers ignore conditional HEAD requests, compare the validators instead
+    if status_code == 200:
+        etag, last_modified = read_validators(headers)
+        if record.get("etag") and etag == record["etag"]:
+            return True
+        if record.get("last_modified") and last_modified == record["last_modified"]:
+            return True
+    return False
+
+# Validators have to come from the origin, the browserless response carries browserless's own headers
+def fetch_validators(url):
+    if not SCRAPE_CACHE_REVALIDATE:
+        return None, None
+    try:
+        head = get_http_client().head(url, timeout=10, allow_redirects=True)
+    except requests.RequestException:
+        return None, None
+    return read_validators(head.headers) if head.status_code == 200 else (None, None)
+
+# Filled into the cached record once the origin answers, the scrape returns without waiting for it
+def fill_validators(url):
+    etag, last_modified = fetch_validators(url)
+    if not (etag or last_modified):
+        return
+    cache_key = canonical_url(url)
+    entry = scrape_cache.lookup(cache_key)
+    if entry is not None:
+        scrape_cache.update(cache_key, {**entry.value, "etag": etag, "last_modified": last_modified})
+
+def request_validators(url):
+    if SCRAPE_CACHE_REVALIDATE:
+        validator_pool.submit(contextvars.copy_context().run, fill_validators, url)
+
+# Ask the origin whether a cached page is still current
+def revalidate(url, record):
+    headers = conditional_headers(record)
+    if not SCRAPE_CACHE_REVALIDATE or not headers:
+        return False
+    try:
+        response = get_http_client().head(url, headers=headers, timeout=10, allow_redirects=True)
+    except requests.RequestException:
+        return False
+    return is_not_modified(record, response.status_code, response.headers)
+
+async def arevalidate(url, record):
+    import httpx
+
+    headers = conditional_headers(record)
+    if not SCRAPE_CACHE_REVALIDATE or not headers:
+        return False
+    try:
+        response = await get_async_http_client().head(url, headers=headers, timeout=10, follow_redirects=True)
+    except httpx.HTTPError:
+        return False
+    return is_not_modified(record, response.status_code, response.headers)
+
+def scrape_request(url):
     headers = {
         'Cache-Control': 'no-cache',
         'Content-Type': 'application/json',
@@ -83,59 +272,200 @@ def scrape(url: str):
 
     # Parse the data
     data = json.dumps({"url": url})
+    browserless_url = f"{BROWSERLESS_URL}?token={browserless_api_key}"
+    return browserless_url, headers, data
+
+# Content might be really long and hit the token limit of the researcher, we should summarize the text
+def page_summary(text, summarize):
+    if summarize and needs_summary(text, BASE_GPT_MODEL):
+        return summary(text)
+    return None
+
+def cached_page(url, entry, summarize=True):
+    cache_key = canonical_url(url)
+    if not entry.fresh:
+        scrape_cache.touch(cache_key)
+    scrape_cache.hits += 1
+    print('Scrape cache hit... ', url)
+    record = entry.value
+    if summarize and not record["summary"]:
+        # Cached by a call that didn't summarize, summarize now and keep it for the next hits
+        record = {**record, "summary": page_summary(record["text"], summarize)}
+        if record["summary"]:
+            scrape_cache.update(cache_key, record)
+    if not summarize:
+        return record["text"]
+    return record["summary"] or record["text"]
+
+# Summarize and cache the text of a page fetched through browserless.
+# Only the extracted text is kept: the page is read just until the text budget is full, so there is no complete HTML to store.
+def process_page(url, text, summarize=True):
+    print("Scraped content:", text)
+
+    record = {
+        "url": url,
+        "text": text,
+        "summary": page_summary(text, summarize),
+        "etag": None,
+        "last_modified": None,
+    }
+    scrape_cache.set(canonical_url(url), record)
+    request_validators(url)
+    return record["summary"] or record["text"]
 
-    # Send the POST request
-    browserless_url = f"https://chrome.browserless.io/content?token={browserless_api_key}"
-    response = requests.post(browserless_url, headers=headers, data=data)
-
-    if response.status_code == 200:
-         # Parse the HTML
-        soup = BeautifulSoup(response.content, 'html.parser')
-        text = soup.get_text()
-        print("Scraped content:", text)
-
-        # Content might be really long and hit the token limit, we should summarize the text
-        if len(text) > 10000:
-            output = summary(text)
-            return output
-        else:
-            return text
-    else:
-        print("HTTP request failed with status code {response.status_code}")
+# Website Scrape Function
+@traced_tool
+def scrape(url: str, summarize=True):
+    entry = scrape_cache.lookup(canonical_url(url))
+    if entry is not None and (entry.fresh or revalidate(url, entry.value)):
+        return cached_page(url, entry, summarize)
+    scrape_cache.misses += 1
 
+    print('Scraping website... ', url)
 
-# Summarise Function
-def summary(content):
-    # invoke chatGPT
-    llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo-16k-0613")
+    # Send the POST request, the page is parsed while it is read and the rest is dropped once the text budget is full
+    browserless_url, headers, data = scrape_request(url)
+    response = get_http_client().post(browserless_url, headers=headers, data=data, stream=True)
+
+    with response:
+        if response.status_code != 200:
+            print(f"HTTP request failed with status code {response.status_code}")
+            return None
+        extractor = get_extractor(encoding=charset(response.headers.get("Content-Type")))
+        text = extract(extractor, response.iter_content(SCRAPE_READ_CHUNK))
+    return process_page(url, text, summarize)
+
+@traced_tool
+async def ascrape(url: str, summarize=True):
+    entry = scrape_cache.lookup(canonical_url(url))
+    if entry is not None and (entry.fresh or await arevalidate(url, entry.value)):
+        # Summarizing blocks, keep it off the event loop
+        return await asyncio.to_thread(cached_page, url, entry, summarize)
+    scrape_cache.misses += 1
 
-    # Use LangChain text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n"], chunk_size=10000, chunk_overlap=500)
-    
-    documents = text_splitter.create_documents([content])
+    print('Scraping website... ', url)
 
-    # Reusable prompt for each content on the split chain
-    map_prompt = """
-    Summarize of the following text for research purpose:
-    "{text}"
-    SUMMARY:
-    """
+    text = await afetch_page_text(url)
+    if text is None:
+        return None
+    return await asyncio.to_thread(process_page, url, text, summarize)
+
+async def afetch_page_text(url):
+    browserless_url, headers, data = scrape_request(url)
+    async with get_async_http_client().stream("POST", browserless_url, headers=headers, content=data) as response:
+        if response.status_code != 200:
+            print(f"HTTP request failed with status code {response.status_code}")
+            return None
+        extractor = get_extractor(encoding=charset(response.headers.get("Content-Type")))
+        async for piece in response.aiter_bytes(SCRAPE_READ_CHUNK):
+            # Parsing blocks, keep it off the event loop
+            if await asyncio.to_thread(extractor.feed, piece):
+                break
+        return await asyncio.to_thread(extractor.text)
+
+
+# Size limit of every page, short pages keep all of their text and leave the rest of the budget to the long ones
+def page_budgets(lengths, max_chars):
+    budgets = [0] * len(lengths)
+    remaining = max_chars
+    by_length = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    for position, index in enumerate(by_length):
+        budgets[index] = min(lengths[index], remaining // (len(lengths) - position))
+        remaining -= budgets[index]
+    return budgets
+
+# Join the pages into one result within the size budget
+def combine_pages(urls, pages, max_chars):
+    texts = []
+    for page in pages:
+        if isinstance(page, Exception):
+            page = f"Failed to scrape: {page}"
+        texts.append(page or "No content could be scraped.")
+    sections = []
+    for url, text, budget in zip(urls, texts, page_budgets([len(text) for text in texts], max_chars)):
+        if len(text) > budget:
+            text = text[:budget] + "... [truncated]"
+        sections.append(f"## {url}\n{text}")
+    return "\n\n".join(sections)
+
+# Accept a list or a comma/newline separated string, drop duplicates by canonical URL
+def dedupe_urls(urls, max_urls):
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.replace(",", "\n").splitlines() if url.strip()]
+    unique = {}
+    for url in urls:
+        unique.setdefault(canonical_url(url), url)
+    return list(unique.values())[:max_urls]
+
+# Batch Scrape Function, fetches and summarizes several pages in one tool call
+@traced_tool
+def scrape_many(urls, summarize=True, max_chars=SCRAPE_MANY_MAX_CHARS):
+    urls = dedupe_urls(urls, SCRAPE_MANY_MAX_URLS)
+    print('Scraping websites... ', urls)
+    # One limit per host, created before any worker runs
+    host_limits = {host: threading.Semaphore(SCRAPE_MANY_PER_HOST) for host in {urlsplit(url).netloc for url in urls}}
+
+    def scrape_one(url):
+        with host_limits[urlsplit(url).netloc]:
+            try:
+                return scrape(url, summarize)
+            except Exception as e:
+                return e
+
+    # Each page is scraped in its own copy of the context, so its span nests under this call
+    contexts = [contextvars.copy_context() for _ in urls]
+    with ThreadPoolExecutor(max_workers=min(SCRAPE_MANY_WORKERS, max(len(urls), 1))) as executor:
+        pages = list(executor.map(lambda context, url: context.run(scrape_one, url), contexts, urls))
+    return combine_pages(urls, pages, max_chars)
+
+@traced_tool
+async def ascrape_many(urls, summarize=True, max_chars=SCRAPE_MANY_MAX_CHARS):
+    urls = dedupe_urls(urls, SCRAPE_MANY_MAX_URLS)
+    print('Scraping websites... ', urls)
+    workers = asyncio.Semaphore(SCRAPE_MANY_WORKERS)
+    host_limits = {host: asyncio.Semaphore(SCRAPE_MANY_PER_HOST) for host in {urlsplit(url).netloc for url in urls}}
+
+    async def scrape_one(url):
+        # Wait for the host first, a worker slot is only taken once the page can be fetched
+        async with host_limits[urlsplit(url).netloc], workers:
+            return await ascrape(url, summarize)
+
+    pages = await asyncio.gather(*[scrape_one(url) for url in urls], return_exceptions=True)
+    return combine_pages(urls, pages, max_chars)
 
-    map_prompt_template = PromptTemplate(template=map_prompt, input_variables=["text"])
-    
-    summary_chain = load_summarize_chain(
-        llm = llm,
-        chain_type = 'map_reduce',
-        map_prompt = map_prompt_template,
-        combine_prompt = map_prompt_template,
-        verbose = True
-    )
+# Summarise Function
+# langchain and replicate are imported on first use, most sessions never summarise or draw
+def get_summary_llm():
+    global summary_llm
+    if summary_llm is None:
+        from langchain.chat_models import ChatOpenAI
 
-    # Run the summary chain
-    output = summary_chain.run(input_documents=documents)
+        summary_llm = ChatOpenAI(temperature=0, model=SUMMARY_MODEL)
+    return summary_llm
 
-    return output
+def predict_summary(prompt):
+    with summary_slots:
+        return get_summary_llm().predict(prompt)
+
+@traced_tool
+def summary(content):
+    # Chunks are measured in tokens of the summary model and cut at content-defined paragraph anchors,
+    # so an edit only changes the chunks around it and the others are answered from the cache
+    chunk_size, min_chunk_size = chunk_sizes(SUMMARY_MODEL)
+    length = lambda text: count_tokens(text, SUMMARY_MODEL)
+    chunks = content_defined_chunks(content, chunk_size, length, min_chunk_size)
+
+    # Only chunks that were not summarized before are sent to chatGPT
+    return map_reduce_summary(
+        chunks,
+        complete=predict_summary,
+        model=SUMMARY_MODEL,
+        cache=summary_cache,
+        workers=SUMMARY_MAP_WORKERS,
+        retries=SUMMARY_MAP_RETRIES,
+        max_combine_tokens=chunk_size,
+        length=length,
+    )
 
 def get_image_name():
     image_count = cl.user_session.get("image_count")
@@ -148,74 +478,110 @@ def get_image_name():
 
     return f"image-{image_count}"
 
+IMAGE_MODEL = "stability-ai/sdxl:c221b2b8ef527988fb59bf24a8b97c4561f1c671f73bd389f866bfb27c061316"
+REVIEW_MODEL = "yorickvp/llava-13b:2facb4a474a0462c15041b78b1ad70952ea46b5ec6ad29583c0b29dbd4249591"
+# Generated images are saved here
+IMAGE_DIR = os.getenv("IMAGE_DIR", "./image")
+
+# Save a downloaded image and return the message shown in the UI
+def save_image(prompt, image_url, content):
+    # Save it with a filename based on the prompt and current time
+    current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+    # shortened_prompt = prompt[:50]
+
+    file = os.path.basename(image_url).replace(".png", "")
+    name = f"{file}_{current_time}"
+
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    filename = f"{IMAGE_DIR.rstrip('/')}/{name}.png"
+
+    cl.user_session.set(f"Generated image for '{prompt}': {image_url}", content)
+    cl.user_session.set("generated_image", name)
+
+    with open(filename, "wb") as file:
+        file.write(content)
+
+    elements = [
+        cl.Image(
+            content=content,
+            name=name,
+            display="inline",
+        )
+    ]
+    return filename, cl.Message(content=f"{name}.png", elements=elements)
+
 # Image generator
+@traced_tool
 def generate_image(prompt):
-    # Use the 'replicate' library to run an AI model for text-to-image generation
-    output = replicate.run(
-        "stability-ai/sdxl:c221b2b8ef527988fb59bf24a8b97c4561f1c671f73bd389f866bfb27c061316",
-        input={
-            "prompt": prompt
-        }
-    )
+    import replicate
 
-    if output and len(output) > 0:
-        # Get the image URL from the output
-        image_url = output[0]
-        print(f"Generated image for '{prompt}': {image_url}")
-
-        # Download the image and save it with a filename based on the prompt and current time
-        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        # shortened_prompt = prompt[:50]
-
-        # Download the image using 'requests' library and save it to a file
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            file = os.path.basename(image_url).replace(".png", "")
-            name = f"{file}_{current_time}"
-
-            if not os.path.exists("./image"):
-                os.mkdir("./image")
-            filename = f"./image/{name}.png"
-
-            cl.user_session.set(f"Generated image for '{prompt}': {image_url}", response.content)
-            cl.user_session.set("generated_image", name)
-
-            elements = [
-                cl.Image(
-                    content=response.content,
-                    name=name,
-                    display="inline",
-                )
-            ]
-            cl.run_sync(
-                cl.Message(content=f"{name}.png", elements=elements).send()
-            )
-            
+    # Use the 'replicate' library to run an AI model for text-to-image generation
+    image_url = generated_url(prompt, replicate.run(IMAGE_MODEL, input={"prompt": prompt}))
+    if image_url is None:
+        return "The image generation process was unsuccessful."
+    # Download the image through the shared HTTP client
+    return store_image(prompt, image_url, get_http_client().get(image_url))
 
-            with open(filename, "wb") as file:
-                file.write(response.content)
-            return f"Image saved as '{filename}'"
-        else:
-            return "The image could not be successfully downloaded and saved."
-    else:
+@traced_tool
+async def agenerate_image(prompt):
+    image_url = generated_url(prompt, await replicate_run(IMAGE_MODEL, input={"prompt": prompt}))
+    if image_url is None:
         return "The image generation process was unsuccessful."
+    return store_image(prompt, image_url, await get_async_http_client().get(image_url))
+
+# Shared by generate_image and agenerate_image, only the calls to replicate and the download differ
+def generated_url(prompt, output):
+    if not output:
+        return None
+    # Get the image URL from the output
+    image_url = output[0]
+    print(f"Generated image for '{prompt}': {image_url}")
+    return image_url
+
+def store_image(prompt, image_url, response):
+    if response.status_code != 200:
+        return "The image could not be successfully downloaded and saved."
+    filename, message = save_image(prompt, image_url, response.content)
+    post_message(message)
+    return f"Image saved as '{filename}'"
+
+# The image file is open for the duration of the model call only
+@contextlib.contextmanager
+def review_input(image_path, prompt):
+    with open(image_path, "rb") as image:
+        yield {
+            "image": image,
+            "prompt": f"Please provide a description of the image and then rate, on a scale of 1 to 10, how closely the image aligns with the provided description. {prompt}?",
+        }
 
 # Image reviewer
+@traced_tool
 def review_image(image_path, prompt):
-    # Use the 'replicate' library to run an AI model for image review
-    output = replicate.run(
-        "yorickvp/llava-13b:2facb4a474a0462c15041b78b1ad70952ea46b5ec6ad29583c0b29dbd4249591",
-        input={
-            "image": open(image_path, "rb"),
-            "prompt": f"Please provide a description of the image and then rate, on a scale of 1 to 10, how closely the image aligns with the provided description. {prompt}?",
-        }
-    )
+    import replicate
 
-    # Concatenate the output into a single string and return it
-    result = ""
-    for item in output:
-        result += item
-    return result
+    # Use the 'replicate' library to run an AI model for image review
+    with review_input(image_path, prompt) as input:
+        output = replicate.run(REVIEW_MODEL, input=input)
+        # Concatenate the output into a single string and return it
+        return "".join(output)
+
+@traced_tool
+async def areview_image(image_path, prompt):
+    with review_input(image_path, prompt) as input:
+        return "".join(await replicate_run(REVIEW_MODEL, input=input))
+
+# Older replicate clients have no async_run, fall back to a worker thread
+async def replicate_run(model, input):
+    import replicate
+
+    if not hasattr(replicate, "async_run"):
+        return await asyncio.to_thread(lambda: list(replicate.run(model, input=input)))
+
+    output = await replicate.async_run(model, input=input)
+    # Streaming models such as llava return an async iterator of tokens
+    if hasattr(output, "__aiter__"):
+        output = [item async for item in output]
+    return output
 
 # Researcher
 # def research(query):
@@ -261,59 +627,76 @@ def review_image(image_path, prompt):
 #     results = agent.run(query)
 #     return results
 
+# Editorial team of write_content, built once per process
+EDITOR_TEMPLATE = AgentTemplate(
+    CompactingAssistantAgent,
+    name="Editor",
+    system_message=f'''
+    Welcome, Senior Editor.
+    As a seasoned professional, you bring meticulous attention to detail, a deep appreciation for literary and cultural nuance, and a commitment to upholding the highest editorial standards. 
+    Your role is to craft the structure of a short blog post using the material from the Research Assistant. Use your experience to ensure clarity, coherence, and precision. 
+    Once structured, pass it to the Writer to pen the final piece.
+    ''',
+    llm_config=llm_config,
+)
+
+WRITER_TEMPLATE = AgentTemplate(
+    CompactingAssistantAgent,
+    name="Writer",
+    system_message=f'''
+    Welcome, Blogger.
+    Your task is to compose a short blog post using the structure given by the Editor and incorporating feedback from the Reviewer. 
+    Embrace stylistic minimalism: be clear, concise, and direct. 
+    Approach the topic from a journalistic perspective; aim to inform and engage the readers without adopting a sales-oriented tone. 
+    After two rounds of revisions, conclude your post with "TERMINATE".
+    ''',
+    llm_config=llm_config,
+)
+
+REVIEWER_TEMPLATE = AgentTemplate(
+    CompactingAssistantAgent,
+    name="Reviewer",
+    system_message=f'''
+    As a distinguished blog content critic, you are known for your discerning eye, deep literary and cultural understanding, and an unwavering commitment to editorial excellence. 
+    Your role is to meticulously review and critique the written blog, ensuring it meets the highest standards of clarity, coherence, and precision. 
+    Provide invaluable feedback to the Writer to elevate the piece. After two rounds of content iteration, conclude with "TERMINATE".
+    ''',        
+    llm_config=llm_config,
+)
+
+EDITORIAL_ADMIN_TEMPLATE = AgentTemplate(
+    ChainlitUserProxyAgent,
+    name="Editorial_Admin",
+    system_message="A human admin. Interact with editor to discuss the structure. Actual writing needs to be approved by this admin.",
+    code_execution_config=False,
+    is_termination_msg=is_terminate,
+    human_input_mode="TERMINATE",
+)
+
 # Define write content function
+@traced_tool
 def write_content(research_material, topic):
-    editor = AssistantAgent(
-        name="Editor",
-        system_message=f'''
-        Welcome, Senior Editor.
-        As a seasoned professional, you bring meticulous attention to detail, a deep appreciation for literary and cultural nuance, and a commitment to upholding the highest editorial standards. 
-        Your role is to craft the structure of a short blog post using the material from the Research Assistant. Use your experience to ensure clarity, coherence, and precision. 
-        Once structured, pass it to the Writer to pen the final piece.
-        ''',
-        llm_config=llm_config,
-    )
+    # The research usually arrives as an artifact handle, the writers need the full report
+    research_material = get_artifact_store().resolve(research_material)
 
-    writer = AssistantAgent(
-        name="Writer",
-        system_message=f'''
-        Welcome, Blogger.
-        Your task is to compose a short blog post using the structure given by the Editor and incorporating feedback from the Reviewer. 
-        Embrace stylistic minimalism: be clear, concise, and direct. 
-        Approach the topic from a journalistic perspective; aim to inform and engage the readers without adopting a sales-oriented tone. 
-        After two rounds of revisions, conclude your post with "TERMINATE".
-        ''',
-        llm_config=llm_config,
-    )
-
-    reviewer = AssistantAgent(
-        name="Reviewer",
-        system_message=f'''
-        As a distinguished blog content critic, you are known for your discerning eye, deep literary and cultural understanding, and an unwavering commitment to editorial excellence. 
-        Your role is to meticulously review and critique the written blog, ensuring it meets the highest standards of clarity, coherence, and precision. 
-        Provide invaluable feedback to the Writer to elevate the piece. After two rounds of content iteration, conclude with "TERMINATE".
-        ''',        
-        llm_config=llm_config,
-    )
-
-    editorial_admin = ChainlitUserProxyAgent(
-        name="Editorial_Admin",
-        system_message="A human admin. Interact with editor to discuss the structure. Actual writing needs to be approved by this admin.",
-        code_execution_config=False,
-        is_termination_msg=lambda x: x.get("content", "") and x.get(
-            "content", "").rstrip().endswith("TERMINATE"),
-        human_input_mode="TERMINATE",
-    )
+    editor = EDITOR_TEMPLATE.instance()
+    writer = WRITER_TEMPLATE.instance()
+    reviewer = REVIEWER_TEMPLATE.instance()
+    editorial_admin = EDITORIAL_ADMIN_TEMPLATE.instance()
+    # Dispatched in the background, the admin would ask the user while the main chat is asking too
+    if in_background.get():
+        editorial_admin.human_input_mode = "NEVER"
 
     cl.user_session.set(EDITOR, editor)
     cl.user_session.set(WRITER, writer)
     cl.user_session.set(REVIEWER, reviewer)
     cl.user_session.set(EDITORIAL_ADMIN, editorial_admin)
 
-    editorial_team = autogen.GroupChat(
+    editorial_team = SelectiveGroupChat(
         agents=[editorial_admin, editor, writer, reviewer],
         messages=[],
-        max_round=10)
+        max_round=10,
+        speaker_selector=get_speaker_selector())
     
     manager = autogen.GroupChatManager(groupchat=editorial_team, llm_config=llm_config)
 
@@ -321,69 +704,145 @@ def write_content(research_material, topic):
 
     editorial_admin.stop_reply_at_receive(manager)
     editorial_admin.send("Give me the blog that just generated again, return ONLY the blog, and add TERMINATE in the end of the message", manager)
+    print("Editorial speaker selection: ", editorial_team.selection_stats.summary())
+    print("Editorial context: ", context_report(editorial_team.agents, manager))
 
     # return the last message the expert received
     return editorial_admin.last_message()["content"]
 
+# Closest stored research query by word overlap
+def near_match_research(key, threshold):
+    words = set(key.split())
+    best, best_score = None, 0
+    for candidate in research_cache.keys(limit=500):
+        other = set(candidate.split())
+        score = len(words & other) / max(len(words | other), 1)
+        if score > best_score:
+            best, best_score = candidate, score
+    if best is not None and best_score >= threshold:
+        return best
+    return None
+
+def cached_research(query):
+    key = normalize_query(query)
+    record = research_cache.get(key)
+    if record is None and RESEARCH_CACHE_NEAR_MATCH:
+        match = near_match_research(key, RESEARCH_CACHE_NEAR_MATCH)
+        if match is not None:
+            record = research_cache.get(match)
+    if record is None:
+        match = semantic_match("research_queries", query)
+        if match is not None:
+            record = research_cache.get(match)
+    if record is None:
+        match = semantic_match("research_reports", query, threshold=RESEARCH_REPORT_THRESHOLD)
+        if match is not None:
+            record = research_cache.get(match)
+    return record
+
 # Define research function
+@traced_tool
 def research(query):
-    llm_config_researcher = {
-        "functions": [
-            {
-                "name": "search",
-                "description": "Google search for relevant information",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Google search query",
-                        }
-                    },
-                    "required": ["query"],
+    record = cached_research(query)
+    if record is not None:
+        age = int((datetime.now().timestamp() - record["created_at"]) / 60)
+        print('Research cache hit... ', query)
+        post(f'*Research for "{query}" served from cache (researched {age} min ago as "{record["query"]}")*', "Research_Admin")
+        return get_artifact_store().reference("research", record["report"])
+
+    report = run_research(query)
+    if report:
+        research_cache.set(normalize_query(query), {
+            "query": query,
+            "report": report,
+            "created_at": datetime.now().timestamp(),
+        })
+        semantic_add("research_queries", query, normalize_query(query))
+        semantic_add("research_reports", report[:RESEARCH_REPORT_INDEX_CHARS], normalize_query(query),
+                     threshold=RESEARCH_REPORT_THRESHOLD)
+    # The group chat gets a handle and a preview, write_content reads the full report
+    return get_artifact_store().reference("research", report)
+
+# Research sub-chat of run_research, built once per process
+RESEARCHER_LLM_CONFIG = {
+    "functions": [
+        {
+            "name": "search",
+            "description": "Google search for relevant information",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Google search query",
+                    }
                 },
+                "required": ["query"],
             },
-            {
-                "name": "scrape",
-                "description": "Scraping website content based on url",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "url": {
-                            "type": "string",
-                            "description": "Website url to scrape",
-                        }
-                    },
-                    "required": ["url"],
+        },
+        {
+            "name": "scrape",
+            "description": "Scraping website content based on url",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "Website url to scrape",
+                    }
                 },
+                "required": ["url"],
             },
-        ],
-        "config_list": config_list,
-        "temperature": 0,
-        "retry_wait_time": 30,
-        "request_timeout": GLOBAL_TIMEOUT,
-    }
+        },
+        {
+            "name": "scrape_many",
+            "description": "Scraping several websites at once, returns the content of every url in one result",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "urls": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": f"Website urls to scrape, up to {SCRAPE_MANY_MAX_URLS}",
+                    }
+                },
+                "required": ["urls"],
+            },
+        },
+    ],
+    "config_list": config_list,
+    "temperature": 0,
+    "retry_wait_time": 30,
+    "request_timeout": GLOBAL_TIMEOUT,
+}
 
-    research_assistant = ChainlitAssistantAgent(
-        name="Research_Assistant",
-        system_message=f'''
-        As the Research Assistant your task is to research the provided query extensively. 
-        Produce a detailed report, ensuring you include technical specifics and reference all sources. Conclude your report with "TERMINATE".
-        ''',
-        llm_config=llm_config_researcher,
-    )
+RESEARCH_ASSISTANT_TEMPLATE = AgentTemplate(
+    ChainlitAssistantAgent,
+    name="Research_Assistant",
+    system_message=f'''
+    As the Research Assistant your task is to research the provided query extensively. 
+    When a search returns several relevant links, read them together with scrape_many instead of scraping one url at a time.
+    Produce a detailed report, ensuring you include technical specifics and reference all sources. Conclude your report with "TERMINATE".
+    ''',
+    llm_config=RESEARCHER_LLM_CONFIG,
+)
+
+RESEARCH_ADMIN_TEMPLATE = AgentTemplate(
+    ChainlitUserProxyAgent,
+    name="Research_Admin",
+    code_execution_config=False,
+    is_termination_msg=is_terminate,
+    human_input_mode="TERMINATE",
+    function_map={
+        "search": search,
+        "scrape": scrape,
+        "scrape_many": scrape_many,
+    }
+)
 
-    research_admin = ChainlitUserProxyAgent(
-        name="Research_Admin",
-        code_execution_config=False,
-        is_termination_msg=lambda x: x.get("content", "") and x.get(
-            "content", "").rstrip().endswith("TERMINATE"),
-        human_input_mode="TERMINATE",
-        function_map={
-            "search": search,
-            "scrape": scrape,
-        }
-    )
+def run_research(query):
+    research_assistant = RESEARCH_ASSISTANT_TEMPLATE.instance()
+    research_admin = RESEARCH_ADMIN_TEMPLATE.instance()
 
     cl.user_session.set(RESEARCH_ADMIN, research_admin)
     cl.user_session.set(RESEARCH_ASSISTANT, research_assistant)
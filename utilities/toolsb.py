@@ -23,6 +23,9 @@ from langchain.utilities import GoogleSearchAPIWrapper
 
 import replicate
 
+from utilities.cache import DiskCache, normalize_query
+from utilities.http_client import get_http_client
+
 load_dotenv()
 browserless_api_key = os.getenv("BROWSERLESS_API_KEY")
 serper_api_key = os.getenv("SERP_API_KEY")
@@ -32,13 +35,24 @@ PRO_GPT_MODEL = os.getenv("PRO_GPT_MODEL")
 BASE_GPT_MODEL = os.getenv("BASE_GPT_MODEL")
 SUB_GPT_MODEL = os.getenv("SUB_GPT_MODEL")
 
+# Search config, point SERPER_URL at a local stand-in server to run offline
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 24 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000))
+
+search_cache = DiskCache("search", ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+
 # Search Function
-def search(query):
-    url = "https://google.serper.dev/search"
+def search(query, num=10):
+    cache_key = f"{normalize_query(query)}|{num}"
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        print('Search cache hit... ', query)
+        return cached
 
     payload = json.dumps({
         "q": query,
-        "num": 10
+        "num": num
     })
 
     headers = {
@@ -48,7 +62,11 @@ def search(query):
 
     print('Searching for... ', query)
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = get_http_client().post(SERPER_URL, headers=headers, data=payload)
+
+    # Only keep successful responses, errors should be retried on the next call
+    if response.status_code == 200:
+        search_cache.set(cache_key, response.text)
 
     # print(response.text)
     return response.text
@@ -67,7 +85,7 @@ def scrape(url: str):
 
     # Send the POST request
     browserless_url = f"https://chrome.browserless.io/content?token={browserless_api_key}"
-    response = requests.post(browserless_url, headers=headers, data=data)
+    response = get_http_client().post(browserless_url, headers=headers, data=data)
 
     if response.status_code == 200:
          # Parse the HTML
@@ -149,7 +167,7 @@ def generate_image(prompt):
         # shortened_prompt = prompt[:50]
 
         # Download the image using 'requests' library and save it to a file
-        response = requests.get(image_url)
+        response = get_http_client().get(image_url)
         if response.status_code == 200:
             file = os.path.basename(image_url).replace(".png", "")
             name = f"{file}_{current_time}"
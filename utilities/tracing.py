@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import secrets
+import asyncio
+import threading
+import functools
+import contextvars
+from collections import defaultdict
+
+from utilities.completion_hooks import add_completion_hook
+
+# Spans per task, agent turn, model call and tool call, exported as OTLP/JSON (one ExportTraceServiceRequest per line,
+# the OpenTelemetry collector's file exporter format) and summed up in a live panel in the UI
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_PATH = os.getenv("TRACE_PATH", "./logs/traces.jsonl")
+# The panel is redrawn at most this often while a task runs
+TRACE_PANEL_INTERVAL = float(os.getenv("TRACE_PANEL_INTERVAL", 2))
+SERVICE_NAME = "cc-media-agency"
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+def now_ns():
+    return time.time_ns()
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class Span:
+    def __init__(self, trace, name, parent=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = now_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def seconds(self):
+        return ((self.end_ns or now_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.end_ns is None:
+            self.end_ns = now_ns()
+            self.error = error
+            self.trace.finish(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or now_ns()),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items() if value is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+    # The agent whose turn this span belongs to, or the tool whose sub-chat agents are not traced themselves
+    def owner(self):
+        span = self
+        while span is not None:
+            if "agent.name" in span.attributes:
+                return span.attributes["agent.name"]
+            if "tool.name" in span.attributes:
+                return f"{span.attributes['tool.name']} sub-chat"
+            span = span.trace.spans_by_id.get(span.parent_id)
+        return "other"
+
+# Spans of one task and their totals per agent and per tool
+class Trace:
+    def __init__(self, name, attributes=None, on_update=None):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self.spans_by_id = {}
+        self.on_update = on_update
+        self.rounds = 0
+        self.llm = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "cache_hits": 0})
+        self.tools = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "errors": 0})
+        self._lock = threading.Lock()
+        self.root = self.start(name, None, attributes)
+
+    def start(self, name, parent, attributes=None):
+        span = Span(self, name, parent, attributes)
+        with self._lock:
+            self.spans_by_id[span.span_id] = span
+        return span
+
+    def finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if span.name == "round":
+                self.rounds += 1
+            elif span.name.startswith("llm "):
+                totals = self.llm[span.owner()]
+                totals["calls"] += 1
+                totals["seconds"] += span.seconds
+                totals["input_tokens"] += span.attributes.get("gen_ai.usage.input_tokens", 0)
+                totals["output_tokens"] += span.attributes.get("gen_ai.usage.output_tokens", 0)
+                totals["cost"] += span.attributes.get("llm.cost_usd", 0.0)
+                totals["cache_hits"] += int(span.attributes.get("llm.cache_hit", False))
+            elif span.name.startswith("tool "):
+                totals = self.tools[span.attributes.get("tool.name")]
+                totals["calls"] += 1
+                totals["seconds"] += span.seconds
+                totals["errors"] += int(span.error is not None)
+        if self.on_update and span is not self.root:
+            self.on_update(self)
+
+    def totals(self):
+        with self._lock:
+            llm = {agent: dict(values) for agent, values in self.llm.items()}
+            tools = {tool: dict(values) for tool, values in self.tools.items()}
+        return {
+            "seconds": self.root.seconds,
+            "rounds": self.rounds,
+            "llm_calls": sum(values["calls"] for values in llm.values()),
+            "tokens": sum(values["input_tokens"] + values["output_tokens"] for values in llm.values()),
+            "cost": sum(values["cost"] for values in llm.values()),
+            "llm": llm,
+            "tools": tools,
+        }
+
+    def summary(self):
+        totals = self.totals()
+        agents = ", ".join(
+            f"{agent} {values['calls']} calls {values['seconds']:.1f}s {values['input_tokens'] + values['output_tokens']} tokens"
+            for agent, values in sorted(totals["llm"].items(), key=lambda item: -item[1]["seconds"])
+        )
+        tools = ", ".join(
+            f"{tool} x{values['calls']} {values['seconds']:.1f}s"
+            for tool, values in sorted(totals["tools"].items(), key=lambda item: -item[1]["seconds"])
+        )
+        return (f"{totals['seconds']:.1f}s, {totals['rounds']} rounds, {totals['llm_calls']} model calls, "
+                f"{totals['tokens']} tokens, ${totals['cost']:.4f} | agents: {agents or 'none'} | tools: {tools or 'none'}")
+
+    def to_otlp(self):
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": otlp_value(SERVICE_NAME)}]},
+            "scopeSpans": [{"scope": {"name": "utilities.tracing"}, "spans": spans}],
+        }]}
+
+_export_lock = threading.Lock()
+
+def export(trace, path=TRACE_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(trace.to_otlp())
+    with _export_lock:
+        with open(path, "a") as file:
+            file.write(line + "\n")
+
+# Starts a span under the current one, without a trace running nothing is recorded
+class span:
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        parent = current_span.get()
+        if parent is None:
+            return None
+        self.span = parent.trace.start(self.name, parent, self.attributes)
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, kind, error, traceback):
+        if self.span is not None:
+            current_span.reset(self.token)
+            self.span.end(f"{kind.__name__}: {error}" if kind else None)
+
+# Root span of a task, exported once the task is done
+class trace:
+    def __init__(self, name, on_update=None, path=TRACE_PATH, **attributes):
+        self.trace = Trace(name, attributes, on_update) if TRACING else None
+        self.path = path
+        self.token = None
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.token = current_span.set(self.trace.root)
+        return self.trace
+
+    def __exit__(self, kind, error, traceback):
+        if self.trace is None:
+            return
+        current_span.reset(self.token)
+        self.trace.root.end(f"{kind.__name__}: {error}" if kind else None)
+        try:
+            export(self.trace, self.path)
+        except OSError as e:
+            print("Trace export failed: ", e)
+
+# Tool call span around a function, sync or async
+def traced_tool(function):
+    name = function.__name__
+    # The async variants (asearch, ascrape...) are reported under the tool name
+    if asyncio.iscoroutinefunction(function) and name.startswith("a"):
+        name = name[1:]
+
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def traced_async(*args, **kwargs):
+            with span(f"tool {name}", **{"tool.name": name}):
+                return await function(*args, **kwargs)
+        return traced_async
+
+    @functools.wraps(function)
+    def traced(*args, **kwargs):
+        with span(f"tool {name}", **{"tool.name": name}):
+            return function(*args, **kwargs)
+    return traced
+
+def model_name(params, response):
+    if isinstance(response, dict) and response.get("model"):
+        return response["model"]
+    if params.get("config_list"):
+        return params["config_list"][0].get("model")
+    return params.get("model")
+
+# Model call span, a completion hook (utilities/completion_hooks.py) installed after the completion cache to see its hits
+def traced_create(create, **params):
+    with span("llm chat", **{"gen_ai.system": "openai", "gen_ai.request.model": model_name(params, None)}) as llm_span:
+        response = create(**params)
+        if llm_span is not None and isinstance(response, dict):
+            usage = response.get("usage", {})
+            model = model_name(params, response)
+            llm_span.name = f"llm {model}"
+            llm_span.set(**{
+                "gen_ai.response.model": model,
+                "gen_ai.usage.input_tokens": usage.get("prompt_tokens", 0),
+                "gen_ai.usage.output_tokens": usage.get("completion_tokens", 0),
+                "llm.cost_usd": float(response.get("cost", 0)),
+                "llm.cache_hit": bool(response.get("cached", False)),
+                "llm.functions": len(params.get("functions") or []),
+            })
+        return response
+
+def install_llm_tracing():
+    if TRACING:
+        add_completion_hook(traced_create)
+
+# Live cost/latency panel of a task, a Chainlit TaskList redrawn from the trace totals
+class TracePanel:
+    def __init__(self, session_cost=0.0, interval=TRACE_PANEL_INTERVAL):
+        self.session_cost = session_cost
+        self.interval = interval
+        self.task_list = None
+        self.last_update = 0.0
+        self._lock = threading.Lock()
+
+    def tasks(self, trace, done=False):
+        import chainlit as cl
+
+        totals = trace.totals()
+        status = cl.TaskStatus.DONE if done else cl.TaskStatus.RUNNING
+        tasks = [cl.Task(
+            title=f"{totals['seconds']:.1f}s, {totals['rounds']} rounds, {totals['llm_calls']} model calls, "
+                  f"{totals['tokens']:,} tokens, ${totals['cost']:.4f} (session ${self.session_cost + totals['cost']:.4f})",
+            status=status,
+        )]
+        for agent, values in sorted(totals["llm"].items(), key=lambda item: -item[1]["seconds"]):
+            cached = f", {values['cache_hits']} cached" if values["cache_hits"] else ""
+            tasks.append(cl.Task(
+                title=f"{agent}: {values['calls']} calls{cached}, {values['seconds']:.1f}s, "
+                      f"{values['input_tokens'] + values['output_tokens']:,} tokens, ${values['cost']:.4f}",
+                status=status,
+            ))
+        for tool, values in sorted(totals["tools"].items(), key=lambda item: -item[1]["seconds"]):
+            errors = f", {values['errors']} failed" if values["errors"] else ""
+            tasks.append(cl.Task(title=f"{tool}: {values['calls']} calls{errors}, {values['seconds']:.1f}s", status=status))
+        return tasks
+
+    async def show(self, trace, done=False):
+        import chainlit as cl
+
+        if self.task_list is None:
+            self.task_list = cl.TaskList()
+        self.task_list.status = "Done" if done else "Running..."
+        self.task_list.tasks = self.tasks(trace, done)
+        await self.task_list.send()
+
+    # Trace callback, redraws now and then. Spans mostly end on worker threads, async tools end them on the event loop.
+    def update(self, trace):
+        import chainlit as cl
+        from utilities.ui_stream import current_stream
+
+        with self._lock:
+            if time.monotonic() - self.last_update < self.interval:
+                return
+            self.last_update = time.monotonic()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            stream = current_stream()
+            # With a UI stream the redraw is scheduled on its loop and the worker doesn't wait for it
+            if stream is not None:
+                asyncio.run_coroutine_threadsafe(self.show(trace), stream.loop)
+                return
+            try:
+                cl.run_sync(self.show(trace))
+            except Exception as e:
+                print("Trace panel update failed: ", e)
+            return
+        asyncio.ensure_future(self.show(trace))
@@ -0,0 +1,145 @@
+import os
+import asyncio
+
+import chainlit as cl
+
+# Agents hand their messages to a per-session queue and carry on, a task on the event loop delivers them in order.
+# UI_STREAM=0 sends every message from the agent's thread and waits for the round trip, like before.
+UI_STREAM = os.getenv("UI_STREAM", "1") == "1"
+# Messages arriving within this many seconds of each other are delivered together
+UI_STREAM_COALESCE = float(os.getenv("UI_STREAM_COALESCE", 0.05))
+# Consecutive messages of one author in a batch are merged into one UI message up to this size.
+# This changes how the transcript looks, UI_STREAM_MERGE=0 keeps every message on its own.
+UI_STREAM_MERGE = os.getenv("UI_STREAM_MERGE", "1") == "1"
+UI_STREAM_MAX_CHARS = int(os.getenv("UI_STREAM_MAX_CHARS", 20000))
+SESSION_KEY = "ui_stream"
+
+class UIStream:
+    def __init__(self, loop, coalesce=UI_STREAM_COALESCE, merge=UI_STREAM_MERGE, max_chars=UI_STREAM_MAX_CHARS):
+        self.loop = loop
+        self.coalesce = coalesce
+        self.merge = merge
+        self.max_chars = max_chars
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.posted = 0
+        self.sent = 0
+        self.failed = 0
+
+    # Thread safe and never blocks, the item is queued on the event loop
+    def post(self, item):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._enqueue(item)
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item):
+        self.posted += 1
+        self.queue.put_nowait(item)
+        # The task ends once the queue is empty, so idle sessions hold no task
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._deliver())
+
+    async def _deliver(self):
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait()]
+            if self.coalesce:
+                await asyncio.sleep(self.coalesce)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for message in self.coalesced(batch):
+                try:
+                    await message.send()
+                    self.sent += 1
+                except Exception as e:
+                    self.failed += 1
+                    print("UI message failed: ", e)
+            for _ in batch:
+                self.queue.task_done()
+
+    # Text items are (author, content), anything else is a prepared cl.Message sent as is
+    def coalesced(self, batch):
+        messages = []
+        author, parts = None, []
+        for item in batch + [None]:
+            if self.merge and isinstance(item, tuple) and parts and item[0] == author \
+                    and sum(len(part) for part in parts) + len(item[1]) <= self.max_chars:
+                parts.append(item[1])
+                continue
+            if parts:
+                messages.append(cl.Message(content="\n\n".join(parts), author=author))
+                author, parts = None, []
+            if isinstance(item, tuple):
+                author, parts = item[0], [item[1]]
+            elif item is not None:
+                messages.append(item)
+        return messages
+
+    # Waits until everything posted so far is in the UI
+    async def drain(self):
+        await self.queue.join()
+
+    def summary(self):
+        return f"{self.posted} messages posted, {self.sent} sent, {self.failed} failed"
+
+# Starts the stream of the current session, call on the event loop (from an on_message handler)
+def start_ui_stream():
+    if not UI_STREAM:
+        return None
+    stream = cl.user_session.get(SESSION_KEY)
+    if stream is None or stream.loop is not asyncio.get_running_loop():
+        stream = UIStream(asyncio.get_running_loop())
+        cl.user_session.set(SESSION_KEY, stream)
+    return stream
+
+def current_stream():
+    try:
+        return cl.user_session.get(SESSION_KEY)
+    except Exception:
+        return None
+
+# Sends scheduled on the event loop, kept until they are done so they aren't garbage collected
+scheduled_sends = set()
+
+# Without a stream the message is sent right away: a worker thread waits for the round trip,
+# code already on the event loop can't block it and schedules the send instead
+def send_now(message):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        cl.run_sync(message.send())
+        return
+    task = asyncio.ensure_future(message.send())
+    scheduled_sends.add(task)
+    task.add_done_callback(scheduled_sends.discard)
+
+# Shows a text message from any thread without waiting for it
+def post(content, author):
+    stream = current_stream()
+    if stream is None:
+        send_now(cl.Message(content=content, author=author))
+        return
+    stream.post((author, content))
+
+# Same for a prepared message, e.g. one with elements
+def post_message(message):
+    stream = current_stream()
+    if stream is None:
+        send_now(message)
+        return
+    stream.post(message)
+
+# Blocks a worker thread until the queued messages are shown, e.g. before asking the user something
+def drain_sync():
+    stream = current_stream()
+    if stream is not None:
+        cl.run_sync(stream.drain())
+
+async def drain():
+    stream = current_stream()
+    if stream is not None:
+        await stream.drain()
@@ -0,0 +1,41 @@
+import os
+import time
+import threading
+import importlib
+
+from utilities.tokens import get_encoding
+
+# Import heavy dependencies in the background once the server is up, so the first session that
+# summarises, draws or answers from the knowledge base doesn't pay for them
+WARM_START = os.getenv("WARM_START", "0") == "1"
+WARM_MODULES = (
+    "httpx",
+    "tiktoken",
+    "langchain.chat_models",
+    "langchain.text_splitter",
+    "replicate",
+    "chromadb",
+)
+
+def warm(modules=WARM_MODULES, model="gpt-3.5-turbo-16k"):
+    start = time.perf_counter()
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"Warm start: could not import {name} ({e})")
+    # Encoder files are downloaded and parsed on first use
+    try:
+        get_encoding(model)
+    except Exception as e:
+        print(f"Warm start: could not load the {model} encoder ({e})")
+    print(f"Warm start done in {time.perf_counter() - start:.2f}s")
+
+warm_thread = None
+
+def prewarm(modules=WARM_MODULES):
+    global warm_thread
+    if warm_thread is None:
+        warm_thread = threading.Thread(target=warm, args=(modules,), name="prewarm", daemon=True)
+        warm_thread.start()
+    return warm_thread
@@ -0,0 +1,87 @@
+import os
+import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Opt-in: known task types run as a workflow of stages instead of a free-form group chat, by default every task chats
+WORKFLOW_MODE = os.getenv("WORKFLOW_MODE", "0") == "1"
+WORKFLOW_WORKERS = int(os.getenv("WORKFLOW_WORKERS", 4))
+
+CONTENT_WORDS = r"\b(blog|article|post|copy|newsletter|caption)s?\b"
+IMAGE_WORDS = r"\b(image|visual|picture|illustration|poster|graphic|artwork)s?\b"
+
+# Task type -> patterns that must all match the task, the first matching type wins
+TASK_TYPES = [
+    ("content_with_image", [CONTENT_WORDS, IMAGE_WORDS]),
+    ("content", [CONTENT_WORDS]),
+    ("image", [IMAGE_WORDS]),
+]
+
+def classify_task(task, task_types=TASK_TYPES):
+    text = task.casefold()
+    for task_type, patterns in task_types:
+        if all(re.search(pattern, text) for pattern in patterns):
+            return task_type
+    return None
+
+# One step of a workflow: a function called with the named inputs, its result is stored under the stage name
+class Stage:
+    def __init__(self, name, run, inputs=()):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+
+# DAG of stages, a stage starts as soon as all of its inputs are available so independent stages run concurrently
+class Workflow:
+    def __init__(self, name, stages, inputs=("task", "topic")):
+        self.name = name
+        self.stages = stages
+        self.inputs = tuple(inputs)
+        self.order = self._check()
+
+    # Unknown inputs and cycles are configuration errors, catch them when the workflow is declared
+    def _check(self):
+        names = [stage.name for stage in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Workflow {self.name} has duplicate stage names")
+        available, order, remaining = set(self.inputs), [], list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if set(stage.inputs) <= available]
+            if not ready:
+                missing = {stage.name: sorted(set(stage.inputs) - available) for stage in remaining}
+                raise ValueError(f"Workflow {self.name} has unknown inputs or a cycle: {missing}")
+            for stage in ready:
+                remaining.remove(stage)
+                available.add(stage.name)
+                order.append(stage.name)
+        return order
+
+    def run_stage(self, stage, results, progress):
+        start = time.perf_counter()
+        if progress:
+            progress(f"Stage {stage.name} started")
+        output = stage.run(**{name: results[name] for name in stage.inputs})
+        elapsed = time.perf_counter() - start
+        if progress:
+            progress(f"Stage {stage.name} done in {elapsed:.1f}s")
+        return output, elapsed
+
+    # Returns the inputs plus the output of every stage, and the seconds spent in each stage
+    def run(self, inputs, workers=WORKFLOW_WORKERS, progress=print):
+        results = dict(inputs)
+        timings = {}
+        pending = list(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for stage in [stage for stage in pending if all(name in results for name in stage.inputs)]:
+                    pending.remove(stage)
+                    # Tools read the Chainlit session from context variables, every thread gets its own copy
+                    context = contextvars.copy_context()
+                    running[pool.submit(context.run, self.run_stage, stage, results, progress)] = stage
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    results[stage.name], timings[stage.name] = future.result()
+        return results, timings